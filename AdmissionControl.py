@@ -0,0 +1,108 @@
+import collections, contextlib, threading, time
+
+# latency histograms and the /metrics route
+import Metrics
+
+
+# caps the number of logins doing the expensive work (roster and feedback lookups, the pass code
+# email, the login record) at the same time. The others wait in a FIFO queue and are admitted in
+# the order they arrived as slots free up, so a burst is worked off at a steady rate instead of
+# every session slowing down together. The queue is per process
+class AdmissionController:
+    def __init__(self, max_in_flight=8, poll_seconds=0.5):
+        self.max_in_flight = max_in_flight
+        self.poll_seconds = poll_seconds
+        self.condition = threading.Condition()
+        self.waiting = collections.deque()
+        self.in_flight = 0
+        self.counters = {"admitted": 0, "abandoned": 0}
+        Metrics.registerCollector(self.collect)
+
+    # the ticket is admitted when it is first in the queue and a slot is free
+    def tryAdmit(self, ticket):
+        with self.condition:
+            if self.waiting[0] is ticket and self.in_flight < self.max_in_flight:
+                self.waiting.popleft()
+                self.in_flight += 1
+                self.counters["admitted"] += 1
+                # the next ticket may fit in a slot too
+                self.condition.notify_all()
+                return True
+            return False
+
+    # 1 for the next ticket to be admitted
+    def position(self, ticket):
+        with self.condition:
+            return self.waiting.index(ticket) + 1
+
+    # waits for a slot, calling on_wait(position) whenever the position in the queue changes.
+    # a session that is stopped or reruns while waiting (streamlit raises from the st call in
+    # on_wait) leaves the queue
+    @contextlib.contextmanager
+    def admitted(self, on_wait=None):
+        ticket = object()
+        start = time.perf_counter()
+        with self.condition:
+            self.waiting.append(ticket)
+
+        try:
+            position = None
+            while not self.tryAdmit(ticket):
+                current = self.position(ticket)
+                if on_wait is not None and current != position:
+                    position = current
+                    on_wait(position)
+                with self.condition:
+                    self.condition.wait(self.poll_seconds)
+        except BaseException:
+            with self.condition:
+                self.waiting.remove(ticket)
+                self.counters["abandoned"] += 1
+                self.condition.notify_all()
+            Metrics.admission_waits.observe(
+                time.perf_counter() - start, outcome="abandoned"
+            )
+            raise
+
+        Metrics.admission_waits.observe(time.perf_counter() - start, outcome="admitted")
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+    # the queue and the slots as Prometheus gauge and counter families
+    def collect(self):
+        with self.condition:
+            waiting = len(self.waiting)
+            in_flight = self.in_flight
+            counters = dict(self.counters)
+        return [
+            (
+                "survey_admission_queue_depth",
+                "gauge",
+                "Students waiting for a login slot",
+                [([], waiting)],
+            ),
+            (
+                "survey_admission_in_flight",
+                "gauge",
+                "Logins doing their work now",
+                [([], in_flight)],
+            ),
+            (
+                "survey_admission_slots",
+                "gauge",
+                "Logins allowed to work at the same time",
+                [([], self.max_in_flight)],
+            ),
+        ] + [
+            (
+                "survey_admission_{}_total".format(counter),
+                "counter",
+                "Students {} by the admission queue".format(counter),
+                [([], value)],
+            )
+            for counter, value in counters.items()
+        ]
@@ -0,0 +1,507 @@
+import argparse, email, json, os, random, sys, tempfile, threading, time
+from unittest.mock import MagicMock
+
+# streamlit's script testing runner executes Script.py the way a browser session would
+from streamlit import config
+from streamlit.proto.WidgetStates_pb2 import WidgetState, WidgetStates
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import (
+    MemoryCacheStorageManager,
+)
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.scriptrunner import RerunData
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.local_script_runner import LocalScriptRunner
+
+import Metrics
+from LocalSMTP import LocalSMTPServer
+from SheetsEmulator import EmulatedClient
+
+script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Script.py")
+sheet_url = "https://docs.google.com/spreadsheets/d/benchmark"
+
+# the server compiles Script.py once for all sessions, the benchmark does the same
+script_cache = ScriptCache()
+
+
+# the same setup streamlit's InteractiveScriptTests use, scripts run without a server
+def setUpRuntime():
+    config.set_option("runner.postScriptGC", False)
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+
+
+def studentEmail(number):
+    return "student{:04d}@example.ac.uk".format(number)
+
+
+def studentID(number):
+    return "4{:07d}".format(number)
+
+
+# a login sheet with its header, the roster with one invited student per row, three
+# feedback sections per student and a voucher pool with a code per student
+def createSpreadsheet(client, students):
+    roster = [["voucher", "email", "student_id"]] + [
+        ["VOUCHER-{:04d}".format(number), studentEmail(number), studentID(number)]
+        for number in range(students)
+    ]
+    feedback = [["student_id", "original", "alternate"]] + [
+        [
+            studentID(number),
+            "Original section {} for student {}".format(section, number),
+            "Alternate section {} for student {}".format(section, number),
+        ]
+        for number in range(students)
+        for section in range(3)
+    ]
+    return client.create(
+        sheet_url,
+        [
+            ("logins", [["email", "student_id", "login_time", "condition"]]),
+            ("data", roster),
+            ("feedback", feedback),
+            (
+                "vouchers",
+                [["code", "student_id", "email", "claimed_at"]]
+                + [["POOL-{:04d}".format(number)] for number in range(students)],
+            ),
+        ],
+    )
+
+
+# the plain text parts of the messages the SMTP stand-in received for one address
+def messagesFor(smtp, address):
+    texts = []
+    for message in list(smtp.messages):
+        if address not in message["to"]:
+            continue
+        parsed = email.message_from_string(message["data"])
+        for part in parsed.walk():
+            if part.get_content_type() in ("text/plain", "text/html"):
+                texts.append(part.get_payload(decode=True).decode("utf-8", "replace"))
+    return texts
+
+
+# one simulated browser session, it keeps the widget values like the frontend does and sends
+# them with every rerun. Widgets outside a form rerun the script when they change
+class SimulatedStudent:
+    def __init__(self, number, smtp, rng, timeout):
+        self.number = number
+        self.email = studentEmail(number)
+        self.student_id = studentID(number)
+        self.smtp = smtp
+        self.rng = rng
+        self.timeout = timeout
+        self.session_state = None
+        self.widget_states = {}
+        self.widgets = {}
+        self.timings = []
+        self.voucher = None
+        # the query string of the page, it holds the resume link once logged in
+        self.query_string = ""
+
+    def rerun(self):
+        runner = LocalScriptRunner(script_path, self.session_state)
+        runner._script_cache = script_cache
+        states = WidgetStates()
+        states.widgets.extend(self.widget_states.values())
+        page = (
+            self.session_state["web_page"]
+            if self.session_state is not None and "web_page" in self.session_state
+            else "Login_page"
+        )
+
+        start = time.perf_counter()
+        runner.request_rerun(
+            RerunData(query_string=self.query_string, widget_states=states)
+        )
+        runner.start()
+        runner.join()
+        self.timings.append((page, time.perf_counter() - start))
+
+        if runner.script_thread_exceptions:
+            raise runner.script_thread_exceptions[0]
+        self.session_state = runner.session_state
+        self.widget_states = {
+            widget_id: state
+            for widget_id, state in self.widget_states.items()
+            if state.WhichOneof("value") != "trigger_value"
+        }
+        self.widgets = {}
+        for message in runner.forward_msgs():
+            if message.WhichOneof("type") == "page_info_changed":
+                self.query_string = message.page_info_changed.query_string
+            if message.WhichOneof("type") != "delta":
+                continue
+            if message.delta.WhichOneof("type") != "new_element":
+                continue
+            element = message.delta.new_element
+            kind = element.WhichOneof("type")
+            if kind == "exception":
+                raise RuntimeError(
+                    "Script.py raised {}: {}".format(
+                        element.exception.type, element.exception.message
+                    )
+                )
+            proto = getattr(element, kind)
+            if getattr(proto, "id", ""):
+                # keyed widgets are found by key, the others by label
+                self.widgets[proto.id.split("-", 2)[-1]] = (kind, proto)
+                self.widgets.setdefault(proto.label, (kind, proto))
+
+    def set(self, name, value):
+        kind, proto = self.widgets[name]
+        state = WidgetState(id=proto.id)
+        if kind in ("text_input", "text_area"):
+            state.string_value = value
+        elif kind == "checkbox":
+            state.bool_value = value
+        elif kind == "slider":
+            state.double_array_value.data[:] = [value]
+        elif kind == "radio":
+            state.int_value = value
+        self.widget_states[proto.id] = state
+        if not proto.form_id:
+            self.rerun()
+
+    def click(self, name):
+        _, proto = self.widgets[name]
+        self.widget_states[proto.id] = WidgetState(id=proto.id, trigger_value=True)
+        self.rerun()
+
+    # the connection drops and the student opens the page again with the resume link, in a new
+    # session that knows nothing of the old one
+    def reconnect(self):
+        self.session_state = None
+        self.widget_states = {}
+        self.rerun()
+
+    def waitForPasscode(self):
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            for text in messagesFor(self.smtp, self.email):
+                if "pass code" in text:
+                    return text.rsplit(" ", 1)[-1].strip()
+            time.sleep(0.01)
+        raise RuntimeError("No pass code email for " + self.email)
+
+    def page(self):
+        return self.session_state["web_page"]
+
+    # Login_page -> Instructions_page -> Consent_page -> Conditional_Instructions_1_page
+    # -> Survey_page -> Conditional_Instructions_2_page -> Voucher_page
+    def run(self):
+        self.rerun()
+        self.set("email_inp", self.email)
+        self.set("std_id_inp", self.student_id)
+        self.click("Submit")
+        self.set("Pass code", self.waitForPasscode())
+        self.click("login")
+        assert self.page() == "Instructions_page", self.page()
+
+        self.click("Proceed")
+        for name in sorted(self.widgets):
+            if (
+                self.widgets[name][0] == "checkbox"
+                and name == self.widgets[name][1].label
+            ):
+                self.set(name, True)
+        self.click("I do Consent, Proceed.")
+        assert self.page() == "Conditional_Instructions_1_page", self.page()
+
+        self.click("Okay, I understand.")
+        assert self.page() == "Survey_page", self.page()
+        self.reconnect()
+        assert self.page() == "Survey_page", self.page()
+        assert self.session_state["original_feedback_statement"]
+        for key in ("Q1A", "Q1B", "Q2A", "Q2B", "Q3A", "Q3B", "Q4A", "Q4B"):
+            self.set(key, self.rng.randint(0, 100))
+        self.set("", self.rng.randint(0, 1))
+        self.set(
+            "Please tell us in your own words why you prefer one version of the feedback over the other:",
+            "Benchmark answer of student {}".format(self.number),
+        )
+        self.click("Submit Rating")
+        self.click("Yes, I have reviewed. Submit now.")
+        assert self.page() == "Conditional_Instructions_2_page", self.page()
+
+        self.click("Okay, I understand.")
+        assert self.page() == "Voucher_page", self.page()
+        # one more rerun of the voucher page, e.g. the student reconnects
+        self.rerun()
+        return self.session_state["amazon_voucher"]
+
+
+# the journal entries of the app not written to the sheets yet
+def journalPending():
+    return sum(
+        count
+        for name, _, _, samples in Metrics.collect()
+        if name == "survey_journal_pending"
+        for _, count in samples
+    )
+
+
+# every student who got to the voucher page has a login row and the results in their roster row
+def checkSheets(sheets_path, simulated):
+    spreadsheet = EmulatedClient(sheets_path).open_by_url(sheet_url)
+    logged_in = {items[1] for items in spreadsheet.worksheet("logins").get_all_values()}
+    submitted = {
+        items[2]
+        for items in spreadsheet.worksheet("data").get_all_values()
+        if len(items) > 15 and items[15]
+    }
+    finished = [student.student_id for student in simulated if student.voucher]
+    errors = []
+    for name, written in (("login", logged_in), ("results", submitted)):
+        missing = [student_id for student_id in finished if student_id not in written]
+        if missing:
+            errors.append(
+                "{} of {} students have no {} row in the sheets".format(
+                    len(missing), len(finished), name
+                )
+            )
+    return errors
+
+
+# nearest rank percentile of sorted values
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+
+def summarize(timings):
+    values = sorted(timings)
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+    }
+
+
+# settings are extra env keys for the app, e.g. the sheets_emulator_* fault injection
+def runBenchmark(students, seed, timeout, workdir, settings):
+    setUpRuntime()
+    smtp = LocalSMTPServer().start()
+    sheets_path = os.path.join(workdir, "sheets.json")
+    createSpreadsheet(EmulatedClient(sheets_path), students)
+
+    # the app opens the emulator file through getGoogleService, behind the same quota layer as
+    # in production
+    os.environ.update(
+        {
+            "storage_backend": "sheets",
+            "sheets_emulator": sheets_path,
+            "google_sheet": sheet_url,
+            "gmail_id": "survey@example.ac.uk",
+            "gmail_app_password": "benchmark",
+            "smtp_host": smtp.host,
+            "smtp_port": str(smtp.port),
+            "smtp_ssl": "false",
+            "smtp_starttls": "false",
+            "delivery_ledger_path": os.path.join(workdir, "delivery_ledger.db"),
+            "login_flush_seconds": "0.2",
+            "passcode_secret": "benchmark",
+            "voucher_worksheet": "vouchers",
+            "voucher_db_path": os.path.join(workdir, "vouchers.db"),
+            "condition_db_path": os.path.join(workdir, "conditions.db"),
+            "shared_cache_path": os.path.join(workdir, "shared_cache.db"),
+            "journal_path": os.path.join(workdir, "journal.jsonl"),
+        }
+    )
+    os.environ.update(settings)
+
+    rng = random.Random(seed)
+    simulated = [
+        SimulatedStudent(number, smtp, random.Random(rng.random()), timeout)
+        for number in range(students)
+    ]
+    errors = []
+    barrier = threading.Barrier(students)
+
+    def drive(student):
+        barrier.wait()
+        try:
+            student.voucher = student.run()
+        except Exception as e:
+            errors.append("student {}: {!r}".format(student.number, e))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=drive, args=(s,)) for s in simulated]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    vouchers = [student.voucher for student in simulated if student.voucher]
+    if len(set(vouchers)) != len(vouchers):
+        errors.append("the same voucher was handed out twice")
+
+    # let the background writers, the journal and the outbox finish before counting
+    time.sleep(1)
+    deadline = time.monotonic() + timeout
+    while journalPending() and time.monotonic() < deadline:
+        time.sleep(0.1)
+    smtp.stop()
+    errors.extend(checkSheets(sheets_path, simulated))
+
+    timings = [elapsed for student in simulated for _, elapsed in student.timings]
+    pages = {}
+    for student in simulated:
+        for page, seconds in student.timings:
+            pages.setdefault(page, []).append(seconds)
+
+    # the emulator the app opened reports its calls through the metrics collectors
+    emulator_calls = {}
+    for name, _, _, samples in Metrics.collect():
+        if name == "survey_sheets_emulator_calls_total":
+            for labels, count in samples:
+                method = dict(labels)["method"]
+                emulator_calls[method] = emulator_calls.get(method, 0) + count
+    faults = {fault: emulator_calls.pop(fault, 0) for fault in ("429", "conflict")}
+    sheets_calls = sum(emulator_calls.values())
+    return {
+        "students": students,
+        "seed": seed,
+        "errors": errors,
+        "elapsed_seconds": elapsed,
+        "reruns": summarize(timings),
+        "reruns_by_page": {page: summarize(values) for page, values in pages.items()},
+        "sheets_calls": sheets_calls,
+        "sheets_calls_per_student": sheets_calls / students,
+        "sheets_calls_by_method": dict(sorted(emulator_calls.items())),
+        "sheets_429": faults["429"],
+        "sheets_conflicts": faults["conflict"],
+        "emails": len(smtp.messages),
+        "emails_per_student": len(smtp.messages) / students,
+    }
+
+
+def printReport(result):
+    print(
+        "{} students, seed {}, {:.2f}s".format(
+            result["students"], result["seed"], result["elapsed_seconds"]
+        )
+    )
+    print()
+    print(
+        "{:<34}{:>8}{:>10}{:>10}{:>10}".format(
+            "rerun", "count", "p50 ms", "p95 ms", "p99 ms"
+        )
+    )
+    rows = [("all", result["reruns"])] + sorted(result["reruns_by_page"].items())
+    for name, summary in rows:
+        print(
+            "{:<34}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}".format(
+                name,
+                summary["count"],
+                summary["p50_ms"],
+                summary["p95_ms"],
+                summary["p99_ms"],
+            )
+        )
+    print()
+    print(
+        "Sheets API calls: {} ({:.2f} per student)".format(
+            result["sheets_calls"], result["sheets_calls_per_student"]
+        )
+    )
+    for method, calls in result["sheets_calls_by_method"].items():
+        print("  {:<32}{:>8}".format(method, calls))
+    print(
+        "Injected 429s: {}, writer conflicts: {}".format(
+            result["sheets_429"], result["sheets_conflicts"]
+        )
+    )
+    print(
+        "Emails sent: {} ({:.2f} per student)".format(
+            result["emails"], result["emails_per_student"]
+        )
+    )
+    for error in result["errors"]:
+        print("ERROR", error)
+
+
+# python Benchmark.py --students 30 drives 30 simulated students through the whole survey at once,
+# against the Sheets emulator and the SMTP stand-in. --json keeps the result to compare runs
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Drive simulated students through the survey"
+    )
+    parser.add_argument("--students", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--reads-per-minute",
+        type=int,
+        default=6000,
+        help="QuotaClient read budget of the app",
+    )
+    parser.add_argument(
+        "--writes-per-minute",
+        type=int,
+        default=6000,
+        help="QuotaClient write budget of the app",
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=0, help="added to every Sheets call"
+    )
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument(
+        "--api-reads-per-minute",
+        type=int,
+        default=0,
+        help="the emulator answers 429 past this many reads a minute, 0 for no limit",
+    )
+    parser.add_argument("--api-writes-per-minute", type=int, default=0)
+    parser.add_argument(
+        "--error-rate", type=float, default=0, help="share of calls answered 429"
+    )
+    parser.add_argument(
+        "--conflict-rate",
+        type=float,
+        default=0,
+        help="share of writes racing another writer",
+    )
+    parser.add_argument(
+        "--no-journal",
+        action="store_true",
+        help="write the logins and results to the sheets directly",
+    )
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--json", help="write the result to this file")
+    parser.add_argument(
+        "--metrics", help="write the /metrics histograms of the run to this file"
+    )
+    args = parser.parse_args()
+
+    settings = {
+        "sheets_reads_per_minute": str(args.reads_per_minute),
+        "sheets_writes_per_minute": str(args.writes_per_minute),
+        "sheets_emulator_latency_ms": str(args.latency_ms),
+        "sheets_emulator_jitter_ms": str(args.jitter_ms),
+        "sheets_emulator_reads_per_minute": str(args.api_reads_per_minute),
+        "sheets_emulator_writes_per_minute": str(args.api_writes_per_minute),
+        "sheets_emulator_error_rate": str(args.error_rate),
+        "sheets_emulator_conflict_rate": str(args.conflict_rate),
+        "sheets_emulator_seed": str(args.seed),
+    }
+    if args.no_journal:
+        settings["journal_path"] = ""
+
+    with tempfile.TemporaryDirectory() as workdir:
+        result = runBenchmark(args.students, args.seed, args.timeout, workdir, settings)
+    printReport(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.metrics:
+        with open(args.metrics, "w") as f:
+            f.write(Metrics.render())
+    sys.exit(1 if result["errors"] else 0)
@@ -0,0 +1,240 @@
+import argparse, os, string, sys, time
+
+# dotenv library loads env files into the python environment.
+from dotenv import load_dotenv
+
+# the storage backends, the roster is read from the one the app runs on
+from Storage import SqliteStorage, openStorage
+
+# background senders, each keeps one SMTP connection open
+from Outbox import openOutbox
+
+# record of the emails already sent, so a run that is started again skips them
+from DeliveryLedger import DeliveryLedger
+
+# spreads the messages evenly over the minute
+from QuotaClient import TokenBucket
+
+# small SMTP stand-in for offline runs
+from LocalSMTP import LocalSMTPServer
+
+# (subject, body) templates, the placeholders are $email, $student_id, $voucher and $survey_url
+templates = {
+    "invitation": (
+        "Invitation: QUB AI Assist Feedback study",
+        """Hi $email,
+
+You are invited to take part in a study of the School of Psychology looking at how students evaluate the feedback they receive on their written assignments.
+
+The survey takes no more than 20 minutes, and you will receive a £15 Amazon voucher for your time. To start, log in with your university email address and student ID ($student_id) at
+
+$survey_url
+
+Thank you!""",
+    ),
+    "reminder": (
+        "Reminder: QUB AI Assist Feedback study",
+        """Hi $email,
+
+A quick reminder that you can still take part in our study on the feedback on written assignments, and receive a £15 Amazon voucher for your time.
+
+Log in with your university email address and student ID ($student_id) at
+
+$survey_url
+
+If you have already taken part, please ignore this email.""",
+    ),
+}
+
+# who receives the template: everybody on the roster, or the students without results in column P
+audiences = {"invitation": "all", "reminder": "pending"}
+
+
+# a template file has the subject on its first line, after "Subject:", and the body below it
+def loadTemplate(path):
+    with open(path, encoding="utf-8") as f:
+        subject, _, body = f.read().partition("\n")
+    if subject.lower().startswith("subject:"):
+        subject = subject[len("subject:") :]
+    return subject.strip(), body.strip()
+
+
+# the students of the roster with one bulk read: A voucher, B email, C student ID, P participated ID.
+# a student appearing twice gets one message
+def readRoster(storage):
+    if isinstance(storage, SqliteStorage):
+        rows = storage.query(
+            "SELECT voucher, email, student_id, participated_id FROM roster WHERE row > 1 ORDER BY row"
+        )
+    else:
+        rows = [
+            (items + [""] * 16)[:3] + [(items + [""] * 16)[15]]
+            for items in storage.worksheet(storage.data_worksheet).get_all_values()[1:]
+        ]
+
+    students = []
+    seen = set()
+    for voucher, email, student_id, participated_id in rows:
+        email = (email or "").strip()
+        if not email or email.lower() in seen:
+            continue
+        seen.add(email.lower())
+        students.append(
+            {
+                "email": email,
+                "student_id": (student_id or "").strip(),
+                "voucher": (voucher or "").strip(),
+                "participated": bool((participated_id or "").strip()),
+            }
+        )
+    return students
+
+
+# every message is rendered before the first one is sent, so a template with an unknown
+# placeholder fails without sending anything
+def renderMessages(students, template, survey_url):
+    subject, body = template
+    return [
+        (
+            student,
+            string.Template(subject).substitute(student, survey_url=survey_url),
+            string.Template(body).substitute(student, survey_url=survey_url),
+        )
+        for student in students
+    ]
+
+
+# sends the messages over the outboxes, at most per_minute of them a minute. Every message is
+# claimed in the ledger under the campaign before it is queued, so a run that is started again
+# skips the students already claimed. A claim whose outcome was never recorded, e.g. the process
+# was killed while sending, stays unconfirmed and is only sent again with retry_unconfirmed
+def sendCampaign(
+    messages, campaign, ledger, outboxes, per_minute, retry_unconfirmed=False
+):
+    message_type = "bulk:" + campaign
+    if retry_unconfirmed:
+        for student in ledger.students(message_type, "queued"):
+            ledger.release(student, message_type)
+
+    bucket = TokenBucket(per_minute, capacity=len(outboxes))
+    counts = {"queued": 0, "skipped": 0}
+    started = time.monotonic()
+    for student, subject, body in messages:
+        key = student["student_id"] or student["email"]
+        # checked first so the students already done don't use up the rate
+        if ledger.status(key, message_type) is not None:
+            counts["skipped"] += 1
+            continue
+        bucket.take()
+        if not ledger.claim(key, message_type):
+            counts["skipped"] += 1
+            continue
+        # the least busy connection takes the message
+        outbox = min(outboxes, key=lambda outbox: outbox.queue.qsize())
+        outbox.send(
+            student["email"],
+            subject,
+            body,
+            on_done=ledger.recordOutcome(key, message_type),
+        )
+        counts["queued"] += 1
+        if counts["queued"] % 50 == 0:
+            print(
+                "Queued {} messages in {:.0f}s".format(
+                    counts["queued"], time.monotonic() - started
+                )
+            )
+
+    for outbox in outboxes:
+        outbox.join()
+    counts["sent"] = sum(outbox.sent for outbox in outboxes)
+    counts["failed"] = sum(outbox.failed for outbox in outboxes)
+    counts["unconfirmed"] = len(ledger.students(message_type, "queued"))
+    return counts
+
+
+# python BulkMailer.py invitation   invites every student of the roster
+# python BulkMailer.py reminder --campaign reminder-1   reminds the students without results
+# add --local-smtp to send to an in-process SMTP stand-in instead of smtp_host
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(
+        description="Send the invitation or a reminder to the students of the roster"
+    )
+    parser.add_argument("template", choices=sorted(templates))
+    parser.add_argument(
+        "--template-file",
+        help="subject on the first line, then the body, with the placeholders of the template",
+    )
+    parser.add_argument(
+        "--campaign",
+        help="name of the run in the delivery ledger, defaults to the template. "
+        "Use a new name to send a template again",
+    )
+    parser.add_argument(
+        "--per-minute",
+        type=int,
+        default=int(os.environ.get("bulk_mail_per_minute", 20)),
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=int(os.environ.get("bulk_mail_connections", 2)),
+    )
+    parser.add_argument(
+        "--limit", type=int, help="only the first students of the audience"
+    )
+    parser.add_argument(
+        "--retry-unconfirmed",
+        action="store_true",
+        help="send again the messages of an interrupted run whose outcome is unknown",
+    )
+    parser.add_argument("--local-smtp", action="store_true")
+    args = parser.parse_args()
+
+    if args.local_smtp:
+        smtp = LocalSMTPServer().start()
+        os.environ.update(
+            {
+                "smtp_host": smtp.host,
+                "smtp_port": str(smtp.port),
+                "smtp_ssl": "false",
+                "smtp_starttls": "false",
+            }
+        )
+
+    students = readRoster(openStorage(writers=False))
+    if audiences[args.template] == "pending":
+        students = [student for student in students if not student["participated"]]
+    students = students[: args.limit]
+    template = (
+        loadTemplate(args.template_file)
+        if args.template_file
+        else templates[args.template]
+    )
+    messages = renderMessages(
+        students,
+        template,
+        os.environ.get("survey_url", "https://research-survey.streamlit.app/"),
+    )
+
+    counts = sendCampaign(
+        messages,
+        args.campaign or args.template,
+        DeliveryLedger(os.environ.get("delivery_ledger_path") or "delivery_ledger.db"),
+        [openOutbox() for _ in range(max(1, args.connections))],
+        args.per_minute,
+        args.retry_unconfirmed,
+    )
+    print(
+        "{} students: {queued} queued, {sent} sent, {failed} failed, {skipped} skipped "
+        "(already done), {unconfirmed} unconfirmed".format(len(messages), **counts)
+    )
+    if args.local_smtp:
+        print(
+            "The SMTP stand-in received {} messages over {} connections".format(
+                len(smtp.messages), smtp.connections
+            )
+        )
+        smtp.stop()
+    sys.exit(1 if counts["failed"] else 0)
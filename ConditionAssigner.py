@@ -0,0 +1,160 @@
+import atexit, queue, random, sqlite3, threading, time
+
+# latency histograms and the /metrics route
+import Metrics
+
+
+# assigns the experimental conditions with balanced block randomization.
+# the positions come from an atomic counter of blocks in a local sqlite file: a process claims a
+# whole block in one transaction, then hands out its slots from memory under a lock, so an
+# assignment is a dict lookup and an index increment. Every block holds each condition
+# block_size / len(conditions) times in an order shuffled from the seed and the block number, so
+# the experiment stays balanced however the logins interleave, and across processes sharing the
+# file. A student keeps the condition of the first assignment.
+# assignments are written to the file by a background thread over its own connection
+class ConditionAssigner:
+    def __init__(
+        self,
+        path,
+        conditions,
+        block_size=None,
+        seed="",
+        flush_interval=1.0,
+    ):
+        self.conditions = list(conditions)
+        if len(self.conditions) < 2:
+            raise ValueError("At least two conditions are needed")
+        self.block_size = block_size or 2 * len(self.conditions)
+        if self.block_size % len(self.conditions):
+            raise ValueError(
+                "block_size must be a multiple of the number of conditions"
+            )
+        self.seed = seed
+        self.path = path
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.block = None
+        self.slots = []
+        self.queue = queue.Queue()
+        self.counts = {condition: 0 for condition in self.conditions}
+
+        self.connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER);
+            INSERT OR IGNORE INTO counters VALUES ('block', 0);
+            CREATE TABLE IF NOT EXISTS assignments (
+                student_id TEXT PRIMARY KEY, condition TEXT, block INTEGER, slot INTEGER,
+                assigned_at TEXT
+            );
+            """)
+        self.assigned = dict(
+            self.connection.execute(
+                "SELECT student_id, condition FROM assignments"
+            ).fetchall()
+        )
+
+        self.write_lock = threading.Lock()
+        self.writer = None
+        self.thread = threading.Thread(
+            target=self.run, name="condition-assigner", daemon=True
+        )
+        self.thread.start()
+        atexit.register(self.flush)
+        Metrics.registerCollector(self.collect)
+
+    # the order of a block only depends on the seed and its number
+    def blockOrder(self, block):
+        order = self.conditions * (self.block_size // len(self.conditions))
+        random.Random("{}:{}".format(self.seed, block)).shuffle(order)
+        return order
+
+    # the counter is shared with the other processes using the file
+    def claimBlock(self):
+        (block,) = self.connection.execute(
+            "UPDATE counters SET value = value + 1 WHERE name = 'block' RETURNING value"
+        ).fetchone()
+        self.block = block
+        self.slots = list(enumerate(self.blockOrder(block)))
+        self.slots.reverse()
+
+    def assign(self, student_id):
+        with self.lock:
+            condition = self.assigned.get(student_id)
+            if condition is not None:
+                return condition
+            if not self.slots:
+                self.claimBlock()
+            slot, condition = self.slots.pop()
+            self.assigned[student_id] = condition
+            self.counts[condition] += 1
+            self.queue.put(
+                (
+                    student_id,
+                    condition,
+                    self.block,
+                    slot,
+                    time.strftime("%d/%m/%Y %H:%M:%S"),
+                )
+            )
+        return condition
+
+    def run(self):
+        while True:
+            rows = [self.queue.get()]
+            time.sleep(self.flush_interval)
+            while True:
+                try:
+                    rows.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.write(rows)
+
+    # write everything that is queued right now, without waiting for the background thread
+    def flush(self):
+        rows = []
+        while True:
+            try:
+                rows.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if rows:
+            self.write(rows)
+
+    def write(self, rows):
+        try:
+            with self.write_lock:
+                if self.writer is None:
+                    self.writer = sqlite3.connect(
+                        self.path, check_same_thread=False, timeout=30
+                    )
+                with self.writer:
+                    self.writer.executemany(
+                        "INSERT OR IGNORE INTO assignments VALUES (?, ?, ?, ?, ?)",
+                        rows,
+                    )
+        except sqlite3.Error as e:
+            print("Recording {} condition assignments failed: {}".format(len(rows), e))
+
+    # the assignments of this process as Prometheus counters
+    def collect(self):
+        with self.lock:
+            counts = dict(self.counts)
+            block = self.block or 0
+        return [
+            (
+                "survey_condition_assignments_total",
+                "counter",
+                "Students assigned to each condition by this process",
+                [([("condition", c)], count) for c, count in counts.items()],
+            ),
+            (
+                "survey_condition_block",
+                "gauge",
+                "Randomization block currently handed out",
+                [([], block)],
+            ),
+        ]
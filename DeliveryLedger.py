@@ -0,0 +1,87 @@
+import sqlite3, threading, time
+
+
+# records which emails were sent, keyed by student and message type, so reruns and reconnects
+# of a page never send the same email twice. It is a local sqlite file, so it is shared by all
+# processes on the machine and survives restarts
+class DeliveryLedger:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS deliveries (
+                student TEXT NOT NULL,
+                message_type TEXT NOT NULL,
+                status TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (student, message_type)
+            )""")
+
+    # returns True when the caller holds the claim and should send the message.
+    # the insert is atomic, so only one session or process gets the claim. With expire_seconds a
+    # claim left queued for longer, e.g. by a process that died before sending, is taken over
+    def claim(self, student, message_type, expire_seconds=None):
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                if expire_seconds is not None:
+                    self.connection.execute(
+                        "DELETE FROM deliveries WHERE student = ? AND message_type = ? AND status = 'queued' AND updated_at < ?",
+                        (student, message_type, now - expire_seconds),
+                    )
+                cursor = self.connection.execute(
+                    "INSERT OR IGNORE INTO deliveries VALUES (?, ?, 'queued', ?)",
+                    (student, message_type, now),
+                )
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+        return cursor.rowcount == 1
+
+    def markSent(self, student, message_type):
+        with self.lock:
+            self.connection.execute(
+                "UPDATE deliveries SET status = 'sent', updated_at = ? WHERE student = ? AND message_type = ?",
+                (time.time(), student, message_type),
+            )
+
+    # a message that could not be sent is removed so the next attempt can claim it again.
+    # a message recorded as sent stays sent
+    def release(self, student, message_type):
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM deliveries WHERE student = ? AND message_type = ? AND status = 'queued'",
+                (student, message_type),
+            )
+
+    # None if the message was never claimed, otherwise "queued" or "sent"
+    def status(self, student, message_type):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT status FROM deliveries WHERE student = ? AND message_type = ?",
+                (student, message_type),
+            ).fetchone()
+        return row[0] if row else None
+
+    # the students holding a claim on the message with the given status
+    def students(self, message_type, status):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT student FROM deliveries WHERE message_type = ? AND status = ?",
+                (message_type, status),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    # outbox callback that records the outcome of a claimed message
+    def recordOutcome(self, student, message_type):
+        def on_done(sent):
+            if sent:
+                self.markSent(student, message_type)
+            else:
+                self.release(student, message_type)
+
+        return on_done
@@ -0,0 +1,268 @@
+import argparse, json, os, sys
+
+# numpy, pandas and pyarrow run the columnar export and the report, the app itself doesn't load them
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# dotenv library loads env files into the python environment.
+from dotenv import load_dotenv
+
+# the storage backends and the columns of the results
+from Storage import SqliteStorage, openStorage, result_columns
+
+# the statements rated on the survey page
+import PageContent
+
+# the ratings of the four statements, a for the original and b for the alternative feedback
+items = [question.lower() for question, _ in PageContent.survey_statements]
+rating_columns = [item + side for item in items for side in ("a", "b")]
+
+# the exported columns, email, student ID and voucher are left out so the file holds no identifiers
+schema = pa.schema(
+    [(column, pa.int16()) for column in rating_columns]
+    + [
+        ("preferred_feedback", pa.string()),
+        ("open_feedback", pa.string()),
+        ("instructions_first", pa.bool_()),
+        ("condition", pa.string()),
+        ("submitted_at", pa.timestamp("s")),
+    ]
+)
+
+# the condition of a result without a condition in the logins, e.g. logins recorded before the
+# condition was, from the instructions_first column of the default two conditions
+conditions = {True: "instructions_first", False: "instructions_after"}
+
+
+# the rows of columns A to last_column from first_row on, below the heading by default, chunk_size
+# rows per request. The rows are read by range so a large sheet never comes down in one response
+def sheetChunks(storage, worksheet, last_column, chunk_size, first_row=2):
+    worksheet = storage.worksheet(worksheet)
+    row_count = worksheet.row_count
+    for first in range(first_row, row_count + 1, chunk_size):
+        last = min(first + chunk_size - 1, row_count)
+        yield worksheet.get("A{}:{}{}".format(first, last_column, last))
+
+
+# the same rows from the sqlite file, fetched chunk_size at a time
+def sqliteChunks(storage, chunk_size):
+    cursor = storage.connection.execute(
+        "SELECT voucher, {} FROM roster WHERE row > 1 ORDER BY row".format(
+            ", ".join(result_columns)
+        )
+    )
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+
+# the condition assigned to each student ID, from column D of the logins. The results only record
+# instructions_first, which can't tell more than two conditions apart. A heading row only adds
+# an entry for the student ID "student_id"
+def loginConditions(storage, chunk_size=1000):
+    if isinstance(storage, SqliteStorage):
+        chunks = [
+            storage.query(
+                "SELECT email, student_id, login_time, condition FROM logins ORDER BY row"
+            )
+        ]
+    else:
+        chunks = sheetChunks(
+            storage, storage.login_worksheet, "D", chunk_size, first_row=1
+        )
+
+    assigned = {}
+    for rows in chunks:
+        for items in rows:
+            items = ["" if value is None else str(value) for value in items]
+            items = items + [""] * (4 - len(items))
+            if items[1].strip() and items[3].strip():
+                assigned[items[1].strip()] = items[3].strip()
+    return assigned
+
+
+# a record batch of the submitted results in rows of columns A:P, the rows of students who haven't
+# submitted are dropped. assigned maps the student IDs to their condition, see loginConditions
+def resultsBatch(rows, assigned):
+    columns = {}
+    for index, column in enumerate(result_columns, start=1):
+        columns[column] = pa.array(
+            [
+                "" if index >= len(row) or row[index] is None else str(row[index])
+                for row in rows
+            ],
+            pa.string(),
+        )
+    columns["condition"] = pa.array(
+        [
+            assigned.get(student_id.strip())
+            or conditions[instructions_first.strip().lower() == "true"]
+            for student_id, instructions_first in zip(
+                columns["student_id"].to_pylist(),
+                columns["instructions_first"].to_pylist(),
+            )
+        ],
+        pa.string(),
+    )
+    submitted = pc.not_equal(pc.utf8_trim_whitespace(columns["submitted_at"]), "")
+
+    arrays = []
+    for field in schema:
+        values = pc.filter(columns[field.name], submitted)
+        missing = pc.equal(pc.utf8_trim_whitespace(values), "")
+        if field.name in rating_columns:
+            values = pc.cast(
+                pc.cast(pc.if_else(missing, None, values), pa.float64()), pa.int16()
+            )
+        elif field.name == "instructions_first":
+            values = pc.equal(pc.utf8_lower(pc.utf8_trim_whitespace(values)), "true")
+        elif field.name == "submitted_at":
+            values = pc.strptime(
+                values, format="%d/%m/%Y %H:%M:%S", unit="s", error_is_null=True
+            )
+        arrays.append(values)
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+# streams the results into a parquet file, one row group per chunk. The file is written next to
+# the target and moved over it once complete. Returns the number of exported results
+def exportResults(storage, path, chunk_size=1000):
+    assigned = loginConditions(storage, chunk_size)
+    if isinstance(storage, SqliteStorage):
+        chunks = sqliteChunks(storage, chunk_size)
+    else:
+        chunks = sheetChunks(storage, storage.data_worksheet, "P", chunk_size)
+
+    exported = 0
+    temporary = path + ".tmp"
+    with pq.ParquetWriter(temporary, schema, compression="zstd") as writer:
+        for rows in chunks:
+            batch = resultsBatch(rows, assigned)
+            if batch.num_rows:
+                writer.write_batch(batch)
+                exported += batch.num_rows
+    os.replace(temporary, path)
+    return exported
+
+
+# sums per condition of the pairs of ratings of one batch, columns are (sum, item)
+def pairedSums(frame):
+    originals = frame[[item + "a" for item in items]].to_numpy(dtype=float)
+    alternatives = frame[[item + "b" for item in items]].to_numpy(dtype=float)
+    differences = alternatives - originals
+    paired = ~np.isnan(differences)
+    sums = {
+        "n": paired,
+        "original": np.where(paired, originals, 0),
+        "alternative": np.where(paired, alternatives, 0),
+        "difference": np.where(paired, differences, 0),
+        "difference_squared": np.where(paired, differences, 0) ** 2,
+    }
+    condition = frame["condition"].to_numpy()
+    return pd.concat(
+        {
+            name: pd.DataFrame(values, columns=items).groupby(condition).sum()
+            for name, values in sums.items()
+        },
+        axis=1,
+    )
+
+
+# original against alternative feedback per item and condition: the means, the mean difference
+# (alternative - original) with its standard deviation, the paired t statistic and Cohen's dz.
+# the file is read in batches and only the sums are kept, so its size doesn't matter
+def pairedReport(path, batch_size=65536):
+    totals = None
+    preferences = None
+    parquet = pq.ParquetFile(path)
+    # files exported before the condition was have instructions_first only
+    recorded = "condition" in parquet.schema_arrow.names
+    for batch in parquet.iter_batches(
+        batch_size,
+        columns=rating_columns
+        + ["condition" if recorded else "instructions_first", "preferred_feedback"],
+    ):
+        frame = batch.to_pandas()
+        if not recorded:
+            frame["condition"] = frame.pop("instructions_first").map(conditions)
+        sums = pairedSums(frame)
+        counts = frame.groupby(["condition", "preferred_feedback"]).size()
+        totals = sums if totals is None else totals.add(sums, fill_value=0)
+        preferences = (
+            counts if preferences is None else preferences.add(counts, fill_value=0)
+        )
+
+    if totals is None:
+        return pd.DataFrame(), pd.DataFrame()
+
+    long = totals.stack(level=1)
+    long.index.names = ["condition", "item"]
+    n = long["n"]
+    mean_difference = long["difference"] / n
+    sd_difference = np.sqrt(
+        (long["difference_squared"] - n * mean_difference**2) / (n - 1)
+    )
+    statements = dict(
+        (question.lower(), statement.strip())
+        for question, statement in PageContent.survey_statements
+    )
+    report = pd.DataFrame(
+        {
+            "n": n.astype(int),
+            "mean_original": long["original"] / n,
+            "mean_alternative": long["alternative"] / n,
+            "mean_difference": mean_difference,
+            "sd_difference": sd_difference,
+            "t": mean_difference / (sd_difference / np.sqrt(n)),
+            "df": n.astype(int) - 1,
+            "dz": mean_difference / sd_difference,
+        }
+    ).reset_index()
+    report.insert(0, "condition", report.pop("condition"))
+    report.insert(2, "statement", report["item"].map(statements))
+
+    preferences = preferences.unstack(fill_value=0).astype(int)
+    return report, preferences.reset_index()
+
+
+# python ExportResults.py export results.parquet   streams the results of the storage backend into parquet
+# python ExportResults.py report results.parquet   prints the paired comparison by condition
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(
+        description="Export the survey results to parquet and compare the feedback versions"
+    )
+    parser.add_argument("command", choices=["export", "report"])
+    parser.add_argument("path", help="parquet file")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--json", help="also write the report to this json file")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        exported = exportResults(openStorage(writers=False), args.path, args.chunk_size)
+        print("Exported {} results to {}".format(exported, args.path))
+        sys.exit(0)
+
+    report, preferences = pairedReport(args.path)
+    if report.empty:
+        print("No results in {}".format(args.path))
+        sys.exit(1)
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(report.round(3).to_string(index=False))
+        print()
+        print(preferences.to_string(index=False))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "paired": report.to_dict(orient="records"),
+                    "preferences": preferences.to_dict(orient="records"),
+                },
+                f,
+                indent=2,
+            )
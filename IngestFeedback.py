@@ -0,0 +1,134 @@
+import argparse, csv, json, re, sys, unicodedata
+
+# dotenv library loads env files into the python environment.
+from dotenv import load_dotenv
+
+# the storage backends and the headings of the feedback sections
+from Storage import feedback_questions, openStorage
+
+# a Google Sheets cell holds at most 50000 characters
+max_cell_characters = 50000
+
+
+# the records of a .csv file (with a heading row) or a .jsonl file (one object per line), read one
+# at a time with the line they start on. The lines of a .jsonl file are parsed by normalizeRecord,
+# so a line that isn't valid JSON is reported like any other invalid record
+def readRecords(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if path.lower().endswith(".csv"):
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record
+        else:
+            for line_number, line in enumerate(f, start=1):
+                if line.strip():
+                    yield line_number, line
+
+
+def normalizeText(value):
+    text = "" if value is None else str(value)
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    return text.strip()
+
+
+# spreadsheets turn IDs into numbers, "40123456.0" is read as "40123456"
+def normalizeStudentID(value):
+    student_id = normalizeText(value)
+    match = re.fullmatch(r"(\d+)\.0+", student_id)
+    return match.group(1) if match else student_id
+
+
+# the sections of a record, either as lists ({"original": [...], "alternate": [...]}) or as the
+# columns original_1, original_2, original_3 and alternate_1, alternate_2, alternate_3.
+# returns (student_id, [(original, alternate)] * 3), raises ValueError for an invalid record
+def normalizeRecord(record):
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except ValueError as e:
+            raise ValueError("invalid JSON, {}".format(e))
+        if not isinstance(record, dict):
+            raise ValueError("not a JSON object")
+    student_id = normalizeStudentID(record.get("student_id"))
+    if not student_id:
+        raise ValueError("no student_id")
+
+    sides = {}
+    for side in ("original", "alternate"):
+        if isinstance(record.get(side), list):
+            texts = record[side]
+        else:
+            texts = [
+                record.get("{}_{}".format(side, number))
+                for number in range(1, len(feedback_questions) + 1)
+            ]
+        texts = [normalizeText(text) for text in texts]
+        if len(texts) != len(feedback_questions):
+            raise ValueError(
+                "{} has {} sections instead of {}".format(
+                    side, len(texts), len(feedback_questions)
+                )
+            )
+        if not any(texts):
+            raise ValueError("{} feedback is empty".format(side))
+        if any(len(text) > max_cell_characters for text in texts):
+            raise ValueError(
+                "{} feedback is longer than {} characters".format(
+                    side, max_cell_characters
+                )
+            )
+        sides[side] = texts
+    return student_id, list(zip(sides["original"], sides["alternate"]))
+
+
+# the feedback of all files by student ID, a later record of a student replaces the earlier one
+def collectFeedback(paths):
+    feedback = {}
+    counts = {"records": 0, "invalid": 0, "duplicates": 0}
+    for path in paths:
+        for line_number, record in readRecords(path):
+            counts["records"] += 1
+            try:
+                student_id, sections = normalizeRecord(record)
+            except (ValueError, AttributeError) as e:
+                counts["invalid"] += 1
+                print("{}:{}: skipped, {}".format(path, line_number, e))
+                continue
+            if student_id in feedback:
+                counts["duplicates"] += 1
+            feedback[student_id] = sections
+    return feedback, counts
+
+
+# python IngestFeedback.py feedback.csv [more.jsonl ...]   merges the feedback into the feedback store
+# of the storage backend. --replace drops the feedback of the students not in the files
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(
+        description="Load the original and alternate feedback of the students from CSV or JSONL files"
+    )
+    parser.add_argument("paths", nargs="+", help=".csv or .jsonl files")
+    parser.add_argument("--replace", action="store_true")
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="store nothing when a record is invalid",
+    )
+    args = parser.parse_args()
+
+    feedback, counts = collectFeedback(args.paths)
+    print(
+        "{records} records: {invalid} invalid, {duplicates} duplicate student IDs".format(
+            **counts
+        )
+    )
+    if not feedback or (args.strict and counts["invalid"]):
+        print("Nothing stored")
+        sys.exit(1)
+
+    stored = openStorage(writers=False).store_feedback(feedback, replace=args.replace)
+    print(
+        "Stored the feedback of {} students, {} from the files".format(
+            stored, len(feedback)
+        )
+    )
@@ -0,0 +1,463 @@
+import atexit, collections, json, os, queue, threading, time, uuid
+
+# latency histograms and the /metrics route
+import Metrics
+
+
+# the lock of one journal file, None when another process holds it. The lock goes with the
+# process, so the file of a process that exited can be taken over
+def lockFile(path):
+    import fcntl
+
+    lock = open(path + ".lock", "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return lock
+    except OSError:
+        lock.close()
+        return None
+
+
+# the journal file of the process: path, or path.1, path.2, ... when another process holds it
+def claimFile(path):
+    try:
+        import fcntl
+    except ImportError:
+        # no file locks on windows, run one process per journal_path there
+        return path, None
+    number = 0
+    while True:
+        candidate = path if number == 0 else "{}.{}".format(path, number)
+        lock = lockFile(candidate)
+        if lock is not None:
+            return candidate, lock
+        number += 1
+
+
+# the journal files of path that exist, path first and then path.1, path.2, ...
+def journalFiles(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    prefix = os.path.basename(path) + "."
+    numbers = sorted(
+        int(name[len(prefix) :])
+        for name in os.listdir(directory)
+        if name.startswith(prefix) and name[len(prefix) :].isdigit()
+    )
+    files = [path] if os.path.exists(path) else []
+    return files + ["{}.{}".format(path, number) for number in numbers]
+
+
+# local write-ahead journal of the writes to Google Sheets. append() returns once the entry is on
+# disk, a slow or failing Sheets API never holds up the student. The entries waiting at the same
+# time are written with one fsync (group commit) by the journal-commit thread. The journal-replay
+# thread hands the pending entries to replay(kind, entries, uncertain) in batches of batch_size
+# entries of one kind, waiting at most flush_interval for a batch to fill, and records the
+# acknowledgement of the entries it replayed. A failed replay is retried with backoff, a batch that
+# failed max_attempts times is tried one entry at a time, and an entry that failed on its own
+# max_attempts times more is parked: it stays in the journal but no longer holds up the entries
+# after it, and is tried again every park_seconds. Once it goes through, the parked entries of its
+# kind are replayed with the others again.
+# uncertain is True when the entries may have been applied before, e.g. the process was killed
+# between the write and its acknowledgement, so replay can skip what is already in the sheet.
+# the file is JSON lines of entries and acknowledgements. It is read when the journal is opened,
+# so the entries of an earlier run are replayed, and rewritten with the pending entries only.
+# each process has a file of its own, see claimFile. The files of path no running process holds,
+# e.g. left by processes of a larger deployment, are taken over when the journal is opened
+class Journal:
+    def __init__(
+        self,
+        path,
+        replay,
+        batch_size=50,
+        flush_interval=2.0,
+        compact_bytes=4000000,
+        max_attempts=5,
+        park_seconds=300,
+        append_timeout=30,
+    ):
+        self.path, self.path_lock = claimFile(path)
+        self.replay = replay
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.compact_bytes = compact_bytes
+        self.max_attempts = max_attempts
+        self.park_seconds = park_seconds
+        self.append_timeout = append_timeout
+        # file_lock is taken before lock when both are needed
+        self.file_lock = threading.Lock()
+        self.lock = threading.Condition()
+        self.replay_lock = threading.Lock()
+        self.commits = queue.Queue()
+        self.pending = collections.OrderedDict()
+        self.uncertain = set()
+        self.attempts = {}
+        self.parked = set()
+        self.parked_at = 0
+        self.lines = 0
+        self.counters = {
+            "appended": 0,
+            "replayed": 0,
+            "replay_failures": 0,
+            "parked": 0,
+        }
+
+        with self.file_lock:
+            self.load(self.path)
+            adopted = self.adopt(path) if self.path_lock is not None else []
+            self.compact()
+        # the entries of the files taken over are in this file now
+        for other, lock in adopted:
+            os.remove(other)
+            lock.close()
+            print("Took over the journal entries of {}".format(other))
+        if self.pending:
+            print(
+                "Replaying {} journal entries of an earlier run".format(
+                    len(self.pending)
+                )
+            )
+
+        self.commit_thread = threading.Thread(
+            target=self.commit, name="journal-commit", daemon=True
+        )
+        self.commit_thread.start()
+        self.replay_thread = threading.Thread(
+            target=self.run, name="journal-replay", daemon=True
+        )
+        self.replay_thread.start()
+        # one more attempt at the pending entries before the process exits, the rest is replayed
+        # by the next run
+        atexit.register(self.drain)
+        Metrics.registerCollector(self.collect)
+
+    # the pending entries of a journal file. A line cut short by a crash is skipped, its entry
+    # was never acknowledged to the student
+    def load(self, path):
+        if not os.path.exists(path):
+            return
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "ack" in record:
+                    for entry_id in record["ack"]:
+                        self.pending.pop(entry_id, None)
+                else:
+                    self.pending[record["id"]] = record
+        self.uncertain.update(self.pending)
+
+    # loads the other files of path that no running process holds. Returns (file, lock) pairs,
+    # the files are removed once their entries are written to this one
+    def adopt(self, path):
+        adopted = []
+        for other in journalFiles(path):
+            if other == self.path:
+                continue
+            lock = lockFile(other)
+            if lock is None:
+                continue
+            self.load(other)
+            adopted.append((other, lock))
+        return adopted
+
+    # rewrites the file with the pending entries, next to it first and then moved over it
+    def compact(self):
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            with self.lock:
+                entries = list(self.pending.values())
+            f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+        self.lines = len(entries)
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    # queues the entry and waits until it is on disk, returns its ID. Raises the error of the write,
+    # or TimeoutError when it is not on disk after append_timeout seconds
+    def append(self, kind, data):
+        waiter = {
+            "entry": {
+                "id": uuid.uuid4().hex,
+                "kind": kind,
+                "data": data,
+                "at": time.time(),
+            },
+            "done": threading.Event(),
+            "error": None,
+        }
+        self.commits.put(waiter)
+        if not waiter["done"].wait(self.append_timeout):
+            raise TimeoutError(
+                "the journal write took more than {}s".format(self.append_timeout)
+            )
+        if waiter["error"] is not None:
+            raise waiter["error"]
+        return waiter["entry"]["id"]
+
+    # everything queued while the previous fsync ran goes into the next one
+    def commit(self):
+        while True:
+            waiters = [self.commits.get()]
+            while True:
+                try:
+                    waiters.append(self.commits.get_nowait())
+                except queue.Empty:
+                    break
+
+            entries = [waiter["entry"] for waiter in waiters]
+            start = time.perf_counter()
+            try:
+                with self.file_lock:
+                    self.write(entries, sync=True)
+                    with self.lock:
+                        for entry in entries:
+                            self.pending[entry["id"]] = entry
+                        self.counters["appended"] += len(entries)
+                        self.lock.notify_all()
+            except Exception as e:
+                print("Writing {} journal entries failed: {}".format(len(entries), e))
+                for waiter in waiters:
+                    waiter["error"] = e
+            Metrics.journal_commits.observe(time.perf_counter() - start)
+            for waiter in waiters:
+                waiter["done"].set()
+
+    def write(self, records, sync=False):
+        self.file.write("".join(json.dumps(record) + "\n" for record in records))
+        self.file.flush()
+        if sync:
+            os.fsync(self.file.fileno())
+        self.lines += len(records)
+
+    # the next batch: the oldest pending entry not in skip and the entries of its kind after it.
+    # an entry that failed in max_attempts batches is tried on its own
+    def nextBatch(self, skip=()):
+        with self.lock:
+            batch = []
+            for entry in self.pending.values():
+                if entry["id"] in skip:
+                    continue
+                single = self.attempts.get(entry["id"], 0) >= self.max_attempts
+                if not batch:
+                    batch.append(entry)
+                    if single:
+                        break
+                elif entry["kind"] == batch[0]["kind"] and not single:
+                    batch.append(entry)
+                    if len(batch) >= self.batch_size:
+                        break
+            return batch
+
+    # counts a failed replay of the batch, parks the entries that failed too often
+    def recordFailure(self, batch, error, delay):
+        with self.lock:
+            self.counters["replay_failures"] += 1
+            parked = []
+            for entry in batch:
+                attempts = self.attempts.get(entry["id"], 0) + 1
+                self.attempts[entry["id"]] = attempts
+                if attempts >= 2 * self.max_attempts:
+                    self.parked.add(entry["id"])
+                    parked.append(entry)
+            self.counters["parked"] += len(parked)
+            if parked:
+                self.parked_at = time.monotonic()
+        if parked:
+            print(
+                "Parked the {} entry {} after {} failed replays, trying it again every {}s: {}".format(
+                    batch[0]["kind"],
+                    batch[0]["id"],
+                    2 * self.max_attempts,
+                    self.park_seconds,
+                    error,
+                )
+            )
+        else:
+            print(
+                "Replaying {} {} entries failed, retrying in {}s: {}".format(
+                    len(batch), batch[0]["kind"], delay, error
+                )
+            )
+
+    # called with lock held
+    def parkedDue(self):
+        return (
+            bool(self.parked) and time.monotonic() - self.parked_at >= self.park_seconds
+        )
+
+    # tries the oldest parked entry on its own. When it goes through, the parked entries of its
+    # kind are probably fine too (e.g. they failed during an outage) and go back to the batches
+    def retryParked(self):
+        with self.lock:
+            if not self.parkedDue():
+                return
+            self.parked_at = time.monotonic()
+            entry = next(
+                entry for entry in self.pending.values() if entry["id"] in self.parked
+            )
+        try:
+            self.replayBatch([entry])
+        except Exception as e:
+            print(
+                "The parked {} entry {} failed again: {}".format(
+                    entry["kind"], entry["id"], e
+                )
+            )
+            return
+        with self.lock:
+            for entry_id in list(self.parked):
+                if self.pending[entry_id]["kind"] == entry["kind"]:
+                    self.parked.discard(entry_id)
+                    self.attempts.pop(entry_id, None)
+
+    # replays a batch and acknowledges it. An acknowledgement lost in a crash only means the
+    # entries are replayed again, so it is not synced
+    def replayBatch(self, batch):
+        with self.replay_lock:
+            with self.lock:
+                batch = [entry for entry in batch if entry["id"] in self.pending]
+                uncertain = any(entry["id"] in self.uncertain for entry in batch)
+                # from here on a failure may leave the entries applied
+                self.uncertain.update(entry["id"] for entry in batch)
+            if not batch:
+                return
+            self.replay(batch[0]["kind"], batch, uncertain)
+
+            ids = [entry["id"] for entry in batch]
+            with self.file_lock:
+                self.write([{"ack": ids}])
+                with self.lock:
+                    for entry_id in ids:
+                        self.pending.pop(entry_id, None)
+                        self.uncertain.discard(entry_id)
+                        self.attempts.pop(entry_id, None)
+                        self.parked.discard(entry_id)
+                    self.counters["replayed"] += len(ids)
+                    compact = (
+                        self.file.tell() > self.compact_bytes
+                        and len(self.pending) * 2 < self.lines
+                    )
+                if compact:
+                    self.file.close()
+                    try:
+                        self.compact()
+                    except Exception as e:
+                        # the acknowledgements stay in the file until the next compaction
+                        print("Compacting the journal failed: {}".format(e))
+                        self.file = open(self.path, "a", encoding="utf-8")
+
+    def run(self):
+        delay = 1
+        while True:
+            with self.lock:
+                while len(self.pending) == len(self.parked) and not self.parkedDue():
+                    self.lock.wait(self.park_seconds if self.parked else None)
+                # wait a little so the writes of a burst end up in the same batch
+                deadline = time.monotonic() + self.flush_interval
+                while len(self.pending) - len(self.parked) < self.batch_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self.lock.wait(timeout)
+
+            # the batches of all pending entries, kinds in the order they were written
+            while True:
+                with self.lock:
+                    parked = set(self.parked)
+                batch = self.nextBatch(parked)
+                if not batch:
+                    break
+                try:
+                    self.replayBatch(batch)
+                    delay = 1
+                except Exception as e:
+                    self.recordFailure(batch, e, delay)
+                    time.sleep(delay)
+                    delay = min(delay * 2, 60)
+            self.retryParked()
+
+    # replays the pending entries now, without waiting for the background thread, and returns
+    # the number of entries still pending. Stops at the first failure, or with split tries the
+    # entries of a failed batch one at a time and goes on with the entries after them
+    def drain(self, split=False):
+        failed = set()
+        while True:
+            batch = self.nextBatch(failed)
+            if not batch:
+                break
+            try:
+                self.replayBatch(batch)
+            except Exception as e:
+                print(
+                    "Replaying {} {} entries of the journal failed: {}".format(
+                        len(batch), batch[0]["kind"], e
+                    )
+                )
+                if not split:
+                    break
+                for entry in batch:
+                    try:
+                        self.replayBatch([entry])
+                    except Exception:
+                        failed.add(entry["id"])
+        with self.lock:
+            return len(self.pending)
+
+    # the pending entries by kind, the age of the oldest one and the totals as Prometheus families
+    def collect(self):
+        with self.lock:
+            pending = collections.Counter(
+                entry["kind"] for entry in self.pending.values()
+            )
+            oldest = min(
+                (entry["at"] for entry in self.pending.values()), default=time.time()
+            )
+            counters = dict(self.counters)
+            parked = len(self.parked)
+        return [
+            (
+                "survey_journal_pending",
+                "gauge",
+                "Journal entries not replayed to Google Sheets yet",
+                [([("kind", kind)], count) for kind, count in sorted(pending.items())],
+            ),
+            (
+                "survey_journal_oldest_pending_seconds",
+                "gauge",
+                "Age of the oldest journal entry not replayed yet",
+                [([], time.time() - oldest)],
+            ),
+            (
+                "survey_journal_parked",
+                "gauge",
+                "Journal entries set aside after failing on their own, tried again now and then",
+                [([], parked)],
+            ),
+            (
+                "survey_journal_appended_total",
+                "counter",
+                "Journal entries written to disk",
+                [([], counters["appended"])],
+            ),
+            (
+                "survey_journal_replayed_total",
+                "counter",
+                "Journal entries replayed to Google Sheets",
+                [([], counters["replayed"])],
+            ),
+            (
+                "survey_journal_replay_failures_total",
+                "counter",
+                "Failed replays of a batch of journal entries",
+                [([], counters["replay_failures"])],
+            ),
+            (
+                "survey_journal_parked_total",
+                "counter",
+                "Journal entries parked after failing on their own",
+                [([], counters["parked"])],
+            ),
+        ]
@@ -0,0 +1,118 @@
+import socketserver, sys, threading
+
+
+# a small SMTP stand-in so the email code can be run offline.
+# it accepts any login, keeps every message in memory and can be told to refuse the next
+# few messages with a 421 reply to exercise the retries of the outbox
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, verbose=False):
+        super().__init__((host, port), SMTPHandler)
+        self.host, self.port = self.server_address
+        self.verbose = verbose
+        self.messages = []
+        self.connections = 0
+        self.fail_next = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.serve_forever, name="local-smtp", daemon=True
+        )
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def accept_message(self):
+        with self.lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                return False
+            return True
+
+    def store(self, sender, recipients, data):
+        with self.lock:
+            self.messages.append({"from": sender, "to": list(recipients), "data": data})
+        if self.verbose:
+            print("Message from {} to {}".format(sender, ", ".join(recipients)))
+            print(data)
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, *lines):
+        for line in lines:
+            self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        self.reply("220 localhost SMTP stand-in")
+        sender, recipients = None, []
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+
+            if verb == "EHLO":
+                self.reply("250-localhost", "250-AUTH PLAIN LOGIN", "250 8BITMIME")
+            elif verb == "HELO":
+                self.reply("250 localhost")
+            elif verb == "AUTH":
+                self.reply("235 Authentication successful")
+            elif verb == "MAIL":
+                if not self.server.accept_message():
+                    self.reply("421 Service not available, try again later")
+                    continue
+                sender, recipients = command.split(":", 1)[1].strip(" <>"), []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command.split(":", 1)[1].strip(" <>"))
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                self.server.store(sender, recipients, self.read_data())
+                sender, recipients = None, []
+                self.reply("250 OK")
+            elif verb in ("RSET", "NOOP"):
+                if verb == "RSET":
+                    sender, recipients = None, []
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+    def read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b".\r\n", b".\n"):
+                break
+            # undo the dot stuffing of the client
+            if line.startswith(b".."):
+                line = line[1:]
+            lines.append(line.decode("utf-8", "replace"))
+        return "".join(lines)
+
+
+# python LocalSMTP.py 1025 runs the stand-in and prints every message it receives.
+# point the app at it with smtp_host = "127.0.0.1", smtp_port = "1025", smtp_ssl = "false",
+# smtp_starttls = "false"
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 1025
+    server = LocalSMTPServer(port=port, verbose=True)
+    print("SMTP stand-in listening on {}:{}".format(server.host, server.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
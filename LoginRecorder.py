@@ -0,0 +1,76 @@
+import atexit, queue, threading, time
+
+
+# logins are appended to the login sheet from a background thread.
+# the student's session only puts the row on a queue, the thread drains the queue and writes
+# everything waiting with one values.append request, so a burst of logins costs a handful of calls
+# and two logins can never compute the same row and overwrite each other
+class LoginRecorder:
+    def __init__(self, get_worksheet, batch_size=50, flush_interval=2.0):
+        self.get_worksheet = get_worksheet
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.worksheet = None
+
+        self.thread = threading.Thread(
+            target=self.run, name="login-recorder", daemon=True
+        )
+        self.thread.start()
+        # rows still waiting in the queue are written before the process exits
+        atexit.register(self.flush)
+
+    # queue a login row, returns immediately
+    def record(self, *row):
+        with self.lock:
+            # the handle is resolved on the session's thread, streamlit caches can't be used from
+            # the background thread
+            self.worksheet = self.get_worksheet()
+            self.queue.put(list(row))
+
+    def run(self):
+        while True:
+            rows = [self.queue.get()]
+            # wait a little so the logins of a burst end up in the same request
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    rows.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self.write(rows)
+
+    # write everything that is queued right now, without waiting for the background thread
+    def flush(self):
+        rows = []
+        while True:
+            try:
+                rows.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if rows:
+            self.write(rows, retries=3)
+
+    # values.append finds the end of the table on the server side, so no row has to be read first.
+    # failed writes are retried with backoff, the rows stay in memory until they are written
+    def write(self, rows, retries=None):
+        delay = 1
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                with self.write_lock:
+                    self.worksheet.append_rows(rows, table_range="A1")
+                return
+            except Exception as e:
+                if retries is not None and attempt >= retries:
+                    print("Recording {} logins failed: {}".format(len(rows), e))
+                    return
+                print("Recording logins failed, retrying in {}s: {}".format(delay, e))
+                time.sleep(delay)
+                delay = min(delay * 2, 60)
@@ -0,0 +1,269 @@
+import bisect, functools, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# upper bounds in seconds, from a cached page rerun to a throttled Sheets call
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+# cumulative latency histogram per label set, rendered in the Prometheus text format
+class Histogram:
+    def __init__(self, name, description, label_names, buckets=default_buckets):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, seconds, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0}
+                self.series[key] = series
+            series["counts"][bisect.bisect_left(self.buckets, seconds)] += 1
+            series["sum"] += seconds
+
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.description),
+            "# TYPE {} histogram".format(self.name),
+        ]
+        with self.lock:
+            series = sorted(
+                (key, list(value["counts"]), value["sum"])
+                for key, value in self.series.items()
+            )
+        for key, counts, total in series:
+            labels = list(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(
+                    "{}_bucket{} {}".format(
+                        self.name, renderLabels(labels + [("le", bound)]), cumulative
+                    )
+                )
+            lines.append("{}_sum{} {}".format(self.name, renderLabels(labels), total))
+            lines.append(
+                "{}_count{} {}".format(self.name, renderLabels(labels), cumulative)
+            )
+        return lines
+
+
+def renderLabels(labels):
+    if not labels:
+        return ""
+    return "{{{}}}".format(
+        ",".join(
+            '{}="{}"'.format(
+                name,
+                str(value)
+                .replace("\\", "\\\\")
+                .replace("\n", "\\n")
+                .replace('"', '\\"'),
+            )
+            for name, value in labels
+        )
+    )
+
+
+reruns = Histogram(
+    "survey_rerun_seconds",
+    "Script.py reruns by page, outcome is complete or rerun (ended by st.experimental_rerun)",
+    ("page", "outcome"),
+)
+helpers = Histogram(
+    "survey_helper_seconds",
+    "Calls of the storage and email helpers of Script.py",
+    ("helper",),
+)
+sheets_calls = Histogram(
+    "survey_sheets_call_seconds",
+    "Google Sheets API calls including throttling and retries, by method and calling helper",
+    ("method", "quota", "helper"),
+)
+smtp_sends = Histogram(
+    "survey_smtp_send_seconds",
+    "SMTP deliveries including retries, by calling helper and outcome",
+    ("helper", "outcome"),
+)
+admission_waits = Histogram(
+    "survey_admission_wait_seconds",
+    "Time students waited for a login slot, outcome is admitted or abandoned",
+    ("outcome",),
+    buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+journal_commits = Histogram(
+    "survey_journal_commit_seconds",
+    "Writes of a group of journal entries to disk including the fsync",
+    (),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+
+histograms = [
+    reruns,
+    helpers,
+    sheets_calls,
+    smtp_sends,
+    admission_waits,
+    journal_commits,
+]
+
+# functions returning extra (name, type, description, [(labels, value)]) families, e.g. the
+# QuotaClient counters
+collectors = []
+collectors_lock = threading.Lock()
+
+local = threading.local()
+
+# seconds spent in the steps of the cold start, the first measurement of each step is kept
+startup = {}
+startup_lock = threading.Lock()
+
+
+def recordStartup(step, seconds):
+    with startup_lock:
+        startup.setdefault(step, seconds)
+
+
+# one line listing the steps, e.g. "imports 0.412s, storage 0.207s"
+def startupReport():
+    with startup_lock:
+        steps = list(startup.items())
+    return ", ".join("{} {:.3f}s".format(step, seconds) for step, seconds in steps)
+
+
+def collectStartup():
+    with startup_lock:
+        steps = list(startup.items())
+    return [
+        (
+            "survey_startup_seconds",
+            "gauge",
+            "Seconds spent in each step of the cold start of the process",
+            [([("step", step)], seconds) for step, seconds in steps],
+        )
+    ]
+
+
+collectors.append(collectStartup)
+
+# submissions that found no voucher code left, the students were asked to get in touch
+missing_vouchers = {"count": 0}
+missing_vouchers_lock = threading.Lock()
+
+
+def recordMissingVoucher():
+    with missing_vouchers_lock:
+        missing_vouchers["count"] += 1
+
+
+def collectMissingVouchers():
+    with missing_vouchers_lock:
+        count = missing_vouchers["count"]
+    return [
+        (
+            "survey_vouchers_missing_total",
+            "counter",
+            "Submissions that found no voucher code left",
+            [([], count)],
+        )
+    ]
+
+
+collectors.append(collectMissingVouchers)
+
+
+def registerCollector(collector):
+    with collectors_lock:
+        collectors.append(collector)
+
+
+# the helper running on this thread, calls made inside it are labelled with its name
+def currentHelper():
+    stack = getattr(local, "helpers", None)
+    return stack[-1] if stack else threading.current_thread().name
+
+
+# decorator timing a helper and labelling the Sheets and SMTP calls made inside it
+def timed(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not hasattr(local, "helpers"):
+            local.helpers = []
+        local.helpers.append(function.__name__)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            helpers.observe(time.perf_counter() - start, helper=function.__name__)
+            local.helpers.pop()
+
+    return wrapper
+
+
+# called at the top of Script.py. A rerun that was left pending on this thread ended with
+# st.experimental_rerun, which skips the end of the script
+def startRerun(page):
+    pending = getattr(local, "rerun", None)
+    if pending is not None:
+        reruns.observe(
+            time.perf_counter() - pending[1], page=pending[0], outcome="rerun"
+        )
+    local.rerun = (page, time.perf_counter())
+
+
+# called at the end of Script.py
+def finishRerun():
+    pending = getattr(local, "rerun", None)
+    local.rerun = None
+    if pending is not None:
+        reruns.observe(
+            time.perf_counter() - pending[1], page=pending[0], outcome="complete"
+        )
+
+
+# the families of the registered collectors
+def collect():
+    with collectors_lock:
+        return [family for collector in collectors for family in collector()]
+
+
+def render():
+    lines = []
+    for histogram in histograms:
+        lines.extend(histogram.render())
+    for name, kind, description, samples in collect():
+        lines.append("# HELP {} {}".format(name, description))
+        lines.append("# TYPE {} {}".format(name, kind))
+        for labels, value in samples:
+            lines.append("{}{} {}".format(name, renderLabels(labels), value))
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# serves GET /metrics from a background thread. Bound to localhost by default, it is an admin route
+def startServer(port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    ).start()
+    return server
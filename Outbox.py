@@ -0,0 +1,177 @@
+import atexit, os, queue, random, smtplib, threading, time
+
+# latency histograms and the /metrics route
+import Metrics
+
+
+# dropped connections, network errors and 4xx replies are worth another attempt,
+# 5xx replies (bad address, rejected message) are not
+def isTransientError(error):
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    return isinstance(error, (smtplib.SMTPServerDisconnected, OSError))
+
+
+# emails are sent from a background thread, so the page returns as soon as the message is queued.
+# the thread keeps one authenticated SMTP connection open and sends the messages in order.
+# yagmail's own send() logs in again for every message, so only its login and message
+# building are used and the message is handed to the open connection directly
+class Outbox:
+    def __init__(
+        self,
+        user,
+        password,
+        host="smtp.gmail.com",
+        port=None,
+        smtp_ssl=True,
+        smtp_starttls=None,
+        smtp_skip_login=False,
+        max_attempts=5,
+        idle_check_seconds=60,
+    ):
+        self.user = user
+        self.password = password
+        self.smtp_options = {
+            "host": host,
+            "port": port,
+            "smtp_ssl": smtp_ssl,
+            "smtp_starttls": smtp_starttls,
+            "smtp_skip_login": smtp_skip_login,
+        }
+        self.max_attempts = max_attempts
+        self.idle_check_seconds = idle_check_seconds
+        self.yag = None
+        self.last_used = 0
+        self.sent = 0
+        self.failed = 0
+        self.queue = queue.Queue()
+
+        self.thread = threading.Thread(target=self.run, name="outbox", daemon=True)
+        self.thread.start()
+        Metrics.registerCollector(self.collect)
+        # give queued messages a chance to go out before the process exits
+        atexit.register(self.shutdown)
+
+    # queue a message, returns immediately.
+    # on_done is called from the outbox thread with True once sent, or False when it was given up
+    def send(self, to, subject, contents, on_done=None):
+        self.queue.put((to, subject, contents, on_done, Metrics.currentHelper()))
+
+    # block until every queued message was sent or given up, returns False on timeout
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def run(self):
+        while True:
+            to, subject, contents, on_done, helper = self.queue.get()
+            try:
+                start = time.perf_counter()
+                sent = self.deliver(to, subject, contents)
+                Metrics.smtp_sends.observe(
+                    time.perf_counter() - start,
+                    helper=helper,
+                    outcome="sent" if sent else "failed",
+                )
+                if on_done is not None:
+                    on_done(sent)
+            except Exception as e:
+                print("Outbox callback failed: {}".format(e))
+            finally:
+                self.queue.task_done()
+
+    def deliver(self, to, subject, contents):
+        delay = 1
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.connect()
+                recipients, msg_string = self.yag.prepare_send(to, subject, contents)
+                self.yag.smtp.sendmail(self.yag.user, recipients, msg_string)
+                self.last_used = time.monotonic()
+                self.sent += 1
+                print("Sent email successfully")
+                return True
+            except Exception as e:
+                self.disconnect()
+                if not isTransientError(e) or attempt == self.max_attempts:
+                    self.failed += 1
+                    print("Sending email to {} failed: {}".format(to, e))
+                    return False
+                # exponential backoff with jitter
+                time.sleep(delay + random.uniform(0, delay))
+                delay = min(delay * 2, 60)
+
+    # reuse the open connection, gmail closes idle connections so one that was idle
+    # for a while is checked with a NOOP first
+    def connect(self):
+        if self.yag is not None and not self.yag.is_closed:
+            if time.monotonic() - self.last_used < self.idle_check_seconds:
+                return
+            try:
+                if self.yag.smtp.noop()[0] == 250:
+                    return
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.disconnect()
+
+        # yagmail to handle the email communication, imported by the first delivery
+        import yagmail
+
+        self.yag = yagmail.SMTP(self.user, self.password, **self.smtp_options)
+        self.yag.login()
+        self.last_used = time.monotonic()
+
+    def disconnect(self):
+        if self.yag is not None:
+            try:
+                self.yag.close()
+            except Exception:
+                pass
+        self.yag = None
+
+    # the counters as Prometheus counter families
+    def collect(self):
+        return [
+            ("survey_emails_sent_total", "counter", "Emails sent", [([], self.sent)]),
+            (
+                "survey_emails_failed_total",
+                "counter",
+                "Emails given up",
+                [([], self.failed)],
+            ),
+            (
+                "survey_outbox_queued",
+                "gauge",
+                "Emails waiting in the outbox",
+                [([], self.queue.qsize())],
+            ),
+        ]
+
+    def shutdown(self):
+        self.join(timeout=30)
+        self.disconnect()
+
+
+# an outbox for the account and SMTP server of the env, gmail_id and gmail_app_password (a token
+# for gmail) log in to smtp_host, gmail by default
+def openOutbox():
+    return Outbox(
+        os.environ.get("gmail_id"),
+        os.environ.get("gmail_app_password"),
+        host=os.environ.get("smtp_host") or "smtp.gmail.com",
+        port=os.environ.get("smtp_port") or None,
+        smtp_ssl=os.environ.get("smtp_ssl", "true").lower() != "false",
+        # left to yagmail when empty, it uses STARTTLS when smtp_ssl is off
+        smtp_starttls={"true": True, "false": False}.get(
+            os.environ.get("smtp_starttls", "").lower()
+        ),
+        smtp_skip_login=os.environ.get("smtp_skip_login", "false").lower() == "true",
+    )
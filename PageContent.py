@@ -0,0 +1,253 @@
+import functools
+
+# the static content of the pages, rendered by Script.renderContent.
+# a page is a tuple of (element, text) blocks: "header", "subheader", "markdown", "html" (markdown
+# with unsafe_allow_html), "template" (html formatted with the dynamic values) and "balloons".
+# the blocks of a page are built on its first render and kept for the life of the process, keyed
+# by the page and the condition, so a rerun only renders them
+
+# static styles for the page
+title_alignment = """
+<style>
+#the-title {
+  text-align: center
+}
+.block-container {
+padding: 2rem 1rem;
+}
+#feedback-on-your-2nd-psy2008-essay{
+border-bottom: 1px solid silver;
+text-align: center
+}
+.stSlider  p{
+margin-bottom: 15px
+}
+
+.stSlider  > div{
+margin-bottom: 20px
+}
+.amazon_voucher{
+text-align: center;
+border: 1px solid black;
+border-radius: 10px;
+padding: 10px;
+font-weight: bold;
+font-size: 3rem;
+}
+#welcome-to-the-survey-by-school-of-psychology{
+text-align: center;
+}
+.stSlider > div, .stSlider p{
+margin-bottom: 0 !important;
+}
+
+.st-fw{
+padding-top: 5px;
+}
+</style>
+"""
+
+# empty heading pushing the content of a page down
+spacer = '<h1 style="text-align: center; margin-top: 2rem;">&nbsp;</h1>'
+
+# the statements rated on the survey page, each rated for the original (A) and alternative (B)
+# feedback by the sliders Q1A, Q1B, ...
+survey_statements = (
+    ("Q1", "The feedback was clear and easy to understand."),
+    ("Q2", "The feedback provided specific suggestions for improvement."),
+    ("Q3", "Overall, I found the feedback helpful."),
+    ("Q4", " I am satisfied with the quality of the feedback."),
+)
+
+consent_statements = (
+    "1.\tI have read and understood the information about the study.",
+    "2.\tI understand that my participation is entirely voluntary and that I am free to withdraw during the study at any time without giving a reason.",
+    "3.\tI understand that my involvement in this research is strictly anonymous and that my participating is confidential. ",
+    "4.\tI understand that my anonymised data will be published in a public repository.",
+    "5.\tI consent to my data being made available anonymously in a public repository.",
+    "6.\tI consent to participate in this study.",
+)
+
+
+def instructionsPage(instructions_first):
+    return (
+        (
+            "html",
+            """ # Evaluating the quality of feedback on student assignments
+
+You are being invited to take part in a research study looking at students’ evaluation of the feedback they receive on their written assignments.
+
+<strong>You were chosen as a participant because you are a Year 1 student in the BSc Psychology undergraduate programme at QUB.
+Before you decide to take part in this study it is important for you to understand what the research will involve. Please take time to read the following information and do not hesitate to contact us should you require any further details.</strong>
+
+In this survey, we will show you the feedback you received on one of your written assignments, namely your Semester 2 essay on individual differences. We will also show you an alternative version of that feedback.
+
+Once you have read both versions of the feedback, we will ask you to rate their quality using four statements each.
+The study should take <span style="color:red;font-weight:bold">no more than 20 minutes</span> to complete. So please take the time and read both versions of the feedback thoroughly before rating their quality. <span style="color:red;font-weight:bold">You will receive an Amazon voucher worth £15 for your time. Please continue until the very end of this questionnaire to receive your compensation.</span>
+
+Your participation is entirely voluntary, and you have the right to withdraw at any time during the study by closing this webpage. If you decide to close this webpage before the end of the questionnaire, your partial response will be deleted as a matter of course. Once you have completed the study, you will not be able to withdraw your data.
+Please note: Your participation in our study will be treated with confidentiality. The data we gather from you and other participants during this study will be fully anonymised prior to analysis so that no one will be able to link the data to you personally. In addition, we will not share your evaluations with your tutors who provided the feedback. Therefore, you can be completely honest in your evaluations.
+Since the data we collect from you may be of interest to other researchers, we will publish it on a publicly accessible online data repository. At that point, anyone will have access to your anonymised (i.e., non-identifiable) data.
+
+Our research depends crucially on the generous help of participants like yourself. We hope that you can assist us with this project.
+
+If you have any further queries, please do not hesitate to contact Dr Thomas Schultze at <span style="color:red">t.schultze@qub.ac.uk</span>
+ """,
+        ),
+    )
+
+
+def consentPage(instructions_first):
+    return (
+        ("header", "Consent to taking part in the study."),
+        (
+            "markdown",
+            "Please tick each statement to indicate your agreement. If left unmarked, you will not be able to proceed to the questionnaire.",
+        ),
+    )
+
+
+def noConsentPage(instructions_first):
+    return (
+        ("html", spacer),
+        (
+            "subheader",
+            "You have not provided consent to take part in our study. Nonetheless, we thank you for considering to take part.",
+        ),
+        ("subheader", "You can now close your browser."),
+        (
+            "html",
+            """If you withheld consent to take part accidentally and would like to participate, please contact <br/>
+        Dr Thomas Schultze-Gerlach (t.schultze@qub.ac.uk)""",
+        ),
+    )
+
+
+# the instructions before the survey, only the students shown them first are told about the AI
+def conditionalInstructions1Page(instructions_first):
+    essay = (
+        "markdown",
+        "In this study, we will show you the feedback you received on your PSY1008 essay on individual differences where you compared the personality theories of Freud and Rogers.",
+    )
+    alternative = (
+        "markdown",
+        "In addition to the actual feedback you received from your tutor, we will show you an alternative version of that feedback.",
+    )
+    important = (
+        "markdown",
+        "**Important:** Remember that your responses will be treated confidentially. That is, your tutor will not see how you rated their feedback, and you can be completely honest in your assessment of that feedback.",
+    )
+    if instructions_first:
+        return (
+            ("header", "Instructions:"),
+            essay,
+            alternative,
+            (
+                "markdown",
+                """We would like to briefly explain how we created the alternative version of the feedback. To create it, we took the original feedback provided by your tutor and fed it into an AI, more specifically, a large language model (LLM). The LLM we used was ChatGPT, which you might be familiar with. We instructed the AI to take the original feedback and make it constructive and encouraging . The result is what we call **AI-augmented feedback**. AI-augmented feedback differs from AI-generated feedback in that it is based on human evaluation of your essay instead of an AI attempting to evaluate and provide feedback on its own.""",
+            ),
+            (
+                "markdown",
+                """We would kindly ask you to read both versions of the feedback on your essay thoroughly. Once you have read them, please rate each version using a set of four statements. Please also state which version of the feedback you would prefer if you had to choose between them and describe briefly why you prefer one version of the feedback over the other.""",
+            ),
+            important,
+        )
+    return (
+        ("html", spacer),
+        ("header", "Instructions:"),
+        essay,
+        alternative,
+        (
+            "markdown",
+            "We would kindly ask you to read both versions of the feedback on your essay thoroughly. Once you have read them, please rate each version using a set of four statements. Please also state which version of the feedback you would prefer if you had to choose between them and describe briefly why you prefer one version of the feedback over the other.",
+        ),
+        important,
+    )
+
+
+# the debriefing after the survey, the other students learn about the AI here
+def conditionalInstructions2Page(instructions_first):
+    aim = (
+        "markdown",
+        "The aim of our study was to investigate how students would evaluate AI-augmented feedback relative to the original feedback they actually received and which the augmented feedback was based on. The reason why we study AI-augmented feedback is because we want to provide our students with the best possible feedback. Augmenting human feedback with AI might be a way to improve the quality of feedback while making sure that feedback still entails human evaluation of the assignment.",
+    )
+    thanks = (
+        "markdown",
+        "By taking part in our study, you have provided valuable information on the perceived quality of AI-augmented feedback relative to purely human feedback. Thank you again for taking the time!",
+    )
+    heading = (
+        ("html", spacer),
+        ("header", "Thank you for taking part in this study:"),
+    )
+    if instructions_first:
+        return heading + (aim, thanks)
+    return heading + (
+        (
+            "markdown",
+            "Before, we tell you what the aim of our study was, we would first like to briefly explain how we created the alternative version of the feedback you just read. To create it, we took the original feedback provided by your tutor and fed it into an AI, more specifically, a large language model (LLM). The LLM we used was ChatGPT, which you might be familiar with. We instructed the AI to take the original feedback and make it constructive and encouraging. The result is what we call **AI-augmented feedback**. AI-augmented feedback differs from AI-generated feedback in that it is based on human evaluation of your essay instead of an AI attempting to evaluate and provide feedback on its own.",
+        ),
+        aim,
+        thanks,
+    )
+
+
+def voucherPage(instructions_first):
+    return (
+        ("balloons", None),
+        (
+            "html",
+            '<h1 style="text-align: center; margin-top: 3rem;">Thank you for taking the survey</h1>',
+        ),
+        (
+            "html",
+            "<h4 style='text-align: justify;'>You have now completed the study. As mentioned initially, we would like to express our gratitude for your taking part in our study by giving you a £15 Amazon voucher as compensation for your time and effort. </h4>",
+        ),
+        (
+            "markdown",
+            "Here is the code for your voucher (we will also send you an email with the code so that you do not have to write it down):",
+        ),
+        (
+            "template",
+            r'<div style="text-align: center;"><span class="amazon_voucher">{amazon_voucher}</span></div>',
+        ),
+        (
+            "html",
+            "<div style='text-align: center;'><br/><br/>Thanks again! You can now close your browser.</div>",
+        ),
+    )
+
+
+# the voucher page of a student who submitted when no code was left
+def noVoucherPage(instructions_first):
+    return (
+        ("balloons", None),
+        (
+            "html",
+            '<h1 style="text-align: center; margin-top: 3rem;">Thank you for taking the survey</h1>',
+        ),
+        (
+            "html",
+            "<h4 style='text-align: justify;'>You have now completed the study and your answers are saved. We have run out of voucher codes for the moment, kindly get in touch with t.schultze@qub.ac.uk and we will send you your £15 Amazon voucher.</h4>",
+        ),
+        (
+            "html",
+            "<div style='text-align: center;'><br/><br/>Thanks again! You can now close your browser.</div>",
+        ),
+    )
+
+
+builders = {
+    "Instructions_page": instructionsPage,
+    "Consent_page": consentPage,
+    "Do_not_consent_page": noConsentPage,
+    "Conditional_Instructions_1_page": conditionalInstructions1Page,
+    "Conditional_Instructions_2_page": conditionalInstructions2Page,
+    "Voucher_page": voucherPage,
+    "No_voucher_page": noVoucherPage,
+}
+
+
+# the blocks of a page for one condition, built on the first call
+@functools.lru_cache(maxsize=None)
+def blocks(page, instructions_first=True):
+    return builders[page](bool(instructions_first))
@@ -0,0 +1,61 @@
+import hashlib, hmac, secrets, time
+
+
+# login pass codes signed with a server secret instead of kept in the session.
+# the code is an HMAC of the email, the student ID and the current time window, so any process
+# holding the same secret can check it without shared state, and a code sent again within the
+# window is the same code. A code is accepted in its own window and the `windows - 1` after it
+class Passcodes:
+    def __init__(self, secret, window_minutes=30, windows=2, length=8):
+        if not secret:
+            # a random secret only verifies in this process, set passcode_secret for replicas
+            print("passcode_secret is not set, pass codes only work in this process")
+            secret = secrets.token_hex(32)
+        self.secret = secret.encode("utf-8")
+        self.window_seconds = window_minutes * 60
+        self.windows = windows
+        self.length = length
+
+    def window(self, now=None):
+        return int((time.time() if now is None else now) // self.window_seconds)
+
+    def sign(self, email, student_id, window):
+        message = "{}|{}|{}".format(
+            email.strip().lower(), str(student_id).strip(), window
+        )
+        return hmac.new(
+            self.secret, message.encode("utf-8"), hashlib.sha256
+        ).hexdigest()[: self.length]
+
+    def issue(self, email, student_id, now=None):
+        return self.sign(email, student_id, self.window(now))
+
+    # compared as bytes, compare_digest raises on strings with non-ASCII characters
+    def verify(self, email, student_id, passcode, now=None):
+        passcode = (passcode or "").strip().lower().encode("utf-8")
+        current = self.window(now)
+        return any(
+            hmac.compare_digest(
+                passcode, self.sign(email, student_id, window).encode("utf-8")
+            )
+            for window in range(current - self.windows + 1, current + 1)
+        )
+
+    # the token of the resume link, "<nonce>.<signature>". The nonce names the checkpoint of the
+    # student and is kept in it, so a new login of the student makes the older links useless
+    def resumeToken(self, nonce):
+        return "{}.{}".format(nonce, self.signResume(nonce))
+
+    def signResume(self, nonce):
+        return hmac.new(
+            self.secret, "resume|{}".format(nonce).encode("utf-8"), hashlib.sha256
+        ).hexdigest()[:16]
+
+    # the nonce of a token signed with the secret, None otherwise
+    def readResumeToken(self, token):
+        nonce, _, signature = (token or "").rpartition(".")
+        if not nonce or not hmac.compare_digest(
+            signature.encode("utf-8"), self.signResume(nonce).encode("utf-8")
+        ):
+            return None
+        return nonce
@@ -0,0 +1,262 @@
+import copy, random, threading, time
+
+# gspread library handles the connectivity between python and Google Sheets
+import gspread
+
+# latency histograms and the /metrics route
+import Metrics
+
+# gspread methods by the quota they count against. Other attributes are passed through untouched
+read_methods = {
+    "open",
+    "open_by_key",
+    "open_by_url",
+    "worksheets",
+    "worksheet",
+    "get_worksheet",
+    "get_all_values",
+    "get_all_records",
+    "get_values",
+    "get",
+    "batch_get",
+    "col_values",
+    "row_values",
+    "acell",
+    "cell",
+    "find",
+    "findall",
+}
+write_methods = {
+    "update",
+    "batch_update",
+    "update_cell",
+    "update_cells",
+    "append_row",
+    "append_rows",
+    "insert_row",
+    "insert_rows",
+    "delete_rows",
+    "add_rows",
+    "resize",
+    "clear",
+    "batch_clear",
+}
+
+# status codes worth another attempt. Writes are only retried on 429, a 5xx may have been applied
+retry_read_codes = {429, 500, 502, 503, 504}
+retry_write_codes = {429}
+
+
+# refills rate tokens per minute up to capacity, take() blocks until a token is free
+class TokenBucket:
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or max(1, per_minute // 6)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # returns the seconds spent waiting for the token
+    def take(self):
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+def statusCode(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+# wraps the gspread client returned by getGoogleService. Every Sheets call takes a token from the
+# bucket of its quota class and is retried with exponential backoff and jitter on 429 and 5xx.
+# identical reads that are in flight at the same time, e.g. the roster being loaded by several
+# sessions, share one request. The spreadsheets and worksheets it returns are wrapped the same way
+class QuotaClient:
+    def __init__(
+        self,
+        client,
+        reads_per_minute=60,
+        writes_per_minute=60,
+        max_retries=5,
+        backoff_base=1.0,
+        backoff_max=32.0,
+    ):
+        self.client = client
+        self.buckets = {
+            "read": TokenBucket(reads_per_minute),
+            "write": TokenBucket(writes_per_minute),
+        }
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.in_flight = {}
+        self.in_flight_lock = threading.Lock()
+        self.counters_lock = threading.Lock()
+        self.counters = {
+            quota: {
+                "calls": 0,
+                "requests": 0,
+                "throttled": 0,
+                "throttled_seconds": 0.0,
+                "retried": 0,
+                "coalesced": 0,
+                "failed": 0,
+            }
+            for quota in self.buckets
+        }
+        Metrics.registerCollector(self.collect)
+
+    def __getattr__(self, name):
+        return wrapAttribute(self, self.client, name)
+
+    def count(self, quota, counter, amount=1):
+        with self.counters_lock:
+            self.counters[quota][counter] += amount
+
+    # a copy of the counters, per quota class
+    def stats(self):
+        with self.counters_lock:
+            return copy.deepcopy(self.counters)
+
+    # the counters as Prometheus counter families
+    def collect(self):
+        stats = self.stats()
+        return [
+            (
+                "survey_sheets_quota_{}_total".format(counter),
+                "counter",
+                "QuotaClient {} per quota class".format(counter.replace("_", " ")),
+                [
+                    ([("quota", quota)], stats[quota][counter])
+                    for quota in sorted(stats)
+                ],
+            )
+            for counter in stats["read"]
+        ]
+
+    def call(self, quota, key, function):
+        self.count(quota, "calls")
+        if quota != "read":
+            return self.request(quota, function)
+
+        # the first caller of a read makes the request, callers arriving while it is in flight
+        # wait for it and get a copy of the result
+        with self.in_flight_lock:
+            flight = self.in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = {"done": threading.Event(), "result": None, "error": None}
+                self.in_flight[key] = flight
+
+        if not leader:
+            self.count(quota, "coalesced")
+            flight["done"].wait()
+            if flight["error"] is not None:
+                raise flight["error"]
+            return copyResult(flight["result"])
+
+        try:
+            flight["result"] = self.request(quota, function)
+            return flight["result"]
+        except Exception as e:
+            flight["error"] = e
+            raise
+        finally:
+            with self.in_flight_lock:
+                del self.in_flight[key]
+            flight["done"].set()
+
+    def request(self, quota, function):
+        retry_codes = retry_read_codes if quota == "read" else retry_write_codes
+        for attempt in range(self.max_retries + 1):
+            waited = self.buckets[quota].take()
+            if waited:
+                self.count(quota, "throttled")
+                self.count(quota, "throttled_seconds", waited)
+            self.count(quota, "requests")
+            try:
+                return function()
+            except gspread.exceptions.APIError as e:
+                if statusCode(e) not in retry_codes or attempt == self.max_retries:
+                    self.count(quota, "failed")
+                    raise
+            # exponential backoff with full jitter
+            self.count(quota, "retried")
+            time.sleep(
+                random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+            )
+
+
+# spreadsheets and worksheets returned by the client go through the same quota
+class QuotaProxy:
+    def __init__(self, quota_client, target):
+        self._quota_client = quota_client
+        self._target = target
+
+    def __getattr__(self, name):
+        return wrapAttribute(self._quota_client, self._target, name)
+
+    def __repr__(self):
+        return repr(self._target)
+
+
+def wrapAttribute(quota_client, target, name):
+    attribute = getattr(target, name)
+    if name in read_methods:
+        quota = "read"
+    elif name in write_methods:
+        quota = "write"
+    else:
+        return attribute
+
+    def call(*args, **kwargs):
+        key = (id(target), name, repr(args), repr(sorted(kwargs.items())))
+        start = time.perf_counter()
+        try:
+            result = quota_client.call(quota, key, lambda: attribute(*args, **kwargs))
+        finally:
+            Metrics.sheets_calls.observe(
+                time.perf_counter() - start,
+                method=name,
+                quota=quota,
+                helper=Metrics.currentHelper(),
+            )
+        return wrapResult(quota_client, result)
+
+    return call
+
+
+# data is copied for the callers sharing a read, spreadsheet and worksheet handles are shared
+def copyResult(result):
+    if isWrappable(result) or (
+        isinstance(result, list) and result and isWrappable(result[0])
+    ):
+        return result
+    return copy.deepcopy(result)
+
+
+def wrapResult(quota_client, result):
+    if isinstance(result, list) and result and isWrappable(result[0]):
+        return [QuotaProxy(quota_client, item) for item in result]
+    if isWrappable(result):
+        return QuotaProxy(quota_client, result)
+    return result
+
+
+# spreadsheets and worksheets, of gspread or anything shaped like them
+def isWrappable(value):
+    return not isinstance(value, QuotaProxy) and (
+        hasattr(value, "worksheets") or hasattr(value, "get_all_values")
+    )
@@ -1,26 +1,47 @@
-import os, time
+import contextlib, os, secrets, time
 from datetime import datetime
 
-# yagmail to handle the email communication
-import yagmail
-
-import numpy as np
-
-# uuid used to generate unique hashs
-import uuid
+# the first run of the script imports the modules of the app, reported as the imports step of the startup
+imports_started = time.perf_counter()
 
 # dotenv library loads env files into the python environment.
 from dotenv import load_dotenv
 
-# gspread library handles the connectivity between python and Google Sheets
-import gspread
-
 # streamlit library holds all the web components to render the webpage  https://docs.streamlit.io/library/api-reference
 import streamlit as st
 
 # The feedback contents are imported from the file ./EssayContent.py
 import EssayContent
 
+# the static text of the pages, built once per page and condition
+import PageContent
+
+# storage backends for the logins, roster, feedback and results
+from Storage import openStorage, openSharedCache
+
+# background sender for the emails
+from Outbox import openOutbox
+
+# record of the emails already sent, so page reruns don't send them again
+from DeliveryLedger import DeliveryLedger
+
+# signed pass codes, any process with the secret can check them
+from Passcode import Passcodes
+
+# balanced block randomization of the experimental conditions
+from ConditionAssigner import ConditionAssigner
+
+# latency histograms of reruns, helpers, Sheets and SMTP calls, served on /metrics
+import Metrics
+
+# caps the logins working at the same time, the others wait in a queue
+from AdmissionControl import AdmissionController
+
+# opens the storage and preloads the sheets in the background when the process boots
+from WarmUp import WarmUp
+
+Metrics.recordStartup("imports", time.perf_counter() - imports_started)
+
 # Load the env variables from .env
 load_dotenv()
 
@@ -30,123 +51,98 @@ horizontal_line_red_dotted = (
 )
 
 
-# the entire file runs for every page event and google sheets has limitation to connect. So making connection at funcitonal level
+# the entire file runs for every page event and google sheets has limitation to connect.
+# So the storage (Google Sheets or the local sqlite file, see storage_backend) is opened once and
+# shared by all sessions of the process
 @st.cache_resource
-def getGoogleService():
-    return gspread.service_account_from_dict(
-        {
-            "type": os.environ.get("type"),
-            "project_id": os.environ.get("project_id"),
-            "private_key_id": os.environ.get("private_key_id"),
-            "private_key": os.environ.get("private_key"),
-            "client_email": os.environ.get("client_email"),
-            "client_id": os.environ.get("client_id"),
-            "auth_uri": os.environ.get("auth_uri"),
-            "token_uri": os.environ.get("token_uri"),
-            "auth_provider_x509_cert_url": os.environ.get(
-                "auth_provider_x509_cert_url"
-            ),
-            "client_x509_cert_url": os.environ.get("client_x509_cert_url"),
-            "universe_domain": os.environ.get("universe_domain"),
-        }
-    )
+def getStorage():
+    try:
+        return getWarmUp().storage()
+    except Exception:
+        # the warm-up keeps the error of opening the storage, the next session starts a new one
+        getWarmUp.clear()
+        raise
 
 
-def getSheetConnection():
-    gs = getGoogleService()
-    return gs.open_by_url(os.environ.get("google_sheet"))
+# started by the first run of the process, after its page is rendered. warm_up = "0" only opens
+# the storage and loads the sheets when the students need them
+@st.cache_resource
+def getWarmUp():
+    return WarmUp(openStorage, preload=os.environ.get("warm_up", "1") != "0")
 
 
-def getWorkSheet(index):
-    sh = getSheetConnection()
-    return sh.get_worksheet(index)
+# the condition counter lives in a local sqlite file shared by the processes of the app.
+# conditions is a comma separated list, the first one shows the instructions before the survey
+@st.cache_resource
+def getConditionAssigner():
+    return ConditionAssigner(
+        os.environ.get("condition_db_path") or "conditions.db",
+        [
+            condition.strip()
+            for condition in os.environ.get(
+                "conditions", "instructions_first,instructions_after"
+            ).split(",")
+            if condition.strip()
+        ],
+        block_size=int(os.environ.get("condition_block_size") or 0) or None,
+        seed=os.environ.get("condition_seed", ""),
+    )
 
 
 # define helper functions
-# To insert a new element, the next available row index is calculated
-def api_get_available_index(worksheet):
-    list_of_lists = worksheet.get_all_values()
-    return len(list_of_lists) + 1
-
-
 # insert the time student logs in
-# also decide the instruction condition based on the odd or even login order
+# also assign the instruction condition, balanced over blocks of logins
+@Metrics.timed
 def api_record_login_time():
-    login_info_sheet = getWorkSheet(0)
-    r = api_get_available_index(login_info_sheet)
-
-    st.session_state["show_instructions_first"] = r % 2 == 0
-
-    login_info_sheet.update(
-        r"A{}:C{}".format(r, r),
-        [
-            [
-                st.session_state["student_email"],
-                st.session_state["student_ID"],
-                datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
-            ]
-        ],
+    assigner = getConditionAssigner()
+    condition = assigner.assign(st.session_state["student_ID"].strip())
+    st.session_state["condition"] = condition
+    st.session_state["show_instructions_first"] = condition == assigner.conditions[0]
+    # names the checkpoint of this login in the resume link
+    st.session_state["resume_nonce"] = secrets.token_urlsafe(12)
+
+    getStorage().record_login(
+        st.session_state["student_email"],
+        st.session_state["student_ID"],
+        datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
+        condition,
     )
 
 
+# returns true when there is no feedback for the student
+@Metrics.timed
 def getFeedbacksForStudentID(id):
-    feedbacks_sheet = getWorkSheet(2)
-    statements = feedbacks_sheet.findall(str(id))
-
-    questions = [
-        "<b>Strengths of the piece of work:</b><br/>",
-        "<br/><br/><b>What could be improved:</b><br/>",
-        "<br/><br/><b>How to make improvements:</b><br/>",
-    ]
+    feedback = getStorage().lookup_feedback(str(id))
 
-    if len(statements) == 0:
+    if feedback is None:
         return True
 
-    indexes = []
-    for statement in statements:
-        indexes.append(r"B{}".format(statement.row))
-        indexes.append(r"C{}".format(statement.row))
-
-    result = feedbacks_sheet.batch_get(indexes)
-
-    resultArr = np.array(result).flatten().tolist()
-
-    original_fb = ""
-    alternate_fb = ""
-
-    for i, value in enumerate(resultArr):
-        quesIndex = int(i / 2)
-        if i % 2 == 0:
-            original_fb = "".join([original_fb, questions[quesIndex], value])
-        else:
-            alternate_fb = "".join([alternate_fb, questions[quesIndex], value])
-
-    st.session_state["original_feedback_statement"] = original_fb
-    st.session_state["alternate_feedback_statement"] = alternate_fb
+    st.session_state["original_feedback_statement"] = feedback["original"]
+    st.session_state["alternate_feedback_statement"] = feedback["alternate"]
 
     return False
 
 
 # returns boolean
 # verify if the student email or ID is already present in the data sheet. returns true if present
+@Metrics.timed
 def checkStudentDetailsInSheet():
-    data_sheet = getWorkSheet(1)
     student_email = st.session_state["student_email"].strip()
     student_ID = st.session_state["student_ID"].strip()
-    emails = data_sheet.col_values(2)
-    studentIds = data_sheet.col_values(3)
-    participatedStudentIds = data_sheet.col_values(16)
+    student = getStorage().lookup_roster(student_email, student_ID)
+    # the results are written to this row when the survey is submitted
+    st.session_state["roster_row"] = student["email_row"]
 
-    if student_email not in emails or student_ID not in studentIds:
+    if student["email_row"] is None or student["id_row"] is None:
         # if student_email in emails or student_ID in studentIds:
         st.warning(
             "Oops, we can't find your invitation. Please use your university email address and student ID."
         )
         return True
-    elif student_email in emails and student_ID in participatedStudentIds:
+    elif student["participated"]:
         st.warning("You have already attended the survey. Thank you for participating")
         return True
-    elif emails.index(student_email) != studentIds.index(student_ID):
+    elif student["email_row"] != student["id_row"]:
         st.warning(
             "Student Email and Student ID do not match. Please verify your details. "
         )
@@ -164,7 +160,9 @@ def checkStudentDetailsInSheet():
     return False
 
 
-# insert the recorded values
+# insert the recorded values into the student's row, returns True once the write is confirmed.
+# the voucher is only claimed once the answers are safe, from the state kept by the process
+@Metrics.timed
 def api_record_results(
     Q1A,
     Q1B,
@@ -177,47 +175,195 @@ def api_record_results(
     preferred_feedback,
     open_feedback,
 ):
-    data_sheet = getWorkSheet(1)
-    allData = data_sheet.get_all_values()
-    index = 1
-
-    # iterate the rows in data sheet and check if second column(email column) is empty
-    # if empty the amazon voucher is taken and values are updated into the row
-    for items in allData:
-        print(items)
-        if items[1].strip() == st.session_state["student_email"]:
-            st.session_state["amazon_voucher"] = items[0]
-            break
-        index += 1
-
-    data_sheet.update(
-        r"B{}:P{}".format(index, index),
+    storage = getStorage()
+    if not storage.record_results(
+        st.session_state["student_email"],
+        st.session_state["student_ID"],
         [
-            [
-                st.session_state["student_email"],
-                st.session_state["student_ID"],
-                Q1A,
-                Q1B,
-                Q2A,
-                Q2B,
-                Q3A,
-                Q3B,
-                Q4A,
-                Q4B,
-                preferred_feedback,
-                open_feedback,
-                st.session_state["show_instructions_first"],
-                datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
-                st.session_state["student_ID"],
-            ]
+            Q1A,
+            Q1B,
+            Q2A,
+            Q2B,
+            Q3A,
+            Q3B,
+            Q4A,
+            Q4B,
+            preferred_feedback,
+            open_feedback,
         ],
+        st.session_state["show_instructions_first"],
+        row=st.session_state["roster_row"],
+    ):
+        return False
+    voucher = storage.claim_voucher(
+        st.session_state["student_email"], st.session_state["student_ID"]
     )
-    # st.experimental_rerun()
+    if not voucher:
+        # no code left, the voucher page asks the student to get in touch
+        print(
+            "No voucher code left for {} ({})".format(
+                st.session_state["student_ID"], st.session_state["student_email"]
+            )
+        )
+        Metrics.recordMissingVoucher()
+        voucher = ""
+    st.session_state["amazon_voucher"] = voucher
+    return True
+
+
+# emails are queued and sent by one background thread per process over a single warm connection.
+# smtp_host/smtp_port/smtp_ssl can point it at a local stand-in (python LocalSMTP.py 1025)
+@st.cache_resource
+def getOutbox():
+    return openOutbox()
+
+
+# the pass code is derived from the email, the student ID and the time window, signed with
+# passcode_secret. All replicas of the app need the same secret
+@st.cache_resource
+def getPasscodes():
+    return Passcodes(
+        os.environ.get("passcode_secret"),
+        window_minutes=int(os.environ.get("passcode_minutes", 30)),
+        windows=int(os.environ.get("passcode_windows", 2)),
+    )
+
+
+# the cache shared by the processes of the node, it also keeps the progress of the students
+@st.cache_resource
+def getSharedCache():
+    return openSharedCache()
+
+
+# session values making up the progress of a student, saved after every rerun once logged in
+checkpoint_keys = [
+    "web_page",
+    "student_email",
+    "student_ID",
+    "condition",
+    "show_instructions_first",
+    "roster_row",
+    "amazon_voucher",
+    "voucher_email_sent",
+    "final_submit_btn",
+    "resume_nonce",
+    "Q1A",
+    "Q1B",
+    "Q2A",
+    "Q2B",
+    "Q3A",
+    "Q3B",
+    "Q4A",
+    "Q4B",
+]
+
+
+# only written when the progress changed since the last save of the session.
+# the first save puts the resume token in the url (?resume=<token>), the token leads back to the
+# checkpoint through the "resume:<nonce>" entry
+def saveCheckpoint():
+    cache = getSharedCache()
+    if cache is None or st.session_state["web_page"] == "Login_page":
+        return
+    checkpoint = {
+        key: st.session_state[key] for key in checkpoint_keys if key in st.session_state
+    }
+    if checkpoint != st.session_state.get("saved_checkpoint"):
+        student_ID = st.session_state["student_ID"].strip()
+        ttl = int(os.environ.get("checkpoint_ttl_seconds", 7 * 24 * 3600))
+        cache.set("checkpoint:{}".format(student_ID), checkpoint, ttl=ttl)
+        if "resume_nonce" in checkpoint:
+            cache.set(
+                "resume:{}".format(checkpoint["resume_nonce"]), student_ID, ttl=ttl
+            )
+        st.session_state["saved_checkpoint"] = checkpoint
+
+    if "resume_token" not in st.session_state and "resume_nonce" in checkpoint:
+        st.session_state["resume_token"] = getPasscodes().resumeToken(
+            checkpoint["resume_nonce"]
+        )
+        st.experimental_set_query_params(resume=st.session_state["resume_token"])
+
+
+# a new session opened with a resume link (after a dropped connection, or a restart of the app)
+# continues from the checkpoint, on its page and without logging in again. The feedback comes from
+# the feedback store, which is kept in memory and the shared cache, so nothing is read from the
+# sheets and no email is sent
+@Metrics.timed
+def resumeSession():
+    st.session_state["resume_checked"] = True
+    cache = getSharedCache()
+    token = st.experimental_get_query_params().get("resume", [""])[0]
+    nonce = getPasscodes().readResumeToken(token) if cache is not None else None
+    if nonce is None:
+        return
+
+    student_ID = cache.get("resume:{}".format(nonce))
+    checkpoint = cache.get("checkpoint:{}".format(student_ID)) if student_ID else None
+    # an older link of a student who logged in again
+    if not checkpoint or checkpoint.get("resume_nonce") != nonce:
+        return
+
+    for key, value in checkpoint.items():
+        st.session_state[key] = value
+    feedback = getStorage().lookup_feedback(student_ID)
+    if feedback is not None:
+        st.session_state["original_feedback_statement"] = feedback["original"]
+        st.session_state["alternate_feedback_statement"] = feedback["alternate"]
+    st.session_state["email_sent_flag"] = True
+    st.session_state["saved_checkpoint"] = checkpoint
+    st.session_state["resume_token"] = token
+    # the cached resources used above already sent elements, the survey page has to call
+    # st.set_page_config first
+    st.experimental_rerun()
+
+
+# at most admission_max_in_flight logins of the process do their Sheets lookups and emails at once
+@st.cache_resource
+def getAdmissionController():
+    return AdmissionController(int(os.environ.get("admission_max_in_flight", 8)))
+
 
+# runs the block once the session is admitted, showing its place in the queue while it waits
+@contextlib.contextmanager
+def waitingRoom():
+    placeholder = st.empty()
+
+    def on_wait(position):
+        placeholder.info(
+            "Many students are logging in right now. You are number {} in the queue, please keep this page open.".format(
+                position
+            ),
+            icon="⏳",
+        )
+
+    with getAdmissionController().admitted(on_wait):
+        placeholder.empty()
+        yield
+
+
+# one ledger connection per process, the sqlite file is shared by all processes
+@st.cache_resource
+def getDeliveryLedger():
+    return DeliveryLedger(
+        os.environ.get("delivery_ledger_path") or "delivery_ledger.db"
+    )
+
+
+# the metrics of all sessions of the process on http://127.0.0.1:<metrics_port>/metrics,
+# not started when metrics_port is empty
+@st.cache_resource
+def getMetricsServer():
+    port = os.environ.get("metrics_port")
+    if not port:
+        return None
+    try:
+        return Metrics.startServer(port, os.environ.get("metrics_host") or "127.0.0.1")
+    except OSError as e:
+        # e.g. another process of the app already serves the port
+        print("Metrics server not started: {}".format(e))
+        return None
 
-# variables for yagmail configurations
-user = os.environ.get("gmail_id")
-app_password = os.environ.get("gmail_app_password")  # a token for gmail
 
 # initialize state variables for streamlit
 # https://docs.streamlit.io/library/api-reference/session-state
@@ -227,6 +373,9 @@ if "loading" not in st.session_state:
 if "email_sent_flag" not in st.session_state:
     st.session_state["email_sent_flag"] = False
 
+if "voucher_email_sent" not in st.session_state:
+    st.session_state["voucher_email_sent"] = False
+
 if "web_page" not in st.session_state:
     st.session_state["web_page"] = "Login_page"
 
@@ -242,8 +391,11 @@ if "student_ID" not in st.session_state:
 if "student_email" not in st.session_state:
     st.session_state["student_email"] = False
 
-if "system_password" not in st.session_state:
-    st.session_state["system_password"] = uuid.uuid4().hex[:8]
+if "roster_row" not in st.session_state:
+    st.session_state["roster_row"] = None
+
+if "condition" not in st.session_state:
+    st.session_state["condition"] = None
 
 if "show_instructions_first" not in st.session_state:
     st.session_state["show_instructions_first"] = True
@@ -258,41 +410,61 @@ if "alternate_feedback_statement" not in st.session_state:
     st.session_state["alternate_feedback_statement"] = ""
 
 
+# the first run of a session looks for a resume link
+if "resume_checked" not in st.session_state:
+    resumeSession()
+
+
 # trigger email to verify login and send passcode
+@Metrics.timed
 def handleSubmit():
     content = r"Hi, {}({}). Your pass code for the feeback form is {}".format(
         st.session_state["student_email"],
         st.session_state["student_ID"],
-        st.session_state["system_password"].strip(),
+        getPasscodes().issue(
+            st.session_state["student_email"], st.session_state["student_ID"]
+        ),
     )
-    print(content)
 
     # check if voucher is sent already
     if checkStudentDetailsInSheet() == False:
         # if no details present,proceed to send
         subject = "QUB AI Assist Feeback Form"
 
-        with yagmail.SMTP(user, app_password) as yag:
-            yag.send(st.session_state["student_email"], subject, content)
-            print("Sent email successfully")
+        getOutbox().send(st.session_state["student_email"], subject, content)
         st.session_state["email_sent_flag"] = True
         # experimental rerun is like soft refresh to the application to force rendering again
         st.experimental_rerun()
 
 
 # delivers the final email with thank you message and voucher code
+# the voucher page reruns on every interaction, the ledger makes sure the email goes out once per student.
+# the session only stops checking once the ledger has it as sent: an email the outbox gave up on is
+# released and claimed again by the next rerun, and so is a claim left queued for
+# delivery_claim_seconds by a process that died before sending it
+@Metrics.timed
 def sendFinalEmail():
-    content = r"We hightly appreciate your efforts in participating in the feedback. Your amazon voucher code is {}".format(
-        st.session_state["amazon_voucher"]
-    )
+    student_ID = st.session_state["student_ID"].strip()
+    ledger = getDeliveryLedger()
+
+    if ledger.status(student_ID, "voucher") == "sent":
+        st.session_state["voucher_email_sent"] = True
+        return
 
-    with yagmail.SMTP(user, app_password) as yag:
-        yag.send(
+    if ledger.claim(
+        student_ID,
+        "voucher",
+        expire_seconds=int(os.environ.get("delivery_claim_seconds", 900)),
+    ):
+        content = r"We hightly appreciate your efforts in participating in the feedback. Your amazon voucher code is {}".format(
+            st.session_state["amazon_voucher"]
+        )
+        getOutbox().send(
             st.session_state["student_email"],
             "Thank you for participating in the Feedback ",
             content,
+            on_done=ledger.recordOutcome(student_ID, "voucher"),
         )
-        print("Sent email successfully")
     st.session_state["loading"] = True
 
 
@@ -309,19 +481,34 @@ def handleFinalSubmit(
     preferred_feedback,
     open_feedback,
 ):
-    api_record_results(
-        Q1A,
-        Q1B,
-        Q2A,
-        Q2B,
-        Q3A,
-        Q3B,
-        Q4A,
-        Q4B,
-        preferred_feedback,
-        open_feedback,
-    )
-    time.sleep(3)
+    # the write is confirmed by the storage, no need to wait before moving on.
+    # submitting again after a failure writes the same answers to the same row
+    try:
+        saved = api_record_results(
+            Q1A,
+            Q1B,
+            Q2A,
+            Q2B,
+            Q3A,
+            Q3B,
+            Q4A,
+            Q4B,
+            preferred_feedback,
+            open_feedback,
+        )
+    except Exception as e:
+        print(
+            "Recording the results of {} failed: {}".format(
+                st.session_state["student_ID"], e
+            )
+        )
+        saved = False
+    if not saved:
+        st.error(
+            "We could not save your answers. Please try again, if the problem persists kindly get in touch with t.schultze@qub.ac.uk",
+            icon="🚨",
+        )
+        return
 
     # if st.session_state["show_instructions_first"]:
     # st.session_state["web_page"] = "Voucher_page"
@@ -335,11 +522,32 @@ def toggle_final_submit_btn():
     # st.experimental_rerun()
 
 
+# renders the static blocks of a page for the condition of the student, see PageContent.py.
+# values fill in the "template" blocks
+def renderContent(page, **values):
+    for element, text in PageContent.blocks(
+        page, st.session_state["show_instructions_first"]
+    ):
+        if element == "header":
+            st.header(text)
+        elif element == "subheader":
+            st.subheader(text)
+        elif element == "markdown":
+            st.markdown(text)
+        elif element == "html":
+            st.markdown(text, unsafe_allow_html=True)
+        elif element == "template":
+            st.markdown(text.format(**values), unsafe_allow_html=True)
+        elif element == "balloons":
+            st.balloons()
+
+
 # UI components
-# the top level of UI code is an IF else ladder which controls the pages
+# every page is a function rendering it, looked up in the pages registry by st.session_state["web_page"]
 
-# login page starts
-if st.session_state["web_page"] == "Login_page":
+
+# login page
+def renderLoginPage():
     # title renders a h1 element
     st.title(
         "Welcome to the Survey by the School of Psychology.",
@@ -368,7 +576,8 @@ if st.session_state["web_page"] == "Login_page":
         )
 
         if submit_btn:
-            handleSubmit()
+            with waitingRoom():
+                handleSubmit()
 
     if st.session_state["email_sent_flag"] != False:
         st.success(
@@ -380,166 +589,116 @@ if st.session_state["web_page"] == "Login_page":
 
         # on login button click user passcode and system passcode, if match record the time and move to next page
         if login_btn:
-            if password == st.session_state["system_password"]:
-                api_record_login_time()
+            if getPasscodes().verify(
+                st.session_state["student_email"],
+                st.session_state["student_ID"],
+                password,
+            ):
+                try:
+                    with waitingRoom():
+                        api_record_login_time()
+                except Exception as e:
+                    # e.g. the journal write timed out, logging in again records a new login
+                    print(
+                        "Recording the login of {} failed: {}".format(
+                            st.session_state["student_ID"], e
+                        )
+                    )
+                    st.error(
+                        "We could not log you in. Please try again, if the problem persists kindly get in touch with t.schultze@qub.ac.uk",
+                        icon="🚨",
+                    )
+                    return
                 st.session_state["web_page"] = "Instructions_page"
                 # sometimes trigger rerender to navigate
                 st.experimental_rerun()
             else:
                 st.error("Incorrect Pass code! Please try again", icon="🚨")
-# login page ends
 
-# survey page starts
-elif st.session_state["web_page"] == "Survey_page":
+
+# survey page
+def renderSurveyPage():
     # set page to maximum width, to render surveys and input fields
     st.set_page_config(layout="wide")
 
     # beginning of sidebar
+    # the rating panel is a form: the sliders, the choice and the text only reach the server with
+    # one of its buttons, so moving them doesn't rerun the script. The confirmation step is part of
+    # the form too, changes made while confirming are sent with "Yes" or "No"
     with st.sidebar:
         st.markdown(
             horizontal_line_red_dotted,
             unsafe_allow_html=True,
         )
-        st.write("The feedback was clear and easy to understand.")
-        Q1A = st.slider(
-            "**Original** Feedback",
-            min_value=0,
-            max_value=100,
-            step=1,
-            disabled=st.session_state["amazon_voucher"] != False,
-            key="Q1A",
-        )
-        Q1B = st.slider(
-            "**Alternative** Feedback",
-            min_value=0,
-            max_value=100,
-            step=1,
-            key="Q1B",
-            disabled=st.session_state["amazon_voucher"] != False,
-        )
-        st.markdown(
-            horizontal_line_red_dotted,
-            unsafe_allow_html=True,
-        )
-        # Q2
-        st.write("The feedback provided specific suggestions for improvement.")
-        Q2A = st.slider(
-            "**Original** Feedback",
-            min_value=0,
-            max_value=100,
-            step=1,
-            disabled=st.session_state["amazon_voucher"] != False,
-            key="Q2A",
-        )
-        Q2B = st.slider(
-            "**Alternative** Feedback",
-            min_value=0,
-            max_value=100,
-            step=1,
-            key="Q2B",
-            disabled=st.session_state["amazon_voucher"] != False,
-        )
-        st.markdown(
-            horizontal_line_red_dotted,
-            unsafe_allow_html=True,
-        )
-        # Q3
-        st.write("Overall, I found the feedback helpful.")
-        Q3A = st.slider(
-            "**Original** Feedback",
-            min_value=0,
-            key="Q3A",
-            max_value=100,
-            step=1,
-            disabled=st.session_state["amazon_voucher"] != False,
-        )
-        Q3B = st.slider(
-            "**Alternative** Feedback",
-            min_value=0,
-            max_value=100,
-            step=1,
-            key="Q3B",
-            disabled=st.session_state["amazon_voucher"] != False,
-        )
-        st.markdown(
-            horizontal_line_red_dotted,
-            unsafe_allow_html=True,
-        )
-        # Q4
-        st.write(" I am satisfied with the quality of the feedback.")
-        Q4A = st.slider(
-            "**Original** Feedback",
-            min_value=0,
-            max_value=100,
-            step=1,
-            key="Q4A",
-            disabled=st.session_state["amazon_voucher"] != False,
-        )
-        Q4B = st.slider(
-            "**Alternative** Feedback",
-            min_value=0,
-            max_value=100,
-            step=1,
-            key="Q4B",
-            disabled=st.session_state["amazon_voucher"] != False,
-        )
-        st.markdown(
-            horizontal_line_red_dotted,
-            unsafe_allow_html=True,
-        )
-        st.write(
-            "If you had to choose between the two versions of the feedback, which of them would you prefer?"
-        )
-        preferred_feedback = st.radio(
-            "",
-            ["original feedback", "alternative feedback"],
-        )
-        st.markdown(
-            horizontal_line_red_dotted,
-            unsafe_allow_html=True,
-        )
-        open_feedback = st.text_area(
-            "Please tell us in your own words why you prefer one version of the feedback over the other:",
-            "",
-            height=250,
-        )
-
-        st.markdown(
-            horizontal_line_red_dotted,
-            unsafe_allow_html=True,
-        )
-
-        if st.session_state["final_submit_btn"] == False:
-            st.button(
-                "Submit Rating",
-                key="final submit",
-                type="primary",
-                disabled=st.session_state["amazon_voucher"] != False,
-                on_click=toggle_final_submit_btn,
+        with st.form("rating_form"):
+            # a slider for the original (A) and the alternative (B) feedback per statement
+            ratings = []
+            for question, statement in PageContent.survey_statements:
+                st.write(statement)
+                ratings.append(
+                    st.slider(
+                        "**Original** Feedback",
+                        min_value=0,
+                        max_value=100,
+                        step=1,
+                        disabled=st.session_state["amazon_voucher"] != False,
+                        key=question + "A",
+                    )
+                )
+                ratings.append(
+                    st.slider(
+                        "**Alternative** Feedback",
+                        min_value=0,
+                        max_value=100,
+                        step=1,
+                        key=question + "B",
+                        disabled=st.session_state["amazon_voucher"] != False,
+                    )
+                )
+                st.markdown(
+                    horizontal_line_red_dotted,
+                    unsafe_allow_html=True,
+                )
+            st.write(
+                "If you had to choose between the two versions of the feedback, which of them would you prefer?"
             )
-        else:
-            st.write("Are you sure to submit?")
-            confirm_submit_yes = st.button(
-                "Yes, I have reviewed. Submit now.",
-                key="confirm_yes",
-                type="primary",
+            preferred_feedback = st.radio(
+                "",
+                ["original feedback", "alternative feedback"],
             )
-            st.button(
-                "No, edit again.", key="confirm_no", on_click=toggle_final_submit_btn
+            st.markdown(
+                horizontal_line_red_dotted,
+                unsafe_allow_html=True,
             )
-            if confirm_submit_yes:
-                handleFinalSubmit(
-                    Q1A,
-                    Q1B,
-                    Q2A,
-                    Q2B,
-                    Q3A,
-                    Q3B,
-                    Q4A,
-                    Q4B,
-                    preferred_feedback,
-                    open_feedback,
+            open_feedback = st.text_area(
+                "Please tell us in your own words why you prefer one version of the feedback over the other:",
+                "",
+                height=250,
+            )
+
+            st.markdown(
+                horizontal_line_red_dotted,
+                unsafe_allow_html=True,
+            )
+
+            if st.session_state["final_submit_btn"] == False:
+                st.form_submit_button(
+                    "Submit Rating",
+                    type="primary",
+                    disabled=st.session_state["amazon_voucher"] != False,
+                    on_click=toggle_final_submit_btn,
+                )
+            else:
+                st.write("Are you sure to submit?")
+                confirm_submit_yes = st.form_submit_button(
+                    "Yes, I have reviewed. Submit now.",
+                    type="primary",
+                )
+                st.form_submit_button(
+                    "No, edit again.", on_click=toggle_final_submit_btn
                 )
+                if confirm_submit_yes:
+                    handleFinalSubmit(*ratings, preferred_feedback, open_feedback)
     # end of sidebar
 
     # start of main content
@@ -557,105 +716,40 @@ elif st.session_state["web_page"] == "Survey_page":
             st.session_state["alternate_feedback_statement"],
             unsafe_allow_html=True,
         )
-# end of main content
-# survey page ends
-
-# voucher page starts
-elif st.session_state["web_page"] == "Voucher_page":
-    st.balloons()
-    st.markdown(
-        '<h1 style="text-align: center; margin-top: 3rem;">Thank you for taking the survey</h1>',
-        unsafe_allow_html=True,
-    )
+    # end of main content
 
-    st.markdown(
-        "<h4 style='text-align: justify;'>You have now completed the study. As mentioned initially, we would like to express our gratitude for your taking part in our study by giving you a £15 Amazon voucher as compensation for your time and effort. </h4>",
-        unsafe_allow_html=True,
-    )
 
-    st.markdown(
-        "Here is the code for your voucher (we will also send you an email with the code so that you do not have to write it down):",
-    )
+# voucher page, amazon_voucher is "" when no code was left for the student and no email is sent
+def renderVoucherPage():
+    if not st.session_state["amazon_voucher"]:
+        renderContent("No_voucher_page")
+        return
+    renderContent("Voucher_page", amazon_voucher=st.session_state["amazon_voucher"])
+    # once the email is sent, later reruns of the page don't touch the ledger or the outbox
+    if not st.session_state["voucher_email_sent"]:
+        sendFinalEmail()
 
-    st.markdown(
-        r'<div style="text-align: center;"><span class="amazon_voucher">{}</span></div>'.format(
-            st.session_state["amazon_voucher"]
-        ),
-        unsafe_allow_html=True,
-    )
-
-    st.markdown(
-        "<div style='text-align: center;'><br/><br/>Thanks again! You can now close your browser.</div>",
-        unsafe_allow_html=True,
-    )
-    sendFinalEmail()
-# voucher page ends
-
-# Instructions page starts
-elif st.session_state["web_page"] == "Instructions_page":
-    st.markdown(
-        """ # Evaluating the quality of feedback on student assignments
-
-You are being invited to take part in a research study looking at students’ evaluation of the feedback they receive on their written assignments.
-
-<strong>You were chosen as a participant because you are a Year 1 student in the BSc Psychology undergraduate programme at QUB.
-Before you decide to take part in this study it is important for you to understand what the research will involve. Please take time to read the following information and do not hesitate to contact us should you require any further details.</strong>
-
-In this survey, we will show you the feedback you received on one of your written assignments, namely your Semester 2 essay on individual differences. We will also show you an alternative version of that feedback.
 
-Once you have read both versions of the feedback, we will ask you to rate their quality using four statements each.
-The study should take <span style="color:red;font-weight:bold">no more than 20 minutes</span> to complete. So please take the time and read both versions of the feedback thoroughly before rating their quality. <span style="color:red;font-weight:bold">You will receive an Amazon voucher worth £15 for your time. Please continue until the very end of this questionnaire to receive your compensation.</span>
-
-Your participation is entirely voluntary, and you have the right to withdraw at any time during the study by closing this webpage. If you decide to close this webpage before the end of the questionnaire, your partial response will be deleted as a matter of course. Once you have completed the study, you will not be able to withdraw your data.
-Please note: Your participation in our study will be treated with confidentiality. The data we gather from you and other participants during this study will be fully anonymised prior to analysis so that no one will be able to link the data to you personally. In addition, we will not share your evaluations with your tutors who provided the feedback. Therefore, you can be completely honest in your evaluations.
-Since the data we collect from you may be of interest to other researchers, we will publish it on a publicly accessible online data repository. At that point, anyone will have access to your anonymised (i.e., non-identifiable) data.
-
-Our research depends crucially on the generous help of participants like yourself. We hope that you can assist us with this project.
-
-If you have any further queries, please do not hesitate to contact Dr Thomas Schultze at <span style="color:red">t.schultze@qub.ac.uk</span>
- """,
-        unsafe_allow_html=True,
-    )
+# Instructions page
+def renderInstructionsPage():
+    renderContent("Instructions_page")
 
     clicked = st.button("Proceed", type="primary")
 
     if clicked:
         st.session_state["web_page"] = "Consent_page"
         st.experimental_rerun()
-# Instructions page ends
 
-# Consent page starts
-elif st.session_state["web_page"] == "Consent_page":
-    st.header("Consent to taking part in the study.")
-    st.markdown(
-        "Please tick each statement to indicate your agreement. If left unmarked, you will not be able to proceed to the questionnaire."
-    )
 
-    agree1 = st.checkbox(
-        "1.	I have read and understood the information about the study."
-    )
-    agree2 = st.checkbox(
-        "2.	I understand that my participation is entirely voluntary and that I am free to withdraw during the study at any time without giving a reason."
-    )
-    agree3 = st.checkbox(
-        "3.	I understand that my involvement in this research is strictly anonymous and that my participating is confidential. "
-    )
-    agree4 = st.checkbox(
-        "4.	I understand that my anonymised data will be published in a public repository."
-    )
-    agree5 = st.checkbox(
-        "5.	I consent to my data being made available anonymously in a public repository."
-    )
-    agree6 = st.checkbox("6.	I consent to participate in this study.")
+# Consent page
+def renderConsentPage():
+    renderContent("Consent_page")
+
+    agreed = [st.checkbox(statement) for statement in PageContent.consent_statements]
 
     if st.button(
         "I do Consent, Proceed.",
-        disabled=not agree1
-        or not agree2
-        or not agree3
-        or not agree4
-        or not agree5
-        or not agree6,
+        disabled=not all(agreed),
         type="primary",
     ):
         # if st.session_state["show_instructions_first"]:
@@ -666,66 +760,20 @@ elif st.session_state["web_page"] == "Consent_page":
 
     if st.button(
         "I do not Consent",
-        disabled=agree1 and agree2 and agree3 and agree4 and agree5 and agree6,
+        disabled=all(agreed),
     ):
         st.session_state["web_page"] = "Do_not_consent_page"
         st.experimental_rerun()
-# Consent page ends
 
-# No Consent page starts
-elif st.session_state["web_page"] == "Do_not_consent_page":
-    st.markdown(
-        '<h1 style="text-align: center; margin-top: 2rem;">&nbsp;</h1>',
-        unsafe_allow_html=True,
-    )
-    st.subheader(
-        "You have not provided consent to take part in our study. Nonetheless, we thank you for considering to take part."
-    )
-    st.subheader("You can now close your browser.")
-    st.markdown(
-        """If you withheld consent to take part accidentally and would like to participate, please contact <br/>
-        Dr Thomas Schultze-Gerlach (t.schultze@qub.ac.uk)""",
-        unsafe_allow_html=True,
-    )
-# No Consent page ends
 
-# Conditional Instructions page starts
-elif st.session_state["web_page"] == "Conditional_Instructions_1_page":
-    if st.session_state["show_instructions_first"]:
-        st.header("Instructions:")
-        st.markdown(
-            "In this study, we will show you the feedback you received on your PSY1008 essay on individual differences where you compared the personality theories of Freud and Rogers."
-        )
-        st.markdown(
-            "In addition to the actual feedback you received from your tutor, we will show you an alternative version of that feedback."
-        )
-        st.markdown(
-            """We would like to briefly explain how we created the alternative version of the feedback. To create it, we took the original feedback provided by your tutor and fed it into an AI, more specifically, a large language model (LLM). The LLM we used was ChatGPT, which you might be familiar with. We instructed the AI to take the original feedback and make it constructive and encouraging . The result is what we call **AI-augmented feedback**. AI-augmented feedback differs from AI-generated feedback in that it is based on human evaluation of your essay instead of an AI attempting to evaluate and provide feedback on its own."""
-        )
-        st.markdown(
-            """We would kindly ask you to read both versions of the feedback on your essay thoroughly. Once you have read them, please rate each version using a set of four statements. Please also state which version of the feedback you would prefer if you had to choose between them and describe briefly why you prefer one version of the feedback over the other."""
-        )
-        st.markdown(
-            "**Important:** Remember that your responses will be treated confidentially. That is, your tutor will not see how you rated their feedback, and you can be completely honest in your assessment of that feedback."
-        )
-    else:
-        st.markdown(
-            '<h1 style="text-align: center; margin-top: 2rem;">&nbsp;</h1>',
-            unsafe_allow_html=True,
-        )
-        st.header("Instructions:")
-        st.markdown(
-            "In this study, we will show you the feedback you received on your PSY1008 essay on individual differences where you compared the personality theories of Freud and Rogers."
-        )
-        st.markdown(
-            "In addition to the actual feedback you received from your tutor, we will show you an alternative version of that feedback."
-        )
-        st.markdown(
-            "We would kindly ask you to read both versions of the feedback on your essay thoroughly. Once you have read them, please rate each version using a set of four statements. Please also state which version of the feedback you would prefer if you had to choose between them and describe briefly why you prefer one version of the feedback over the other."
-        )
-        st.markdown(
-            "**Important:** Remember that your responses will be treated confidentially. That is, your tutor will not see how you rated their feedback, and you can be completely honest in your assessment of that feedback."
-        )
+# No Consent page
+def renderNoConsentPage():
+    renderContent("Do_not_consent_page")
+
+
+# Conditional Instructions page, before the survey
+def renderConditionalInstructions1Page():
+    renderContent("Conditional_Instructions_1_page")
 
     clicked = st.button(
         "Okay, I understand.",
@@ -734,31 +782,11 @@ elif st.session_state["web_page"] == "Conditional_Instructions_1_page":
     if clicked:
         st.session_state["web_page"] = "Survey_page"
         st.experimental_rerun()
-# Conditional Instructions page ends
 
-elif st.session_state["web_page"] == "Conditional_Instructions_2_page":
-    st.markdown(
-        '<h1 style="text-align: center; margin-top: 2rem;">&nbsp;</h1>',
-        unsafe_allow_html=True,
-    )
-    st.header("Thank you for taking part in this study:")
-    if st.session_state["show_instructions_first"]:
-        st.markdown(
-            "The aim of our study was to investigate how students would evaluate AI-augmented feedback relative to the original feedback they actually received and which the augmented feedback was based on. The reason why we study AI-augmented feedback is because we want to provide our students with the best possible feedback. Augmenting human feedback with AI might be a way to improve the quality of feedback while making sure that feedback still entails human evaluation of the assignment."
-        )
-        st.markdown(
-            "By taking part in our study, you have provided valuable information on the perceived quality of AI-augmented feedback relative to purely human feedback. Thank you again for taking the time!"
-        )
-    else:
-        st.markdown(
-            "Before, we tell you what the aim of our study was, we would first like to briefly explain how we created the alternative version of the feedback you just read. To create it, we took the original feedback provided by your tutor and fed it into an AI, more specifically, a large language model (LLM). The LLM we used was ChatGPT, which you might be familiar with. We instructed the AI to take the original feedback and make it constructive and encouraging. The result is what we call **AI-augmented feedback**. AI-augmented feedback differs from AI-generated feedback in that it is based on human evaluation of your essay instead of an AI attempting to evaluate and provide feedback on its own."
-        )
-        st.markdown(
-            "The aim of our study was to investigate how students would evaluate AI-augmented feedback relative to the original feedback they actually received and which the augmented feedback was based on. The reason why we study AI-augmented feedback is because we want to provide our students with the best possible feedback. Augmenting human feedback with AI might be a way to improve the quality of feedback while making sure that feedback still entails human evaluation of the assignment."
-        )
-        st.markdown(
-            "By taking part in our study, you have provided valuable information on the perceived quality of AI-augmented feedback relative to purely human feedback. Thank you again for taking the time!"
-        )
+
+# Conditional Instructions page, after the survey
+def renderConditionalInstructions2Page():
+    renderContent("Conditional_Instructions_2_page")
 
     clicked = st.button(
         "Okay, I understand.",
@@ -767,50 +795,35 @@ elif st.session_state["web_page"] == "Conditional_Instructions_2_page":
     if clicked:
         st.session_state["web_page"] = "Voucher_page"
         st.experimental_rerun()
-# Conditional Instructions page ends
 
 
-# static styles for the page
-title_alignment = """
-<style>
-#the-title {
-  text-align: center
-}
-.block-container {
-padding: 2rem 1rem;
-}
-#feedback-on-your-2nd-psy2008-essay{
-border-bottom: 1px solid silver;
-text-align: center
-}
-.stSlider  p{
-margin-bottom: 15px
+pages = {
+    "Login_page": renderLoginPage,
+    "Survey_page": renderSurveyPage,
+    "Voucher_page": renderVoucherPage,
+    "Instructions_page": renderInstructionsPage,
+    "Consent_page": renderConsentPage,
+    "Do_not_consent_page": renderNoConsentPage,
+    "Conditional_Instructions_1_page": renderConditionalInstructions1Page,
+    "Conditional_Instructions_2_page": renderConditionalInstructions2Page,
 }
 
-.stSlider  > div{
-margin-bottom: 20px
-}
-.amazon_voucher{
-text-align: center;
-border: 1px solid black;
-border-radius: 10px;
-padding: 10px;
-font-weight: bold;
-font-size: 3rem;
-}
-#welcome-to-the-survey-by-school-of-psychology{
-text-align: center;
-}
-.stSlider > div, .stSlider p{
-margin-bottom: 0 !important;
-}
+# time this rerun by the page it renders
+Metrics.startRerun(st.session_state["web_page"])
 
-.st-fw{
-padding-top: 5px;
-}
-</style>
-"""
-st.markdown(title_alignment, unsafe_allow_html=True)
+render = pages.get(st.session_state["web_page"])
+if render is not None:
+    render()
+
+# static styles for the page, sent again on every run since streamlit drops the elements a run
+# doesn't render
+st.markdown(PageContent.title_alignment, unsafe_allow_html=True)
+
+# started here, the survey page calls st.set_page_config before any other element
+getMetricsServer()
+getWarmUp()
+saveCheckpoint()
+Metrics.finishRerun()
 
 # js_scripts = """
 # <script>
@@ -0,0 +1,137 @@
+import json, os, sqlite3, threading, time
+
+# latency histograms and the /metrics route
+import Metrics
+
+
+# a cache in a local sqlite file, shared by all app processes on the node.
+# entries are json values with an expiry and a version stamp, a read with another version is a miss.
+# getOrLoad lets one process load a missing entry while the others wait for it, so the Sheets
+# reads stay the same however many processes run
+class SharedCache:
+    def __init__(self, path, lease_seconds=30, poll_seconds=0.05):
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.owner = "{}:{}".format(os.getpid(), id(self))
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "loads": 0, "waits": 0}
+        self.connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, version TEXT, value TEXT, stored_at REAL, expires_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS leases (
+                key TEXT PRIMARY KEY, owner TEXT, expires_at REAL
+            );
+            """)
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM entries WHERE expires_at < ?", (time.time(),)
+            )
+        Metrics.registerCollector(self.collect)
+
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    # the value, or None when it is missing, expired or has another version
+    def get(self, key, version=""):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM entries WHERE key = ? AND version = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, str(version), time.time()),
+            ).fetchone()
+        self.count("hits" if row is not None else "misses")
+        return None if row is None else json.loads(row[0])
+
+    # ttl in seconds, None keeps the entry until it is replaced
+    def set(self, key, value, ttl=None, version=""):
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (
+                    key,
+                    str(version),
+                    json.dumps(value),
+                    now,
+                    None if ttl is None else now + ttl,
+                ),
+            )
+
+    def delete(self, key):
+        with self.lock:
+            self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    # a lease marks the process loading the entry, an expired one can be taken over
+    def takeLease(self, key):
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(
+                    "SELECT owner, expires_at FROM leases WHERE key = ?", (key,)
+                ).fetchone()
+                taken = row is None or row[1] < now
+                if taken:
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO leases VALUES (?, ?, ?)",
+                        (key, self.owner, now + self.lease_seconds),
+                    )
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+        return taken
+
+    def releaseLease(self, key):
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM leases WHERE key = ? AND owner = ?", (key, self.owner)
+            )
+
+    # the cached value, loading it with loader() when it is missing. Only the process holding the
+    # lease loads, the others poll for the value until the lease runs out and then load themselves
+    def getOrLoad(self, key, loader, ttl=None, version=""):
+        value = self.get(key, version)
+        if value is not None:
+            return value
+
+        deadline = time.monotonic() + self.lease_seconds
+        while not self.takeLease(key):
+            self.count("waits")
+            time.sleep(self.poll_seconds)
+            value = self.get(key, version)
+            if value is not None:
+                return value
+            if time.monotonic() > deadline:
+                break
+
+        try:
+            value = self.get(key, version)
+            if value is not None:
+                return value
+            self.count("loads")
+            value = loader()
+            self.set(key, value, ttl, version)
+            return value
+        finally:
+            self.releaseLease(key)
+
+    # the counters of this process as Prometheus counters
+    def collect(self):
+        with self.lock:
+            counters = dict(self.counters)
+        return [
+            (
+                "survey_shared_cache_{}_total".format(counter),
+                "counter",
+                "Shared cache {} in this process".format(counter),
+                [([], value)],
+            )
+            for counter, value in counters.items()
+        ]
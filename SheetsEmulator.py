@@ -0,0 +1,445 @@
+import collections, json, os, random, re, tempfile, threading, time
+
+# gspread library handles the connectivity between python and Google Sheets
+import gspread
+
+# requests builds the HTTP responses of the injected API errors, like gspread receives them
+import requests
+
+# latency histograms and the /metrics route
+import Metrics
+
+# the methods by the quota they count against on the real API
+read_methods = {
+    "open_by_url",
+    "worksheets",
+    "get_worksheet",
+    "worksheet",
+    "get_all_values",
+    "col_values",
+    "row_values",
+    "findall",
+    "get",
+    "batch_get",
+}
+write_methods = {"update", "batch_update", "append_rows", "resize"}
+
+
+# a 429 as the Sheets API sends it, raised as the gspread APIError the app would see
+def quotaError(quota):
+    response = requests.Response()
+    response.status_code = 429
+    response.reason = "Too Many Requests"
+    response.headers["Content-Type"] = "application/json; charset=UTF-8"
+    response._content = json.dumps(
+        {
+            "error": {
+                "code": 429,
+                "message": "Quota exceeded for quota metric '{} requests' and limit "
+                "'{} requests per minute per user' of service "
+                "'sheets.googleapis.com'.".format(quota.title(), quota.title()),
+                "status": "RESOURCE_EXHAUSTED",
+            }
+        }
+    ).encode("utf-8")
+    return gspread.exceptions.APIError(response)
+
+
+# a local stand-in for the parts of the Google Sheets API the app uses, for benchmarks and
+# offline runs. It answers like gspread does and counts every call by method.
+# - latency (+ up to jitter) seconds are added to every call, like the network round trip
+# - reads_per_minute/writes_per_minute answer 429 past the per minute quota, like the real API.
+#   error_rate answers 429 to that share of the calls on top
+# - conflict_rate is the share of writes that race another writer: an append lands after a foreign
+#   row, an update is overwritten by the other writer right after it was confirmed
+# - with path, the spreadsheets are loaded from and saved to that json file after every write
+class EmulatedClient:
+    def __init__(
+        self,
+        path=None,
+        latency=0,
+        jitter=0,
+        reads_per_minute=0,
+        writes_per_minute=0,
+        error_rate=0,
+        conflict_rate=0,
+        seed=None,
+    ):
+        self.path = path
+        self.latency = latency
+        self.jitter = jitter
+        self.limits = {"read": reads_per_minute, "write": writes_per_minute}
+        self.error_rate = error_rate
+        self.conflict_rate = conflict_rate
+        self.random = random.Random(seed)
+        self.spreadsheets = {}
+        self.calls = collections.Counter()
+        self.windows = {"read": collections.deque(), "write": collections.deque()}
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    def count(self, method):
+        with self.lock:
+            self.calls[method] += 1
+
+    # every API call goes through here before it touches the data
+    def request(self, method):
+        self.count(method)
+        quota = "write" if method in write_methods else "read"
+        with self.lock:
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            throttled = self.random.random() < self.error_rate
+            if self.limits[quota]:
+                window = self.windows[quota]
+                now = time.monotonic()
+                while window and now - window[0] >= 60:
+                    window.popleft()
+                if len(window) >= self.limits[quota]:
+                    throttled = True
+                else:
+                    window.append(now)
+        if delay:
+            time.sleep(delay)
+        if throttled:
+            self.calls["429"] += 1
+            raise quotaError(quota)
+
+    def conflict(self):
+        with self.lock:
+            if self.random.random() < self.conflict_rate:
+                self.calls["conflict"] += 1
+                return True
+            return False
+
+    # the calls as a Prometheus counter family, 429 and conflict count the injected faults
+    def collect(self):
+        with self.lock:
+            calls = sorted(self.calls.items())
+        return [
+            (
+                "survey_sheets_emulator_calls_total",
+                "counter",
+                "Calls answered by the Sheets emulator, by method",
+                [([("method", method)], count) for method, count in calls],
+            )
+        ]
+
+    def create(self, url, worksheets):
+        spreadsheet = EmulatedSpreadsheet(self, url)
+        for title, rows in worksheets:
+            spreadsheet.add_worksheet(title, rows)
+        self.spreadsheets[url] = spreadsheet
+        self.save()
+        return spreadsheet
+
+    def open_by_url(self, url):
+        self.request("open_by_url")
+        if url not in self.spreadsheets:
+            raise gspread.exceptions.SpreadsheetNotFound(url)
+        return self.spreadsheets[url]
+
+    # {url: [[title, rows], ...]}
+    def load(self):
+        with open(self.path) as f:
+            data = json.load(f)
+        for url, worksheets in data.items():
+            spreadsheet = EmulatedSpreadsheet(self, url)
+            for title, rows in worksheets:
+                spreadsheet.add_worksheet(title, rows)
+            self.spreadsheets[url] = spreadsheet
+
+    # written to a temporary file first, so a crash never leaves half a file behind
+    def save(self):
+        if not self.path:
+            return
+        with self.save_lock:
+            data = {}
+            for url, spreadsheet in self.spreadsheets.items():
+                data[url] = []
+                for worksheet in spreadsheet.sheets:
+                    with worksheet.lock:
+                        data[url].append([worksheet.title, worksheet.values()])
+            directory = os.path.dirname(os.path.abspath(self.path))
+            with tempfile.NamedTemporaryFile(
+                "w", dir=directory, suffix=".tmp", delete=False
+            ) as f:
+                json.dump(data, f)
+            os.replace(f.name, self.path)
+
+
+class EmulatedSpreadsheet:
+    def __init__(self, client, url):
+        self.client = client
+        self.url = url
+        self.sheets = []
+
+    def add_worksheet(self, title, rows=None):
+        worksheet = EmulatedWorksheet(self, title, len(self.sheets), rows or [])
+        self.sheets.append(worksheet)
+        return worksheet
+
+    def worksheets(self):
+        self.client.request("worksheets")
+        return list(self.sheets)
+
+    def get_worksheet(self, index):
+        self.client.request("get_worksheet")
+        return self.sheets[index] if index < len(self.sheets) else None
+
+    def worksheet(self, title):
+        self.client.request("worksheet")
+        for worksheet in self.sheets:
+            if worksheet.title == title:
+                return worksheet
+        raise gspread.exceptions.WorksheetNotFound(title)
+
+
+# "B5:P5" to zero based (first row, first column, last row, last column), open ends are None
+def parseRange(range_name):
+    cells = []
+    for part in range_name.split("!")[-1].split(":"):
+        match = re.fullmatch(r"([A-Za-z]*)(\d*)", part)
+        letters, digits = match.group(1).upper(), match.group(2)
+        column = None
+        if letters:
+            column = 0
+            for letter in letters:
+                column = column * 26 + ord(letter) - 64
+            column -= 1
+        cells.append((int(digits) - 1 if digits else None, column))
+    if len(cells) == 1:
+        cells.append(cells[0])
+    (first_row, first_column), (last_row, last_column) = cells
+    return first_row, first_column, last_row, last_column
+
+
+def cellName(row, column):
+    letters = ""
+    column += 1
+    while column:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return "{}{}".format(letters, row + 1)
+
+
+# values are stored the way Sheets shows them
+def cellValue(value):
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    return "" if value is None else str(value)
+
+
+class EmulatedWorksheet:
+    def __init__(self, spreadsheet, title, index, rows):
+        self.spreadsheet = spreadsheet
+        self.client = spreadsheet.client
+        self.title = title
+        self.index = index
+        self.id = index
+        self.rows = [[cellValue(value) for value in row] for row in rows]
+        self.lock = threading.Lock()
+
+    # the grid size comes with the worksheet metadata in gspread, it costs no request
+    @property
+    def row_count(self):
+        with self.lock:
+            return len(self.rows)
+
+    # rows without trailing empty rows, padded to the same width like gspread does
+    def values(self):
+        rows = list(self.rows)
+        while rows and not any(rows[-1]):
+            rows.pop()
+        width = max((len(row) for row in rows), default=0)
+        return [row + [""] * (width - len(row)) for row in rows]
+
+    def get_all_values(self):
+        self.client.request("get_all_values")
+        with self.lock:
+            return self.values()
+
+    def col_values(self, col):
+        self.client.request("col_values")
+        with self.lock:
+            column = [row[col - 1] if len(row) >= col else "" for row in self.rows]
+        while column and not column[-1]:
+            column.pop()
+        return column
+
+    def row_values(self, row):
+        self.client.request("row_values")
+        with self.lock:
+            values = list(self.rows[row - 1]) if row <= len(self.rows) else []
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def findall(self, query):
+        self.client.request("findall")
+        with self.lock:
+            return [
+                gspread.cell.Cell(row + 1, column + 1, value)
+                for row, items in enumerate(self.rows)
+                for column, value in enumerate(items)
+                if value == query
+            ]
+
+    def read(self, range_name):
+        first_row, first_column, last_row, last_column = parseRange(range_name)
+        values = self.values()
+        first_row = first_row or 0
+        first_column = first_column or 0
+        last_row = len(values) - 1 if last_row is None else last_row
+        result = []
+        for items in values[first_row : last_row + 1]:
+            end = len(items) if last_column is None else last_column + 1
+            cells = items[first_column:end]
+            while cells and not cells[-1]:
+                cells.pop()
+            result.append(cells)
+        while result and not result[-1]:
+            result.pop()
+        return result
+
+    def get(self, range_name):
+        self.client.request("get")
+        with self.lock:
+            return self.read(range_name)
+
+    def batch_get(self, ranges):
+        self.client.request("batch_get")
+        with self.lock:
+            return [self.read(range_name) for range_name in ranges]
+
+    def write(self, first_row, first_column, values):
+        for offset, items in enumerate(values):
+            row = first_row + offset
+            while len(self.rows) <= row:
+                self.rows.append([])
+            current = self.rows[row]
+            end = first_column + len(items)
+            if len(current) < end:
+                current.extend([""] * (end - len(current)))
+            current[first_column:end] = [cellValue(value) for value in items]
+
+    def update(self, range_name, values=None, **kwargs):
+        self.client.request("update")
+        first_row, first_column, _, _ = parseRange(range_name)
+        with self.lock:
+            self.write(first_row or 0, first_column or 0, values)
+        if self.client.conflict():
+            # the other writer's update lands right after ours, last write wins
+            with self.lock:
+                self.write(
+                    first_row or 0,
+                    first_column or 0,
+                    [["conflict"] * len(items) for items in values],
+                )
+        self.client.save()
+        width = max((len(items) for items in values), default=0)
+        return {
+            "spreadsheetId": self.spreadsheet.url,
+            "updatedRange": "{}!{}".format(self.title, range_name),
+            "updatedRows": len(values),
+            "updatedColumns": width,
+            "updatedCells": sum(len(items) for items in values),
+        }
+
+    # values.batchUpdate, all ranges are written with one request
+    def batch_update(self, data, **kwargs):
+        self.client.request("batch_update")
+        with self.lock:
+            for item in data:
+                first_row, first_column, _, _ = parseRange(item["range"])
+                self.write(first_row or 0, first_column or 0, item["values"])
+        self.client.save()
+        return {
+            "spreadsheetId": self.spreadsheet.url,
+            "totalUpdatedRows": sum(len(item["values"]) for item in data),
+            "totalUpdatedCells": sum(
+                len(items) for item in data for items in item["values"]
+            ),
+            "totalUpdatedSheets": 1 if data else 0,
+        }
+
+    # the grid grows with the writes here, resize only drops the rows past the new size
+    def resize(self, rows=None, cols=None):
+        self.client.request("resize")
+        with self.lock:
+            if rows is not None:
+                del self.rows[rows:]
+                self.rows.extend([] for _ in range(rows - len(self.rows)))
+        self.client.save()
+
+    # values.append, the rows go after the last row of the table
+    def append_rows(self, values, table_range=None, **kwargs):
+        self.client.request("append_rows")
+        first_column = parseRange(table_range)[1] or 0 if table_range else 0
+        with self.lock:
+            if self.client.conflict():
+                # another writer appended first, our rows go below its row
+                self.write(len(self.values()), first_column, [["conflict"]])
+            first_row = len(self.values())
+            self.write(first_row, first_column, values)
+        self.client.save()
+        return {
+            "spreadsheetId": self.spreadsheet.url,
+            "updates": {
+                "updatedRange": "{}!{}".format(
+                    self.title, cellName(first_row, first_column)
+                ),
+                "updatedRows": len(values),
+            },
+        }
+
+    def append_row(self, values, **kwargs):
+        return self.append_rows([values], **kwargs)
+
+
+# the emulator configured from the environment, see the sheets_emulator keys in .example.env
+def openEmulatedClient(path):
+    client = EmulatedClient(
+        path,
+        latency=float(os.environ.get("sheets_emulator_latency_ms", 0)) / 1000,
+        jitter=float(os.environ.get("sheets_emulator_jitter_ms", 0)) / 1000,
+        reads_per_minute=int(os.environ.get("sheets_emulator_reads_per_minute", 0)),
+        writes_per_minute=int(os.environ.get("sheets_emulator_writes_per_minute", 0)),
+        error_rate=float(os.environ.get("sheets_emulator_error_rate", 0)),
+        conflict_rate=float(os.environ.get("sheets_emulator_conflict_rate", 0)),
+        seed=os.environ.get("sheets_emulator_seed") or None,
+    )
+    Metrics.registerCollector(client.collect)
+    return client
+
+
+# python SheetsEmulator.py snapshot emulator.json copies the spreadsheet at google_sheet into the
+# emulator file, so the app can run offline on the real data (sheets_emulator = "emulator.json")
+if __name__ == "__main__":
+    import sys
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    if len(sys.argv) != 3 or sys.argv[1] != "snapshot":
+        print("usage: python SheetsEmulator.py snapshot <file>")
+        sys.exit(1)
+
+    import Storage
+
+    url = os.environ.get("google_sheet")
+    spreadsheet = Storage.getGoogleService().open_by_url(url)
+    client = EmulatedClient(sys.argv[2])
+    client.create(
+        url,
+        [
+            (worksheet.title, worksheet.get_all_values())
+            for worksheet in spreadsheet.worksheets()
+        ],
+    )
+    print(
+        "Copied {} worksheets to {}".format(
+            len(client.spreadsheets[url].sheets), sys.argv[2]
+        )
+    )
@@ -0,0 +1,842 @@
+import hashlib, json, os, sqlite3, sys, threading, time
+
+# dotenv library loads env files into the python environment.
+from dotenv import load_dotenv
+
+# background writer for the login sheet
+from LoginRecorder import LoginRecorder
+
+# local write-ahead journal of the logins and results, replayed to the sheets in the background
+from Journal import Journal
+
+# in-process queue of the unclaimed voucher codes
+from VoucherPool import VoucherPool
+
+# cache shared by the app processes of the node
+from SharedCache import SharedCache
+
+# gspread, QuotaClient and the Sheets emulator are imported by the code opening the Sheets client,
+# so the app boots without them and the sqlite backend never loads them
+
+# the headings of the three feedback sections, in the order of the rows in the feedback sheet
+feedback_questions = [
+    "<b>Strengths of the piece of work:</b><br/>",
+    "<br/><br/><b>What could be improved:</b><br/>",
+    "<br/><br/><b>How to make improvements:</b><br/>",
+]
+
+# columns B:P of the data sheet, after the voucher in column A
+result_columns = [
+    "email",
+    "student_id",
+    "q1a",
+    "q1b",
+    "q2a",
+    "q2b",
+    "q3a",
+    "q3b",
+    "q4a",
+    "q4b",
+    "preferred_feedback",
+    "open_feedback",
+    "instructions_first",
+    "submitted_at",
+    "participated_id",
+]
+
+
+# (original, alternate) pairs of the sections of one student, to the html shown on the survey page
+def renderFeedback(sections):
+    return {
+        "original": "".join(
+            question + original
+            for question, (original, _) in zip(feedback_questions, sections)
+        ),
+        "alternate": "".join(
+            question + alternate
+            for question, (_, alternate) in zip(feedback_questions, sections)
+        ),
+    }
+
+
+# the feedback sheet holds one row per section: A the student ID, B the original and C the
+# alternate feedback. It may start with this heading row, recognised by student_id in A1, every
+# other row is a section
+feedback_heading = ["student_id", "original", "alternate"]
+
+
+def hasFeedbackHeading(values):
+    return bool(values and values[0] and values[0][0].strip() == feedback_heading[0])
+
+
+# the sections of the feedback sheet rows by student ID, in the order of the rows
+def feedbackSections(values):
+    sections = {}
+    for items in values[1:] if hasFeedbackHeading(values) else values:
+        items = items + [""] * (3 - len(items))
+        student_id = items[0].strip()
+        if student_id:
+            sections.setdefault(student_id, []).append((items[1], items[2]))
+    return sections
+
+
+# the row written to columns B:P of the data sheet when a student submits the survey
+def resultRow(email, student_id, answers, instructions_first, submitted_at):
+    return [email, student_id, *answers, instructions_first, submitted_at, student_id]
+
+
+# every storage backend implements these operations, Script.py only talks to the storage.
+# rows are numbered like the rows of the sheets, the header is row 1
+class Storage:
+    # records the login with the condition the student was assigned to
+    def record_login(self, email, student_id, login_time, condition=""):
+        raise NotImplementedError
+
+    # returns {"email_row": row or None, "id_row": row or None, "participated": bool}
+    def lookup_roster(self, email, student_id):
+        raise NotImplementedError
+
+    # returns {"original": html, "alternate": html}, or None when there is no feedback
+    def lookup_feedback(self, student_id):
+        raise NotImplementedError
+
+    # answers are Q1A to Q4B, the preferred feedback and the open feedback.
+    # row is the roster row found at login, returns True once the write is confirmed
+    def record_results(self, email, student_id, answers, instructions_first, row=None):
+        raise NotImplementedError
+
+    # returns the voucher code of the student
+    def claim_voucher(self, email, student_id):
+        raise NotImplementedError
+
+    # feedback is {student_id: [(original, alternate)] * 3}, merged into the stored feedback or
+    # replacing all of it. Returns the number of students stored
+    def store_feedback(self, feedback, replace=False):
+        raise NotImplementedError
+
+    # (name, function) pairs loading what the first students would wait for, run by WarmUp
+    def warmUpSteps(self):
+        return []
+
+
+# the client goes through QuotaClient, which keeps the calls under the per minute quotas of the
+# Sheets API and retries the ones that are throttled anyway.
+# with sheets_emulator set to a json file the app runs on the local Sheets emulator instead
+def getGoogleService():
+    # rate limiting, retries and request coalescing for the Sheets API
+    from QuotaClient import QuotaClient
+
+    if os.environ.get("sheets_emulator"):
+        # local stand-in for the Sheets API
+        from SheetsEmulator import openEmulatedClient
+
+        client = openEmulatedClient(os.environ.get("sheets_emulator"))
+    else:
+        # gspread library handles the connectivity between python and Google Sheets
+        import gspread
+
+        client = gspread.service_account_from_dict(
+            {
+                "type": os.environ.get("type"),
+                "project_id": os.environ.get("project_id"),
+                "private_key_id": os.environ.get("private_key_id"),
+                "private_key": os.environ.get("private_key"),
+                "client_email": os.environ.get("client_email"),
+                "client_id": os.environ.get("client_id"),
+                "auth_uri": os.environ.get("auth_uri"),
+                "token_uri": os.environ.get("token_uri"),
+                "auth_provider_x509_cert_url": os.environ.get(
+                    "auth_provider_x509_cert_url"
+                ),
+                "client_x509_cert_url": os.environ.get("client_x509_cert_url"),
+                "universe_domain": os.environ.get("universe_domain"),
+            }
+        )
+    return QuotaClient(
+        client,
+        reads_per_minute=int(os.environ.get("sheets_reads_per_minute", 60)),
+        writes_per_minute=int(os.environ.get("sheets_writes_per_minute", 60)),
+        max_retries=int(os.environ.get("sheets_max_retries", 5)),
+    )
+
+
+# Google Sheets backend. Worksheet index 0 holds the logins, 1 the roster and results, 2 the feedback,
+# unless they are given by title. With voucher_worksheet the vouchers come from that pool of codes
+# instead of column A of the roster. With a shared cache the roster and feedback reads are shared
+# by all processes of the node. With journal_path the logins and results are written to the local
+# journal and replayed to the sheets in the background, so an outage of the API only delays them.
+# without writers there is no journal, login recorder or voucher pool: the admin commands reading
+# or rewriting whole sheets don't record logins or claims, and leave the journal files to the app
+class SheetsStorage(Storage):
+    def __init__(
+        self,
+        client,
+        sheet_url,
+        login_worksheet=0,
+        data_worksheet=1,
+        feedback_worksheet=2,
+        roster_ttl=300,
+        feedback_version="1",
+        login_batch_size=50,
+        login_flush_seconds=2,
+        voucher_worksheet=None,
+        shared_cache=None,
+        journal_path=None,
+        voucher_db_path="vouchers.db",
+        writers=True,
+    ):
+        self.client = client
+        self.shared_cache = shared_cache
+        self.sheet_url = sheet_url
+        self.login_worksheet = login_worksheet
+        self.data_worksheet = data_worksheet
+        self.feedback_worksheet = feedback_worksheet
+        self.roster_ttl = roster_ttl
+        self.feedback_version = feedback_version
+        self.lock = threading.Lock()
+        self.roster_lock = threading.Lock()
+        self.spreadsheet = None
+        self.registry = None
+        self.roster = None
+        self.roster_loaded_at = 0
+        self.feedback = {}
+        self.journal = None
+        self.login_recorder = None
+        if writers and journal_path:
+            # logins and results are confirmed once they are in the journal, it writes them to
+            # the sheets in batches like the login recorder
+            self.journal = Journal(
+                journal_path,
+                self.replayEntries,
+                batch_size=login_batch_size,
+                flush_interval=login_flush_seconds,
+            )
+        elif writers:
+            self.login_recorder = LoginRecorder(
+                lambda: self.worksheet(self.login_worksheet),
+                batch_size=login_batch_size,
+                flush_interval=login_flush_seconds,
+            )
+        self.voucher_worksheet = voucher_worksheet
+        self.voucher_pool = None
+        if voucher_worksheet is not None and writers:
+            # claims are reserved in the local file and written to the sheet in batches like the logins
+            self.voucher_pool = VoucherPool(
+                voucher_db_path,
+                self.loadVoucherPool,
+                self.persistVoucherClaims,
+                batch_size=login_batch_size,
+                flush_interval=login_flush_seconds,
+            )
+
+    # the spreadsheet handle is kept, open_by_url costs a metadata request
+    def getSpreadsheet(self):
+        if self.spreadsheet is None:
+            self.spreadsheet = self.client.open_by_url(self.sheet_url)
+        return self.spreadsheet
+
+    # all worksheet handles are resolved with one metadata request and kept.
+    # accepts a worksheet title or its index in the tab order, the handles are only
+    # read again when the worksheet can't be found, e.g. it was renamed or re-created
+    def worksheet(self, title_or_index):
+        for attempt in range(2):
+            with self.lock:
+                if self.registry is None:
+                    worksheets = self.getSpreadsheet().worksheets()
+                    self.registry = {
+                        "by_title": {ws.title: ws for ws in worksheets},
+                        "by_index": worksheets,
+                    }
+                registry = self.registry
+
+            if isinstance(title_or_index, int):
+                if title_or_index < len(registry["by_index"]):
+                    return registry["by_index"][title_or_index]
+            elif title_or_index in registry["by_title"]:
+                return registry["by_title"][title_or_index]
+
+            if attempt == 0:
+                with self.lock:
+                    self.registry = None
+
+        import gspread
+
+        raise gspread.exceptions.WorksheetNotFound(title_or_index)
+
+    # the rows of a worksheet, through the shared cache when there is one
+    def readWorksheet(self, name, title_or_index, ttl=None, version=""):
+        if self.shared_cache is None:
+            return self.worksheet(title_or_index).get_all_values()
+        return self.shared_cache.getOrLoad(
+            "{}:{}".format(self.sheet_url, name),
+            lambda: self.worksheet(title_or_index).get_all_values(),
+            ttl=ttl,
+            version=version,
+        )
+
+    # logins are queued and appended to the login sheet in batches by a background thread,
+    # the condition goes to column D
+    def record_login(self, email, student_id, login_time, condition=""):
+        if self.journal is not None:
+            self.journal.append("login", [email, student_id, login_time, condition])
+        else:
+            self.login_recorder.record(email, student_id, login_time, condition)
+
+    # the roster in the data sheet is downloaded with one bulk read and kept in memory as hash maps,
+    # so the login checks are dict lookups. The ttl picks up students added to the sheet
+    def getRosterIndex(self):
+        if (
+            self.roster is not None
+            and time.monotonic() - self.roster_loaded_at < self.roster_ttl
+        ):
+            return self.roster
+
+        # only one session reloads the roster, the others wait for it
+        with self.roster_lock:
+            if (
+                self.roster is not None
+                and time.monotonic() - self.roster_loaded_at < self.roster_ttl
+            ):
+                return self.roster
+            return self.loadRosterIndex()
+
+    def loadRosterIndex(self):
+        roster = {
+            "email_rows": {},
+            "id_rows": {},
+            "vouchers": {},
+            "participated_ids": set(),
+        }
+        # column A holds the voucher, B the email, C the student ID and P is filled once the
+        # survey is submitted. the first occurrence wins, same as list.index on the columns
+        rows = self.readWorksheet("roster", self.data_worksheet, ttl=self.roster_ttl)
+        for row_number, items in enumerate(rows, start=1):
+            items = items + [""] * (16 - len(items))
+            email, student_id, participated_id = (
+                items[1].strip(),
+                items[2].strip(),
+                items[15].strip(),
+            )
+            if email:
+                roster["email_rows"].setdefault(email, row_number)
+            if student_id:
+                roster["id_rows"].setdefault(student_id, row_number)
+            if participated_id:
+                roster["participated_ids"].add(participated_id)
+            roster["vouchers"][row_number] = items[0]
+
+        self.roster = roster
+        self.roster_loaded_at = time.monotonic()
+        return roster
+
+    # a submission in another process is seen through the shared cache before the roster is reloaded
+    def lookup_roster(self, email, student_id):
+        roster = self.getRosterIndex()
+        participated = student_id in roster["participated_ids"]
+        if not participated and self.shared_cache is not None:
+            participated = bool(
+                self.shared_cache.get(
+                    "{}:participated:{}".format(self.sheet_url, student_id)
+                )
+            )
+        return {
+            "email_row": roster["email_rows"].get(email),
+            "id_row": roster["id_rows"].get(student_id),
+            "participated": participated,
+        }
+
+    # feedback_version, followed by the version of the last feedback written by IngestFeedback.py
+    # when it is known through the shared cache
+    def feedbackVersion(self):
+        if self.shared_cache is None:
+            return self.feedback_version
+        ingested = self.shared_cache.get("{}:feedback_ingested".format(self.sheet_url))
+        if ingested is None:
+            return self.feedback_version
+        return "{}:{}".format(self.feedback_version, ingested)
+
+    # the feedback sheet is read with one bulk request into a dict from student ID to the rendered
+    # original and alternate feedback, see feedbackSections. The store is rebuilt when the feedback
+    # version changes
+    def getFeedbackStore(self):
+        version = self.feedbackVersion()
+        if version in self.feedback:
+            return self.feedback[version]
+
+        sections = feedbackSections(
+            self.readWorksheet("feedback", self.feedback_worksheet, version=version)
+        )
+        store = {
+            student_id: renderFeedback(rows) for student_id, rows in sections.items()
+        }
+        self.feedback = {version: store}
+        return store
+
+    def lookup_feedback(self, student_id):
+        return self.getFeedbackStore().get(student_id)
+
+    # the row is known from the roster, so B:P is written with one request and no read.
+    # the response of the update confirms the write, with a journal the entry on disk does
+    def record_results(self, email, student_id, answers, instructions_first, row=None):
+        if row is None:
+            row = self.getRosterIndex()["email_rows"].get(email)
+        if row is None:
+            return False
+
+        values = resultRow(
+            email,
+            student_id,
+            answers,
+            instructions_first,
+            time.strftime("%d/%m/%Y %H:%M:%S"),
+        )
+        if self.journal is not None:
+            try:
+                self.journal.append("results", {"row": row, "values": values})
+            except OSError:
+                return False
+        else:
+            response = self.worksheet(self.data_worksheet).update(
+                r"B{}:P{}".format(row, row), [values]
+            )
+            if not response or response.get("updatedRows") != 1:
+                return False
+
+        # keep the cached roster in step with the write so a second attempt is refused without a
+        # reload. It is not loaded here, that would wait for the sheets the journal was used to avoid
+        if self.roster is not None:
+            self.roster["participated_ids"].add(student_id)
+        if self.shared_cache is not None:
+            self.shared_cache.set(
+                "{}:participated:{}".format(self.sheet_url, student_id), True
+            )
+        return True
+
+    # writes a batch of journal entries. Logins are appended with the entry ID in column E, so
+    # when an earlier attempt may have gone through the IDs already in the sheet are skipped.
+    # results are written to their rows with one batch update, writing them again changes nothing
+    def replayEntries(self, kind, entries, uncertain):
+        if kind == "login":
+            worksheet = self.worksheet(self.login_worksheet)
+            if uncertain:
+                written = set(worksheet.col_values(5))
+                entries = [entry for entry in entries if entry["id"] not in written]
+            if entries:
+                worksheet.append_rows(
+                    [entry["data"] + [entry["id"]] for entry in entries],
+                    table_range="A1",
+                )
+        elif kind == "results":
+            response = self.worksheet(self.data_worksheet).batch_update(
+                [
+                    {
+                        "range": "B{0}:P{0}".format(entry["data"]["row"]),
+                        "values": [entry["data"]["values"]],
+                    }
+                    for entry in entries
+                ]
+            )
+            if not response or response.get("totalUpdatedRows") != len(entries):
+                raise RuntimeError("the results update was not confirmed")
+
+    # without a voucher worksheet the vouchers are handed out with the invitation, column A of the
+    # student's row. It is taken from the roster the logins keep loaded, the submit doesn't wait
+    # for a reload of the sheet
+    def claim_voucher(self, email, student_id):
+        if self.voucher_pool is not None:
+            return self.voucher_pool.claim(student_id, email)
+        roster = self.roster if self.roster is not None else self.getRosterIndex()
+        return roster["vouchers"].get(roster["email_rows"].get(email), False)
+
+    # the voucher worksheet has a heading row, then A the code, B the student ID, C the email and
+    # D the time of the claim. Codes are added as rows with only column A, claims are appended
+    # as full rows, so rows never have to be found or shifted. A code with a claim row is taken
+    def loadVoucherPool(self):
+        codes = []
+        claims = {}
+        for items in self.worksheet(self.voucher_worksheet).get_all_values()[1:]:
+            items = items + [""] * (2 - len(items))
+            code, student_id = items[0].strip(), items[1].strip()
+            if not code:
+                continue
+            if student_id:
+                claims.setdefault(student_id, code)
+            else:
+                codes.append(code)
+        return codes, claims
+
+    def persistVoucherClaims(self, rows):
+        self.worksheet(self.voucher_worksheet).append_rows(rows, table_range="A1")
+
+    # the feedback sheet is rewritten sorted by student ID with the sections of a student in
+    # consecutive rows, in updates of chunk_rows rows. A heading row stays at the top, a sheet
+    # without one gets none, see feedbackSections. Rows left over from a longer layout are blanked. With a shared cache the version of the new content is published, so the
+    # processes of the node reload the feedback without a change of feedback_version
+    def store_feedback(self, feedback, replace=False, chunk_rows=5000):
+        worksheet = self.worksheet(self.feedback_worksheet)
+        values = worksheet.get_all_values()
+        merged = {} if replace else feedbackSections(values)
+        merged.update(feedback)
+
+        rows = ([feedback_heading] if hasFeedbackHeading(values) else []) + [
+            [student_id, original, alternate]
+            for student_id in sorted(merged)
+            for original, alternate in merged[student_id]
+        ]
+        rows += [["", "", ""]] * (len(values) - len(rows))
+        if worksheet.row_count < len(rows):
+            worksheet.resize(rows=len(rows))
+        for start in range(0, len(rows), chunk_rows):
+            chunk = rows[start : start + chunk_rows]
+            worksheet.update(
+                "A{}:C{}".format(start + 1, start + len(chunk)),
+                chunk,
+                value_input_option="RAW",
+            )
+
+        if self.shared_cache is not None:
+            self.shared_cache.set(
+                "{}:feedback_ingested".format(self.sheet_url),
+                hashlib.sha256(json.dumps(rows).encode("utf-8")).hexdigest()[:12],
+            )
+        return len(merged)
+
+    # opening the spreadsheet fetches the token of the service account and the worksheet handles
+    def warmUpSteps(self):
+        steps = [
+            ("worksheets", lambda: self.worksheet(self.login_worksheet)),
+            ("roster", self.getRosterIndex),
+            ("feedback", self.getFeedbackStore),
+        ]
+        if self.voucher_pool is not None:
+            steps.append(("vouchers", self.voucher_pool.preload))
+        return steps
+
+
+# local sqlite backend, runs the login path at local disk latency and needs no network.
+# the tables mirror the sheets, rows keep their sheet row numbers so a file imported from
+# Google Sheets can be exported back to it
+class SqliteStorage(Storage):
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS logins (
+                row INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT, student_id TEXT, login_time TEXT, condition TEXT
+            );
+            CREATE TABLE IF NOT EXISTS roster (
+                row INTEGER PRIMARY KEY, voucher TEXT, {}
+            );
+            CREATE INDEX IF NOT EXISTS roster_email ON roster (email);
+            CREATE INDEX IF NOT EXISTS roster_student_id ON roster (student_id);
+            CREATE INDEX IF NOT EXISTS roster_participated_id ON roster (participated_id);
+            CREATE TABLE IF NOT EXISTS feedback (
+                student_id TEXT, section INTEGER, original TEXT, alternate TEXT,
+                PRIMARY KEY (student_id, section)
+            );
+            CREATE TABLE IF NOT EXISTS vouchers (
+                code TEXT PRIMARY KEY, student_id TEXT UNIQUE, email TEXT, claimed_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS vouchers_unclaimed ON vouchers (code)
+                WHERE student_id IS NULL;
+            """.format(", ".join(column + " TEXT" for column in result_columns)))
+        # files created before the condition was recorded
+        columns = [row[1] for row in self.query("PRAGMA table_info(logins)")]
+        if "condition" not in columns:
+            self.connection.execute("ALTER TABLE logins ADD COLUMN condition TEXT")
+
+    def query(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    # the row number continues the rows imported from the login sheet, header included
+    def record_login(self, email, student_id, login_time, condition=""):
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO logins (email, student_id, login_time, condition) VALUES (?, ?, ?, ?)",
+                (email, student_id, login_time, condition),
+            )
+
+    def lookup_roster(self, email, student_id):
+        email_row, id_row, participated = self.query(
+            """SELECT
+                (SELECT MIN(row) FROM roster WHERE email = ?),
+                (SELECT MIN(row) FROM roster WHERE student_id = ?),
+                EXISTS (SELECT 1 FROM roster WHERE participated_id = ?)""",
+            (email, student_id, student_id),
+        )[0]
+        return {
+            "email_row": email_row,
+            "id_row": id_row,
+            "participated": bool(participated),
+        }
+
+    def lookup_feedback(self, student_id):
+        sections = self.query(
+            "SELECT original, alternate FROM feedback WHERE student_id = ? ORDER BY section",
+            (student_id,),
+        )
+        return renderFeedback(sections) if sections else None
+
+    def record_results(self, email, student_id, answers, instructions_first, row=None):
+        values = resultRow(
+            email,
+            student_id,
+            answers,
+            instructions_first,
+            time.strftime("%d/%m/%Y %H:%M:%S"),
+        )
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE roster SET {} WHERE row = COALESCE(?, (SELECT MIN(row) FROM roster WHERE email = ?))".format(
+                    ", ".join(column + " = ?" for column in result_columns)
+                ),
+                [str(value) for value in values] + [row, email],
+            )
+        return cursor.rowcount == 1
+
+    # with codes in the vouchers table the next unclaimed one is reserved for the student in one
+    # transaction, so processes sharing the file never hand out a code twice. The student ID is
+    # unique, asking again returns the same code. Without codes column A of the roster is used
+    def claim_voucher(self, email, student_id):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                if self.connection.execute("SELECT 1 FROM vouchers LIMIT 1").fetchone():
+                    self.connection.execute(
+                        """UPDATE vouchers SET student_id = ?, email = ?, claimed_at = ?
+                        WHERE code = (SELECT MIN(code) FROM vouchers WHERE student_id IS NULL)
+                        AND NOT EXISTS (SELECT 1 FROM vouchers WHERE student_id = ?)""",
+                        (
+                            student_id,
+                            email,
+                            time.strftime("%d/%m/%Y %H:%M:%S"),
+                            student_id,
+                        ),
+                    )
+                    rows = self.connection.execute(
+                        "SELECT code FROM vouchers WHERE student_id = ?", (student_id,)
+                    ).fetchall()
+                else:
+                    rows = self.connection.execute(
+                        "SELECT voucher FROM roster WHERE email = ? ORDER BY row LIMIT 1",
+                        (email,),
+                    ).fetchall()
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+        return rows[0][0] if rows else False
+
+    def store_feedback(self, feedback, replace=False):
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                if replace:
+                    self.connection.execute("DELETE FROM feedback")
+                else:
+                    self.connection.executemany(
+                        "DELETE FROM feedback WHERE student_id = ?",
+                        [(student_id,) for student_id in feedback],
+                    )
+                self.connection.executemany(
+                    "INSERT INTO feedback VALUES (?, ?, ?, ?)",
+                    [
+                        (student_id, section, original, alternate)
+                        for student_id, sections in feedback.items()
+                        for section, (original, alternate) in enumerate(sections)
+                    ],
+                )
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+        return len(feedback)
+
+    # copy the worksheets of Google Sheets into the sqlite file, replacing its content
+    def import_from(self, sheets):
+        logins = sheets.worksheet(sheets.login_worksheet).get_all_values()
+        roster = sheets.worksheet(sheets.data_worksheet).get_all_values()
+        feedback = sheets.worksheet(sheets.feedback_worksheet).get_all_values()
+        # one row per code, a student keeps the first code claimed like in loadVoucherPool
+        vouchers = {}
+        if sheets.voucher_worksheet is not None:
+            students = set()
+            rows = sheets.worksheet(sheets.voucher_worksheet).get_all_values()
+            for items in rows[1:]:
+                code, student_id, email, claimed_at = (items + [""] * 4)[:4]
+                code, student_id = code.strip(), student_id.strip()
+                if not code:
+                    continue
+                vouchers.setdefault(code, (None, None, None))
+                if (
+                    student_id
+                    and student_id not in students
+                    and vouchers[code][0] is None
+                ):
+                    students.add(student_id)
+                    vouchers[code] = (student_id, email, claimed_at)
+
+        feedback_rows = [
+            (student_id, section, original, alternate)
+            for student_id, sections in feedbackSections(feedback).items()
+            for section, (original, alternate) in enumerate(sections)
+        ]
+
+        with self.lock:
+            self.connection.execute("BEGIN")
+            for table in ("logins", "roster", "feedback", "vouchers"):
+                self.connection.execute("DELETE FROM " + table)
+            self.connection.executemany(
+                "INSERT INTO logins VALUES (?, ?, ?, ?, ?)",
+                [
+                    (row_number, *(items + [""] * 4)[:4])
+                    for row_number, items in enumerate(logins, start=1)
+                ],
+            )
+            self.connection.executemany(
+                "INSERT INTO roster VALUES ({})".format(", ".join(["?"] * 17)),
+                [
+                    (row_number, *(items + [""] * 16)[:16])
+                    for row_number, items in enumerate(roster, start=1)
+                ],
+            )
+            self.connection.executemany(
+                "INSERT INTO feedback VALUES (?, ?, ?, ?)", feedback_rows
+            )
+            self.connection.executemany(
+                "INSERT INTO vouchers VALUES (?, ?, ?, ?)",
+                [(code, *claim) for code, claim in vouchers.items()],
+            )
+            self.connection.execute("COMMIT")
+        return len(logins), len(roster), len(feedback_rows)
+
+    # write the logins, the roster with the results and the vouchers back to Google Sheets,
+    # one update per worksheet
+    def export_to(self, sheets):
+        logins = [
+            ["" if value is None else value for value in row]
+            for row in self.query(
+                "SELECT email, student_id, login_time, condition FROM logins ORDER BY row"
+            )
+        ]
+        roster = [
+            ["" if value is None else value for value in row]
+            for row in self.query(
+                "SELECT voucher, {} FROM roster ORDER BY row".format(
+                    ", ".join(result_columns)
+                )
+            )
+        ]
+        vouchers = [
+            ["" if value is None else value for value in row]
+            for row in self.query(
+                "SELECT code, student_id, email, claimed_at FROM vouchers ORDER BY code"
+            )
+        ]
+        if vouchers and sheets.voucher_worksheet is not None:
+            sheets.worksheet(sheets.voucher_worksheet).update(
+                "A2:D{}".format(len(vouchers) + 1), vouchers
+            )
+        if logins:
+            sheets.worksheet(sheets.login_worksheet).update(
+                "A1:D{}".format(len(logins)), logins
+            )
+        if roster:
+            sheets.worksheet(sheets.data_worksheet).update(
+                "A1:P{}".format(len(roster)), roster
+            )
+        return len(logins), len(roster)
+
+
+# a worksheet setting is its title, or its index in the tab order when it is a number
+def worksheetSetting(name, default=None):
+    value = os.environ.get(name) or default
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return value
+
+
+def openSheetsStorage(writers=True):
+    return SheetsStorage(
+        getGoogleService(),
+        os.environ.get("google_sheet"),
+        login_worksheet=worksheetSetting("login_worksheet", 0),
+        data_worksheet=worksheetSetting("data_worksheet", 1),
+        feedback_worksheet=worksheetSetting("feedback_worksheet", 2),
+        roster_ttl=int(os.environ.get("roster_ttl_seconds", 300)),
+        feedback_version=os.environ.get("feedback_version", "1"),
+        login_batch_size=int(os.environ.get("login_batch_size", 50)),
+        login_flush_seconds=float(os.environ.get("login_flush_seconds", 2)),
+        voucher_worksheet=worksheetSetting("voucher_worksheet"),
+        shared_cache=openSharedCache(),
+        journal_path=os.environ.get("journal_path") or None,
+        voucher_db_path=os.environ.get("voucher_db_path") or "vouchers.db",
+        writers=writers,
+    )
+
+
+shared_caches = {}
+shared_caches_lock = threading.Lock()
+
+
+# shared_cache_path is the sqlite file of the cache shared by the processes, empty turns it off.
+# one instance per file in the process
+def openSharedCache():
+    path = os.environ.get("shared_cache_path", "shared_cache.db")
+    if not path:
+        return None
+    with shared_caches_lock:
+        if path not in shared_caches:
+            shared_caches[path] = SharedCache(path)
+        return shared_caches[path]
+
+
+def openSqliteStorage():
+    return SqliteStorage(os.environ.get("sqlite_path") or "survey.db")
+
+
+# storage_backend selects the backend the app runs on, "sheets" (default) or "sqlite".
+# the admin commands open it without writers, see SheetsStorage
+def openStorage(writers=True):
+    if os.environ.get("storage_backend", "sheets").lower() == "sqlite":
+        return openSqliteStorage()
+    return openSheetsStorage(writers)
+
+
+# python Storage.py import   copies Google Sheets into the sqlite file
+# python Storage.py export   writes the logins and results in the sqlite file back to Google Sheets
+# python Storage.py replay   writes the journal entries left by stopped app processes to Google Sheets
+if __name__ == "__main__":
+    load_dotenv()
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+
+    if command == "import":
+        logins, roster, feedback = openSqliteStorage().import_from(
+            openSheetsStorage(writers=False)
+        )
+        print(
+            "Imported {} login rows, {} roster rows and {} feedback sections".format(
+                logins, roster, feedback
+            )
+        )
+    elif command == "export":
+        logins, roster = openSqliteStorage().export_to(openSheetsStorage(writers=False))
+        print("Exported {} login rows and {} roster rows".format(logins, roster))
+    elif command == "replay":
+        journal = openSheetsStorage().journal
+        if journal is None:
+            print("journal_path is not set")
+            sys.exit(1)
+        # the journal took over the files of journal_path no running process holds
+        pending = journal.drain(split=True)
+        print("{} journal entries left in {}".format(pending, journal.path))
+        sys.exit(1 if pending else 0)
+    else:
+        print("usage: python Storage.py import|export|replay")
+        sys.exit(1)
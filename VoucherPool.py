@@ -0,0 +1,285 @@
+import atexit, os, sqlite3, threading, time
+
+# latency histograms and the /metrics route
+import Metrics
+
+
+# hands out voucher codes, reserving each one in a local sqlite file shared by all app processes
+# of the node before it is returned. A claim is one BEGIN IMMEDIATE transaction taking the first
+# unclaimed code, so two processes never hand out the same code, and a code stays taken after a
+# crash. The student ID is unique in the file, a student asking again gets the same code.
+# load() returns the codes of the voucher sheet in order and the claims recorded there as
+# {student_id: code}. It fills the file on the first claim of the process and again when no code
+# is left, e.g. after codes were added. Claims are handed to persist(rows) by a background thread
+# in batches of [code, student_id, email, claimed_at] rows and marked in the file once written,
+# so claims a crashed process never wrote are written by the next one.
+# the file belongs to one voucher sheet, and the codes of the sheet are handed out by one node
+class VoucherPool:
+    def __init__(
+        self,
+        path,
+        load,
+        persist,
+        batch_size=50,
+        flush_interval=2.0,
+        reload_seconds=60,
+        writer_seconds=300,
+    ):
+        self.load = load
+        self.persist = persist
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.reload_seconds = reload_seconds
+        self.writer_seconds = writer_seconds
+        self.writer = "{}:{}".format(os.getpid(), id(self))
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.counters_lock = threading.Lock()
+        self.loaded_at = None
+        self.wake = threading.Event()
+        self.counters = {
+            "claimed": 0,
+            "repeated": 0,
+            "exhausted": 0,
+            "persisted": 0,
+            "persist_failures": 0,
+        }
+
+        self.connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS vouchers (
+                code TEXT PRIMARY KEY, position INTEGER, student_id TEXT UNIQUE, email TEXT,
+                claimed_at TEXT, persisted INTEGER NOT NULL DEFAULT 0, writer TEXT,
+                writing_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS vouchers_unclaimed ON vouchers (position)
+                WHERE student_id IS NULL;
+            CREATE INDEX IF NOT EXISTS vouchers_unpersisted ON vouchers (claimed_at)
+                WHERE student_id IS NOT NULL AND persisted = 0;
+            """)
+
+        self.thread = threading.Thread(
+            target=self.run, name="voucher-pool", daemon=True
+        )
+        self.thread.start()
+        # claims of earlier runs that were never written go out with the first batch
+        self.wake.set()
+        # claims still waiting are written before the process exits
+        atexit.register(self.flush)
+        Metrics.registerCollector(self.collect)
+
+    def transaction(self, function):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = function()
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+        return result
+
+    # adds the codes and claims of the sheet to the file. Codes already there keep their state,
+    # a claim made here and not written yet is kept over the sheet
+    def reload(self):
+        with self.load_lock:
+            self.loadCodes()
+
+    # a failed read counts as a load too, so the sheet is not read again before reload_seconds
+    def loadCodes(self):
+        self.loaded_at = time.monotonic()
+        codes, claims = self.load()
+
+        def merge():
+            (position,) = self.connection.execute(
+                "SELECT COALESCE(MAX(position), 0) FROM vouchers"
+            ).fetchone()
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO vouchers (code, position) VALUES (?, ?)",
+                [
+                    (code, position + number)
+                    for number, code in enumerate(codes, start=1)
+                ],
+            )
+            for student_id, code in claims.items():
+                self.connection.execute(
+                    "UPDATE OR IGNORE vouchers SET student_id = ?, persisted = 1 WHERE code = ? AND student_id IS NULL",
+                    (student_id, code),
+                )
+                # a code claimed on the sheet is never handed out here, even when the student
+                # holds another code in the file
+                self.connection.execute(
+                    "DELETE FROM vouchers WHERE code = ? AND student_id IS NULL",
+                    (code,),
+                )
+
+        self.transaction(merge)
+        self.loaded_at = time.monotonic()
+
+    # loads the codes, a failure leaves the claims to the codes already in the file
+    def tryLoad(self, load):
+        try:
+            load()
+        except Exception as e:
+            print("Loading the voucher codes failed: {}".format(e))
+
+    # loads the codes ahead of the first claim
+    def preload(self):
+        if self.loaded_at is None:
+            with self.load_lock:
+                if self.loaded_at is None:
+                    self.loadCodes()
+
+    # the code the student holds, or the next free one reserved for them. (code or None, repeated)
+    def reserve(self, student_id, email):
+        def take():
+            row = self.connection.execute(
+                "SELECT code FROM vouchers WHERE student_id = ?", (student_id,)
+            ).fetchone()
+            if row is not None:
+                return row[0], True
+            row = self.connection.execute(
+                "SELECT code FROM vouchers WHERE student_id IS NULL ORDER BY position LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None, False
+            self.connection.execute(
+                "UPDATE vouchers SET student_id = ?, email = ?, claimed_at = ? WHERE code = ?",
+                (student_id, email, time.strftime("%d/%m/%Y %H:%M:%S"), row[0]),
+            )
+            return row[0], False
+
+        return self.transaction(take)
+
+    # the code of the student, claiming the next free one on the first call.
+    # returns False when the pool is empty
+    def claim(self, student_id, email):
+        self.tryLoad(self.preload)
+        code, repeated = self.reserve(student_id, email)
+        if code is None and time.monotonic() - self.loaded_at >= self.reload_seconds:
+            self.tryLoad(self.reload)
+            code, repeated = self.reserve(student_id, email)
+
+        with self.counters_lock:
+            if code is None:
+                self.counters["exhausted"] += 1
+                return False
+            self.counters["repeated" if repeated else "claimed"] += 1
+        if not repeated:
+            self.wake.set()
+        return code
+
+    # marks up to batch_size unwritten claims as written by this process and returns them. The
+    # claims of a writer that went quiet for writer_seconds are taken over
+    def takeClaims(self):
+        def take():
+            self.connection.execute(
+                """UPDATE vouchers SET writer = ?, writing_at = ? WHERE code IN (
+                    SELECT code FROM vouchers WHERE student_id IS NOT NULL AND persisted = 0
+                    AND (writer IS NULL OR writer = ? OR writing_at < ?)
+                    ORDER BY claimed_at LIMIT ?)""",
+                (
+                    self.writer,
+                    time.time(),
+                    self.writer,
+                    time.time() - self.writer_seconds,
+                    self.batch_size,
+                ),
+            )
+            return [
+                list(row)
+                for row in self.connection.execute(
+                    "SELECT code, student_id, email, claimed_at FROM vouchers WHERE writer = ? AND persisted = 0 AND student_id IS NOT NULL",
+                    (self.writer,),
+                )
+            ]
+
+        return self.transaction(take)
+
+    def markPersisted(self, rows):
+        with self.lock:
+            self.connection.executemany(
+                "UPDATE vouchers SET persisted = 1 WHERE code = ?",
+                [(row[0],) for row in rows],
+            )
+
+    def run(self):
+        while True:
+            # the claims of crashed processes are looked for now and then
+            self.wake.wait(self.writer_seconds)
+            self.wake.clear()
+            # wait a little so the claims of a burst end up in the same request
+            time.sleep(self.flush_interval)
+            while True:
+                rows = self.takeClaims()
+                if not rows:
+                    break
+                self.write(rows)
+
+    # write the claims waiting right now, without waiting for the background thread
+    def flush(self):
+        rows = self.takeClaims()
+        if rows:
+            self.write(rows, retries=3)
+
+    # failed writes are retried with backoff, the claims stay unwritten in the file until then
+    def write(self, rows, retries=None):
+        delay = 1
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self.persist(rows)
+                self.markPersisted(rows)
+                with self.counters_lock:
+                    self.counters["persisted"] += len(rows)
+                return
+            except Exception as e:
+                with self.counters_lock:
+                    self.counters["persist_failures"] += 1
+                if retries is not None and attempt >= retries:
+                    print("Recording {} voucher claims failed: {}".format(len(rows), e))
+                    return
+                print(
+                    "Recording voucher claims failed, retrying in {}s: {}".format(
+                        delay, e
+                    )
+                )
+                time.sleep(delay)
+                delay = min(delay * 2, 60)
+
+    # the counters as Prometheus counter and gauge families
+    def collect(self):
+        with self.counters_lock:
+            counters = dict(self.counters)
+        with self.lock:
+            available, pending = self.connection.execute(
+                """SELECT COALESCE(SUM(student_id IS NULL), 0),
+                COALESCE(SUM(student_id IS NOT NULL AND persisted = 0), 0) FROM vouchers"""
+            ).fetchone()
+        return [
+            (
+                "survey_vouchers_available",
+                "gauge",
+                "Unclaimed voucher codes in the pool",
+                [([], available)],
+            ),
+            (
+                "survey_vouchers_pending",
+                "gauge",
+                "Voucher claims waiting to be written",
+                [([], pending)],
+            ),
+        ] + [
+            (
+                "survey_vouchers_{}_total".format(counter),
+                "counter",
+                "Voucher pool {}".format(counter.replace("_", " ")),
+                [([], value)],
+            )
+            for counter, value in counters.items()
+        ]
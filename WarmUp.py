@@ -0,0 +1,53 @@
+import threading, time
+
+# latency histograms and the /metrics route
+import Metrics
+
+
+# opens the storage on a background thread when the process boots, then preloads what the first
+# students would otherwise wait for: the service account, the worksheet handles, the roster, the
+# feedback and the voucher pool (see Storage.warmUpSteps). The first page renders meanwhile,
+# storage() only waits until the storage is opened. Each step is timed into the startup report
+class WarmUp:
+    def __init__(self, open_storage, preload=True):
+        self.open_storage = open_storage
+        self.preload = preload
+        self.started = time.perf_counter()
+        self.opened = threading.Event()
+        self.value = None
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name="warm-up", daemon=True)
+        self.thread.start()
+
+    def step(self, name, function):
+        start = time.perf_counter()
+        result = function()
+        Metrics.recordStartup(name, time.perf_counter() - start)
+        return result
+
+    def run(self):
+        try:
+            self.value = self.step("storage", self.open_storage)
+        except Exception as e:
+            self.error = e
+            print("Opening the storage failed: {}".format(e))
+            return
+        finally:
+            self.opened.set()
+
+        if self.preload:
+            for name, function in self.value.warmUpSteps():
+                try:
+                    self.step(name, function)
+                except Exception as e:
+                    # the sessions load it again when they need it
+                    print("Warm-up step {} failed: {}".format(name, e))
+        Metrics.recordStartup("warm_up", time.perf_counter() - self.started)
+        print("Startup: {}".format(Metrics.startupReport()))
+
+    # the opened storage, raises the error of opening it
+    def storage(self):
+        self.opened.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
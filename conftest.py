@@ -0,0 +1,31 @@
+import multiprocessing
+
+import pytest
+
+# the tests of the guarantees the app processes of a node rely on run their workers in separate
+# processes sharing the files like the app does. python -m pytest -q next to Benchmark.py
+
+spawn = multiprocessing.get_context("spawn")
+
+
+# runs worker(*args, number, barrier, results) in processes started at the same time, each puts
+# one result. Returns the results in the order they came in
+def startProcesses(worker, processes, *args):
+    barrier = spawn.Barrier(processes)
+    results = spawn.Queue()
+    started = [
+        spawn.Process(target=worker, args=args + (number, barrier, results))
+        for number in range(processes)
+    ]
+    for process in started:
+        process.start()
+    collected = [results.get(timeout=60) for process in started]
+    for process in started:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+    return collected
+
+
+@pytest.fixture
+def runProcesses():
+    return startProcesses
@@ -0,0 +1,47 @@
+import collections
+
+from ConditionAssigner import ConditionAssigner
+
+
+def assignConditions(path, assignments, number, barrier, results):
+    assigner = ConditionAssigner(path, ["a", "b", "c"], seed="test")
+    barrier.wait()
+    results.put(
+        [
+            assigner.assign("p{}-{}".format(number, student))
+            for student in range(assignments)
+        ]
+    )
+    assigner.flush()
+
+
+# every process uses up whole blocks of 6, so 3 x 1998 assignments split exactly 1998 each
+def test_conditions_stay_balanced_across_processes(tmp_path, runProcesses):
+    assigned = runProcesses(assignConditions, 3, str(tmp_path / "conditions.db"), 1998)
+
+    counts = collections.Counter(
+        condition for conditions in assigned for condition in conditions
+    )
+    assert counts == {"a": 1998, "b": 1998, "c": 1998}
+
+
+# a process stops in the middle of a block, each leaves at most one block unbalanced
+def test_conditions_stay_within_a_block_per_process(tmp_path, runProcesses):
+    assigned = runProcesses(assignConditions, 3, str(tmp_path / "conditions.db"), 2000)
+
+    counts = collections.Counter(
+        condition for conditions in assigned for condition in conditions
+    )
+    assert sum(counts.values()) == 6000
+    assert max(counts.values()) - min(counts.values()) <= 3 * 6
+
+
+def test_a_student_keeps_the_first_condition(tmp_path):
+    path = str(tmp_path / "conditions.db")
+    assigner = ConditionAssigner(path, ["a", "b"])
+    condition = assigner.assign("student")
+    assert all(assigner.assign("student") == condition for attempt in range(10))
+    assigner.flush()
+
+    # a restarted process reads the assignments back from the file
+    assert ConditionAssigner(path, ["a", "b"]).assign("student") == condition
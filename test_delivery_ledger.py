@@ -0,0 +1,56 @@
+import time
+
+from DeliveryLedger import DeliveryLedger
+
+
+def claimVoucherEmail(path, number, barrier, results):
+    ledger = DeliveryLedger(path)
+    barrier.wait()
+    results.put(ledger.claim("40000001", "voucher", expire_seconds=900))
+
+
+# sessions of several processes on the voucher page at once, one of them sends the email
+def test_a_claim_is_exclusive_across_processes(tmp_path, runProcesses):
+    claims = runProcesses(claimVoucherEmail, 4, str(tmp_path / "ledger.db"))
+    assert sorted(claims) == [False, False, False, True]
+
+
+def test_a_claim_left_queued_is_taken_over_once_expired(tmp_path):
+    ledger = DeliveryLedger(str(tmp_path / "ledger.db"))
+    assert ledger.claim("40000001", "voucher", expire_seconds=900)
+    assert not ledger.claim("40000001", "voucher", expire_seconds=900)
+
+    # the process holding the claim died before sending
+    time.sleep(0.1)
+    assert ledger.claim("40000001", "voucher", expire_seconds=0.05)
+    assert not ledger.claim("40000001", "voucher", expire_seconds=900)
+    assert ledger.status("40000001", "voucher") == "queued"
+
+
+def test_a_released_claim_can_be_claimed_again(tmp_path):
+    ledger = DeliveryLedger(str(tmp_path / "ledger.db"))
+    assert ledger.claim("40000001", "voucher")
+    # the outbox gave up on the email
+    ledger.recordOutcome("40000001", "voucher")(False)
+    assert ledger.status("40000001", "voucher") is None
+    assert ledger.claim("40000001", "voucher")
+
+
+def test_sent_is_final(tmp_path):
+    ledger = DeliveryLedger(str(tmp_path / "ledger.db"))
+    assert ledger.claim("40000001", "voucher")
+    ledger.recordOutcome("40000001", "voucher")(True)
+    time.sleep(0.1)
+
+    assert not ledger.claim("40000001", "voucher", expire_seconds=0)
+    # a late failure of another attempt doesn't undo it
+    ledger.release("40000001", "voucher")
+    assert ledger.status("40000001", "voucher") == "sent"
+    assert ledger.students("voucher", "sent") == ["40000001"]
+
+
+def test_claims_are_per_student_and_message(tmp_path):
+    ledger = DeliveryLedger(str(tmp_path / "ledger.db"))
+    assert ledger.claim("40000001", "voucher")
+    assert ledger.claim("40000002", "voucher")
+    assert ledger.claim("40000001", "bulk:reminder-1")
@@ -0,0 +1,122 @@
+import json, os, time
+
+import pytest
+
+from Journal import Journal
+
+
+def failingReplay(kind, entries, uncertain):
+    raise ConnectionError("sheets unavailable")
+
+
+# appends entries the sheets never get and exits without running the atexit handlers, like a
+# killed process
+def appendAndDie(path, number, barrier, results):
+    journal = Journal(path, failingReplay, flush_interval=60)
+    barrier.wait()
+    for entry in range(10):
+        journal.append("login", [number, entry])
+    results.put(journal.path)
+    results.close()
+    results.join_thread()
+    # the other process holds its journal file until both are done
+    barrier.wait()
+    os._exit(0)
+
+
+def test_journal_replays_the_files_of_stopped_processes(tmp_path, runProcesses):
+    path = str(tmp_path / "journal.jsonl")
+    files = runProcesses(appendAndDie, 2, path)
+    assert sorted(files) == [path, path + ".1"]
+
+    replayed = []
+
+    def replay(kind, entries, uncertain):
+        assert uncertain
+        replayed.extend(tuple(entry["data"]) for entry in entries)
+
+    journal = Journal(path, replay)
+    assert journal.drain() == 0
+    assert sorted(replayed) == [
+        (number, entry) for number in range(2) for entry in range(10)
+    ]
+    assert not os.path.exists(path + ".1")
+
+    # the acknowledgements are on disk, a restart replays nothing
+    replayed.clear()
+    journal.path_lock.close()
+    Journal(path, replay).drain()
+    assert replayed == []
+
+
+def test_journal_skips_a_line_cut_short(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    with open(path, "w") as f:
+        f.write(json.dumps({"id": "1", "kind": "login", "data": 1, "at": 0}) + "\n")
+        f.write('{"id": "2", "kind": "login", "da')
+
+    replayed = []
+    journal = Journal(path, lambda kind, entries, uncertain: replayed.extend(entries))
+    assert journal.drain() == 0
+    assert [entry["id"] for entry in replayed] == ["1"]
+
+
+# an entry the sheets always refuse is parked and the entries after it go through
+def test_journal_parks_an_entry_that_keeps_failing(tmp_path):
+    replayed = []
+
+    def replay(kind, entries, uncertain):
+        if any(entry["data"] == "poison" for entry in entries):
+            raise ValueError("invalid row")
+        replayed.extend(entry["data"] for entry in entries)
+
+    journal = Journal(
+        str(tmp_path / "journal.jsonl"),
+        replay,
+        flush_interval=0,
+        max_attempts=1,
+        park_seconds=60,
+    )
+    journal.append("login", "poison")
+    ids = [journal.append("login", number) for number in range(5)]
+
+    deadline = time.monotonic() + 30
+    while len(replayed) < len(ids) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    assert sorted(replayed) == list(range(5))
+    assert len(journal.parked) == 1
+    assert journal.drain(split=True) == 1
+
+
+# a failed compaction leaves the journal writable
+def test_journal_keeps_appending_after_a_failed_compaction(tmp_path):
+    journal = Journal(
+        str(tmp_path / "journal.jsonl"),
+        lambda kind, entries, uncertain: None,
+        compact_bytes=0,
+    )
+
+    def full():
+        raise OSError(28, "No space left on device")
+
+    journal.compact = full
+    journal.append("login", 1)
+    assert journal.drain() == 0
+    journal.append("login", 2)
+    assert journal.drain() == 0
+
+
+# a write that never finishes raises instead of holding up the student
+def test_journal_append_times_out(tmp_path):
+    journal = Journal(
+        str(tmp_path / "journal.jsonl"),
+        lambda kind, entries, uncertain: None,
+        append_timeout=0.5,
+    )
+    with journal.file_lock:
+        started = time.monotonic()
+        with pytest.raises(TimeoutError):
+            journal.append("login", 1)
+    assert time.monotonic() - started < 5
+    # the commit thread is still running and writes the next entries
+    journal.append("login", 2)
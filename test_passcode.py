@@ -0,0 +1,84 @@
+from Passcode import Passcodes
+
+# 30 minute windows, a code is accepted in its own window and the one after it
+start = 1800 * 1000
+
+
+def passcodes(secret="secret"):
+    return Passcodes(secret, window_minutes=30, windows=2)
+
+
+def test_a_code_is_accepted_for_passcode_windows():
+    codes = passcodes()
+    code = codes.issue("student@example.ac.uk", "40000001", now=start)
+    # the first and the last second of its own window and of the next one
+    for now in (start, start + 1799, start + 1800, start + 3599):
+        assert codes.verify("student@example.ac.uk", "40000001", code, now=now)
+
+
+def test_a_code_expires_after_passcode_windows():
+    codes = passcodes()
+    code = codes.issue("student@example.ac.uk", "40000001", now=start)
+    assert not codes.verify("student@example.ac.uk", "40000001", code, now=start + 3600)
+    # nor is it accepted before it was issued
+    assert not codes.verify("student@example.ac.uk", "40000001", code, now=start - 1)
+
+
+def test_a_code_sent_again_in_the_window_is_the_same():
+    codes = passcodes()
+    assert codes.issue("student@example.ac.uk", "40000001", now=start) == codes.issue(
+        "student@example.ac.uk", "40000001", now=start + 1799
+    )
+
+
+def test_case_and_whitespace_are_ignored():
+    codes = passcodes()
+    code = codes.issue(" Student@Example.ac.uk ", " 40000001 ", now=start)
+    assert codes.verify("student@example.ac.uk", "40000001", code, now=start)
+    assert codes.verify(
+        "STUDENT@example.ac.uk", "40000001", "  " + code.upper() + "\n", now=start
+    )
+
+
+def test_the_code_of_another_student_is_refused():
+    codes = passcodes()
+    code = codes.issue("student@example.ac.uk", "40000001", now=start)
+    assert not codes.verify("student@example.ac.uk", "40000002", code, now=start)
+    assert not codes.verify("other@example.ac.uk", "40000001", code, now=start)
+    assert not passcodes("other secret").verify(
+        "student@example.ac.uk", "40000001", code, now=start
+    )
+
+
+def test_malformed_codes_are_refused():
+    codes = passcodes()
+    for passcode in (None, "", "é" * 8, "0" * 8, "0" * 64):
+        assert not codes.verify(
+            "student@example.ac.uk", "40000001", passcode, now=start
+        )
+
+
+def test_resume_tokens_are_read_back():
+    codes = passcodes()
+    assert codes.readResumeToken(codes.resumeToken("nonce.with.dots")) == (
+        "nonce.with.dots"
+    )
+
+
+def test_tampered_and_foreign_resume_tokens_are_refused():
+    codes = passcodes()
+    token = codes.resumeToken("nonce")
+    nonce, signature = token.split(".")
+    tampered = [
+        "other." + signature,
+        nonce + "." + signature[:-1] + ("0" if signature[-1] != "0" else "1"),
+        nonce + "." + signature[:-1],
+        nonce,
+        "." + signature,
+        nonce + ".é",
+        "",
+        None,
+    ]
+    for token in tampered:
+        assert codes.readResumeToken(token) is None
+    assert passcodes("other secret").readResumeToken(codes.resumeToken("nonce")) is None
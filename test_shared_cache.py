@@ -0,0 +1,50 @@
+import time
+
+from SharedCache import SharedCache
+
+
+def loadShared(path, counter_path, number, barrier, results):
+    cache = SharedCache(path, poll_seconds=0.01)
+
+    def load():
+        with open(counter_path, "a") as f:
+            f.write("{}\n".format(number))
+        time.sleep(0.5)
+        return {"rows": [[1, 2, 3]]}
+
+    barrier.wait()
+    results.put(cache.getOrLoad("roster", load, ttl=60))
+
+
+def test_shared_cache_loads_once_across_processes(tmp_path, runProcesses):
+    counter_path = str(tmp_path / "loads")
+    values = runProcesses(loadShared, 4, str(tmp_path / "cache.db"), counter_path)
+
+    assert values == [{"rows": [[1, 2, 3]]}] * 4
+    with open(counter_path) as f:
+        assert len(f.readlines()) == 1
+
+
+def test_entries_expire_and_change_with_the_version(tmp_path):
+    cache = SharedCache(str(tmp_path / "cache.db"))
+    cache.set("roster", [1], ttl=60, version="1")
+    assert cache.get("roster", version="1") == [1]
+    assert cache.get("roster", version="2") is None
+    cache.set("feedback", [2], ttl=-1)
+    assert cache.get("feedback") is None
+
+
+# a loader that fails releases the lease, the next caller loads
+def test_a_failed_load_releases_the_lease(tmp_path):
+    cache = SharedCache(str(tmp_path / "cache.db"), lease_seconds=30)
+
+    def fail():
+        raise ConnectionError("sheets unavailable")
+
+    try:
+        cache.getOrLoad("roster", fail)
+    except ConnectionError:
+        pass
+    started = time.monotonic()
+    assert cache.getOrLoad("roster", lambda: [1]) == [1]
+    assert time.monotonic() - started < 5
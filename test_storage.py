@@ -0,0 +1,40 @@
+from SheetsEmulator import EmulatedClient
+from Storage import SheetsStorage, SqliteStorage
+
+sheet_url = "https://docs.google.com/spreadsheets/d/test"
+
+
+# a storage on the emulator with the given feedback sheet, without background writers
+def openSheets(feedback):
+    client = EmulatedClient()
+    client.create(
+        sheet_url,
+        [
+            ("logins", []),
+            ("data", [["voucher", "email", "student_id"]]),
+            ("feedback", feedback),
+        ],
+    )
+    return SheetsStorage(client, sheet_url, shared_cache=None, writers=False)
+
+
+sections = [
+    ["1001", "first original", "first alternate"],
+    ["1001", "second original", "second alternate"],
+]
+
+
+# the feedback sheet may or may not start with a heading, both layouts are kept by a merge
+def test_feedback_sheets_with_and_without_heading(tmp_path):
+    for heading in ([], [["student_id", "original", "alternate"]]):
+        sheets = openSheets(heading + sections)
+        assert "first original" in sheets.lookup_feedback("1001")["original"]
+        assert sheets.lookup_feedback("student_id") is None
+
+        sheets.store_feedback({"1002": [("new original", "new alternate")]})
+        rows = sheets.worksheet(2).get_all_values()
+        assert rows == heading + sections + [["1002", "new original", "new alternate"]]
+
+        sqlite = SqliteStorage(str(tmp_path / "survey{}.db".format(len(heading))))
+        assert sqlite.import_from(sheets)[2] == 3
+        assert "first original" in sqlite.lookup_feedback("1001")["original"]
@@ -0,0 +1,84 @@
+from VoucherPool import VoucherPool
+
+voucher_codes = ["CODE{:03d}".format(number) for number in range(100)]
+
+
+def claimVouchers(path, students, number, barrier, results):
+    pool = VoucherPool(
+        path, lambda: (voucher_codes, {}), lambda rows: None, flush_interval=0
+    )
+    barrier.wait()
+    results.put(
+        [
+            (student, pool.claim(student, student + "@example.ac.uk"))
+            for student in students
+        ]
+    )
+
+
+# two processes starting together used to hand out the first code of the sheet twice
+def test_voucher_codes_are_unique_across_processes(tmp_path, runProcesses):
+    path = str(tmp_path / "vouchers.db")
+    students = ["student{:03d}".format(number) for number in range(40)]
+    claims = runProcesses(claimVouchers, 2, path, students)
+
+    # both processes saw the same students, each student holds one code in both
+    first, second = [dict(claim) for claim in claims]
+    assert first == second
+    codes = list(first.values())
+    assert len(set(codes)) == len(students)
+    assert set(codes) == set(voucher_codes[: len(students)])
+
+
+def claimDifferentVouchers(path, number, barrier, results):
+    pool = VoucherPool(
+        path, lambda: (voucher_codes, {}), lambda rows: None, flush_interval=0
+    )
+    barrier.wait()
+    results.put(
+        [pool.claim("p{}-{}".format(number, student), "") for student in range(25)]
+    )
+
+
+def test_voucher_pool_runs_out_without_repeating_codes(tmp_path, runProcesses):
+    path = str(tmp_path / "vouchers.db")
+    claims = runProcesses(claimDifferentVouchers, 5, path)
+
+    codes = [code for claim in claims for code in claim if code is not False]
+    assert sorted(codes) == voucher_codes
+    assert sum(claim.count(False) for claim in claims) == 25
+
+
+def test_claims_are_written_and_kept_after_a_restart(tmp_path):
+    path = str(tmp_path / "vouchers.db")
+    written = []
+    pool = VoucherPool(
+        path,
+        lambda: (voucher_codes, {}),
+        written.extend,
+        flush_interval=0,
+    )
+    code = pool.claim("student", "student@example.ac.uk")
+    pool.flush()
+    # the background thread may have written it already
+    assert {tuple(row[:3]) for row in written} == {
+        (code, "student", "student@example.ac.uk")
+    }
+
+    # a claim of the sheet is never handed out again
+    restarted = VoucherPool(
+        path, lambda: (voucher_codes, {"other": "CODE001"}), written.extend
+    )
+    assert restarted.claim("student", "") == code
+    assert restarted.claim("next", "") == "CODE002"
+
+
+def test_a_failed_load_leaves_the_codes_in_the_file(tmp_path):
+    path = str(tmp_path / "vouchers.db")
+    VoucherPool(path, lambda: (voucher_codes, {}), lambda rows: None).preload()
+
+    def unavailable():
+        raise ConnectionError("sheets unavailable")
+
+    pool = VoucherPool(path, unavailable, lambda rows: None)
+    assert pool.claim("student", "") == "CODE000"